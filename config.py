@@ -35,9 +35,14 @@ def get_logger(name: str) -> logging.Logger:
 load_dotenv()
 
 _TM_API_KEY = os.getenv('TM_API_KEY')  # Tradermade API key
+_BAR_CACHE_URL = f'sqlite:///{_ROOT_DIR}/data/bars.sqlite'  # persistent OHLC bars downloaded from Tradermade
+_BAR_MINUTES = {'minute': 1, 'hourly': 60, 'daily': 24 * 60}  # minutes in a bar of period 1 of each interval
+_CONCURRENT_REQUESTS = True  # Tradermade high/low requests are sent concurrently, rate limited (see factory)
 
 # Trading classes constants
 _ORDER_TYPES = {'buy', 'sell'}
+_LOT_SIZE = 10 ** 5  # units of the base currency in a lot
+_CONTRACT_SIZES = {'XAU': 100, 'XAG': 5000, 'XPT': 100, 'XPD': 100}  # MT4 standard lot of metals (ounces)
 
 _METRICS_DF_KEYS = ['order', 'symbol', 'order_type', 'volume', 'open_time', 'close_time', 'delta_time', 'open_price',
                     'close_price', 'high', 'low', 'sl', 'tp', 'profit', 'max_possible_gain', 'max_possible_loss',
@@ -134,6 +139,22 @@ _INCOME_DROPDOWN_OPTIONS = [
     {'label': 'Day of week', 'value': 'day_of_week'}
 ]
 
+_DRIFT_KPI_OPTIONS = [
+    {'label': 'Win rate', 'value': 'win_rate'},
+    {'label': 'Expectancy', 'value': 'expectancy'},
+    {'label': 'Profit factor', 'value': 'profit_factor'},
+    {'label': 'Profit std', 'value': 'std_profit'},
+    {'label': 'Sharpe ratio (per trade)', 'value': 'sharpe_ratio'},
+    {'label': 'Max drawdown', 'value': 'max_drawdown'}
+]
+
+_DRIFT_WINDOW_OPTIONS = [
+    {'label': 'Last 50 trades', 'value': 50},
+    {'label': 'Last 200 trades', 'value': 200},
+    {'label': '30 days', 'value': '30D'},
+    {'label': '90 days', 'value': '90D'}
+]
+
 _COLORS = {
     'blue': 'rgb(0, 80, 250)',
     'red': 'rgb(255, 0, 0)',
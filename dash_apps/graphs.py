@@ -1,12 +1,15 @@
 from dash import dash, dcc, html, callback, dash_table
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 from data_classes.statistics_m import Metrics, metrics_between_dates
 from dash_graph_f.tables_functions import TradesDataTable
-from data_classes.factory import metrics_from_file
+from data_classes.factory import metrics_from_file, metrics_from_file_in_background, \
+    metrics_from_parser_in_background, BackgroundEnrichment
+from data_classes.mt4data import FileParser
+from data_classes.live import LiveMetrics
 from dash_graph_f.graph_high_low import CouldWinTrades, WonVsBestDiff, MetricsRadar
-from dash_graph_f.income import ScatterGraph, BarGraph, SunBurst, TimeOpenIncome
+from dash_graph_f.income import ScatterGraph, BarGraph, SunBurst, TimeOpenIncome, DriftGraph
 from config import _INCOME_DROPDOWN_OPTIONS, _BARS_DROPDOWN_OPTIONS, _METRICS_DROPDOWN_OPTIONS, \
-    _TIME_TYPE_OPTIONS, _TIME_TYPE_DICT, get_logger
+    _TIME_TYPE_OPTIONS, _TIME_TYPE_DICT, _DRIFT_KPI_OPTIONS, _DRIFT_WINDOW_OPTIONS, get_logger
 import pandas as pd
 import datetime as dt
 import pickle
@@ -15,11 +18,47 @@ with open('./data/cached_random_dict.pkl', 'rb') as f:
     rand_data = pickle.load(f)
 
 random_metric = Metrics(pd.DataFrame(rand_data), pd.DataFrame(), 'USD')
-rand_df = random_metric.df
+enrichment: BackgroundEnrichment | None = None  # running high/low enrichment of the loaded statement, if any
+live: LiveMetrics | None = None  # statement followed while it's exported again during the trading day, if any
+_ENRICHMENT_POLL_MS = 2000
+_LIVE_POLL_MS = 60_000
 app = dash.Dash()
 logger = get_logger(__name__)
 
 
+def load_statement(file_path: str, provider=None) -> None:
+    """Loads an MT4 statement to be displayed instead of the random data. Returns once the file is parsed,
+    trades high and low are completed in the background (see 'metrics_from_file_in_background')"""
+    global random_metric, enrichment, live
+    random_metric, enrichment = metrics_from_file_in_background(file_path, provider)
+    live = None
+
+
+def load_uploaded_statement(contents: str, provider=None) -> None:
+    """Same as 'load_statement' for the contents of a dcc.Upload ('data:<type>;base64,<data>')"""
+    global random_metric, enrichment, live
+    file_parser = FileParser.from_dash_upload(contents.split(',', 1)[-1])
+    random_metric, enrichment = metrics_from_parser_in_background(file_parser, provider)
+    live = None
+
+
+def follow_statement(file_path: str) -> None:
+    """Displays an MT4 statement that keeps being exported again: every '_LIVE_POLL_MS' only its new trades are
+    parsed and appended (see 'LiveMetrics'), and the figures are redrawn from the updated metrics"""
+    global random_metric, enrichment, live
+    live = LiveMetrics.from_file(file_path)
+    random_metric, enrichment = live.metrics, None
+
+
+def live_status() -> str:
+    """KPIs of the followed statement, updated per new trade (see 'OnlineKpis')"""
+    if live is None:
+        return ''
+    kpis = live.kpis
+    return (f'{kpis.n_of_trades} trades, net income {kpis.net_income:.2f}, win rate {kpis.win_rate:.0%}, '
+            f'max drawdown {kpis.max_drawdown:.2f}')
+
+
 def set_start_end_dates(base_df: pd.DataFrame) -> tuple[dt.datetime, dt.datetime]:
     """Returns tuple (min date, max date) of a metrics.df"""
     try:
@@ -40,6 +79,20 @@ def app_layout(start_date, end_date) -> dash.html.Div:
     """Create layout of graph's page. Start and end date will be the initial values of date picker range."""
     layout = html.Div([
         html.H1('Profit', style={'text-align': 'center'}),
+        dcc.Upload(
+            html.Div(['Drop or ', html.A('select'), ' an MT4 statement']),
+            id='statement upload',
+            style={'borderWidth': '1px', 'borderStyle': 'dashed', 'textAlign': 'center', 'padding': '10px'}
+        ),
+        html.Span(id='statement status'),
+        html.Div([
+            html.Progress(id='enrichment progress', value='1', max='1'),
+            html.Span(id='enrichment status', style={'margin-left': '10px'}),
+        ]),
+        dcc.Interval(id='enrichment interval', interval=_ENRICHMENT_POLL_MS,
+                     disabled=enrichment is None or enrichment.done),
+        html.Span(live_status(), id='live status'),
+        dcc.Interval(id='live interval', interval=_LIVE_POLL_MS, disabled=live is None),
         html.Br(),
         dcc.Dropdown(
             options=_METRICS_DROPDOWN_OPTIONS,
@@ -48,6 +101,7 @@ def app_layout(start_date, end_date) -> dash.html.Div:
         ),
         dcc.DatePickerRange(
             min_date_allowed=start_date,
+            max_date_allowed=end_date,
             start_date_placeholder_text=start_date,
             start_date=start_date,
             end_date=end_date,
@@ -81,6 +135,18 @@ def app_layout(start_date, end_date) -> dash.html.Div:
         ),
         dcc.Graph(id='time graph'),
         html.Br(),
+        dcc.Dropdown(
+            options=_DRIFT_KPI_OPTIONS,
+            value='expectancy',
+            id='drift kpi'
+        ),
+        dcc.Dropdown(
+            options=_DRIFT_WINDOW_OPTIONS,
+            value=50,
+            id='drift window'
+        ),
+        dcc.Graph(id='drift graph'),
+        html.Br(),
         dcc.Graph(id='box: could have won'),
         html.Br(),
         dcc.Graph(id='box: real vs max'),
@@ -104,8 +170,62 @@ def app_layout(start_date, end_date) -> dash.html.Div:
     return layout
 
 
-start, end = set_start_end_dates(rand_df)
-app.layout = app_layout(start_date=start, end_date=end)
+def serve_layout() -> dash.html.Div:
+    """Layout of the metrics displayed when the page is loaded (random data until a statement is loaded), the date
+    picker range covers all its trades"""
+    start_date, end_date = set_start_end_dates(random_metric.df)
+    return app_layout(start_date=start_date, end_date=end_date)
+
+
+app.layout = serve_layout
+
+
+@callback(
+    Output('statement status', 'children'),
+    [Input('statement upload', 'contents')],
+    [State('statement upload', 'filename')],
+    prevent_initial_call=True)
+def upload_statement(contents, filename):
+    """Loads an uploaded statement, figures depending on 'statement status' are redrawn from its metrics and the
+    high/low enrichment polling starts again"""
+    try:
+        load_uploaded_statement(contents)
+    except Exception as e:
+        logger.error(f"{__name__} failed to load uploaded statement {filename}: {e}")
+        return f'{filename} could not be loaded: {e}'
+    return f'{filename}: {len(random_metric.df)} trades'
+
+
+@callback(
+    [Output('date range', 'min_date_allowed'),
+     Output('date range', 'max_date_allowed'),
+     Output('date range', 'start_date'),
+     Output('date range', 'end_date'),
+     Output('date range', 'initial_visible_month')],
+    [Input('statement status', 'children'),
+     Input('live status', 'children')],
+    [State('date range', 'max_date_allowed'),
+     State('date range', 'end_date')],
+    prevent_initial_call=True)
+def update_date_range(_, __, max_date_allowed, selected_end_date):
+    """Date picker range of a newly loaded statement, covering all its trades. New trades of a followed statement
+    extend the range, the selected dates are kept unless the end date was the last one"""
+    start_date, end_date = set_start_end_dates(random_metric.df)
+    if dash.callback_context.triggered_id == 'statement status':
+        return start_date, end_date, start_date, end_date, end_date
+    following_end = selected_end_date is None or max_date_allowed is None or \
+        pd.Timestamp(selected_end_date) >= pd.Timestamp(max_date_allowed)
+    return (start_date, end_date, dash.no_update, end_date if following_end else dash.no_update,
+            dash.no_update)
+
+
+@callback(
+    Output('main', 'data'),
+    [Input('statement status', 'children'),
+     Input('live status', 'children')],
+    prevent_initial_call=True)
+def update_trades_table(_, __):
+    return TradesDataTable(random_metric).records
 
 
 @callback(
@@ -113,8 +233,6 @@ app.layout = app_layout(start_date=start, end_date=end)
      Output('bars graph', 'figure'),
      Output('sunburst', 'figure'),
      Output('time graph', 'figure'),
-     Output('box: could have won', 'figure'),
-     Output('box: real vs max', 'figure'),
      Output('kpi radar', 'figure')],
     [Input('metric dropdown', 'value'),
      Input('date range', 'start_date'),
@@ -122,8 +240,10 @@ app.layout = app_layout(start_date=start, end_date=end)
      Input('income dropdown', 'value'),
      Input('bars dropdown', 'value'),
      Input('time style', 'value'),
-     Input('radar option', 'value')])
-def update_charts(measure, start_date, end_date, subplots_choice, bars_choice, time_style, radar_choice):
+     Input('radar option', 'value'),
+     Input('statement status', 'children'),
+     Input('live status', 'children')])
+def update_charts(measure, start_date, end_date, subplots_choice, bars_choice, time_style, radar_choice, _, __):
 
     metrics_obj = metrics_between_dates(random_metric, start_date=start_date, end_date=end_date)
 
@@ -144,6 +264,38 @@ def update_charts(measure, start_date, end_date, subplots_choice, bars_choice, t
                                 title='Time open vs Income',
                                 **_TIME_TYPE_DICT[time_style]).get_figure()
 
+    radar = MetricsRadar(metrics_obj, radar_choice, title='KPI Radar').get_figure()
+
+    return [income_graph, bars_graph, sunburst, time_graph, radar]
+
+
+@callback(
+    Output('drift graph', 'figure'),
+    [Input('date range', 'start_date'),
+     Input('date range', 'end_date'),
+     Input('drift kpi', 'value'),
+     Input('drift window', 'value'),
+     Input('statement status', 'children'),
+     Input('live status', 'children')])
+def update_drift_graph(start_date, end_date, kpi, window, _, __):
+    """Rolling KPI of the trades closed in the date range, windows reach back before the start date"""
+    return DriftGraph(random_metric, window=window, kpi=kpi, title='Performance drift',
+                      start_date=start_date, end_date=end_date).get_figure()
+
+
+@callback(
+    [Output('box: could have won', 'figure'),
+     Output('box: real vs max', 'figure')],
+    [Input('date range', 'start_date'),
+     Input('date range', 'end_date'),
+     Input('income dropdown', 'value'),
+     Input('enrichment interval', 'n_intervals'),
+     Input('statement status', 'children'),
+     Input('live status', 'children')])
+def update_high_low_charts(start_date, end_date, subplots_choice, _, __, ___):
+    """Charts depending on trades high and low, redrawn on each enrichment poll until the enrichment is done"""
+    metrics_obj = metrics_between_dates(random_metric, start_date=start_date, end_date=end_date)
+
     could_win = CouldWinTrades(metrics_obj,
                                subplots_choice=subplots_choice,
                                title='Trades you could have won').get_figure()
@@ -151,6 +303,38 @@ def update_charts(measure, start_date, end_date, subplots_choice, bars_choice, t
                                 subplots_choice,
                                 title='Profit (won trades) vs Best Possible Result').get_figure()
 
-    radar = MetricsRadar(metrics_obj, radar_choice, title='KPI Radar').get_figure()
+    return [could_win, real_vs_max]
 
-    return [income_graph, bars_graph, sunburst, time_graph, could_win, real_vs_max, radar]
+
+@callback(
+    [Output('enrichment progress', 'value'),
+     Output('enrichment status', 'children'),
+     Output('enrichment interval', 'disabled')],
+    [Input('enrichment interval', 'n_intervals'),
+     Input('statement status', 'children')])
+def update_enrichment_progress(_, __):
+    """Shows the high/low enrichment progress, stops polling once it's done. Polling starts again when a statement
+    is loaded"""
+    if enrichment is None:
+        return '1', '', True
+    if enrichment.error is not None:
+        return str(enrichment.progress), f'High/low data incomplete: {enrichment.error}', True
+    if enrichment.done:
+        return '1', 'High/low data complete', True
+    return str(enrichment.progress), f'Loading high/low data {enrichment.progress:.0%}', False
+
+
+@callback(
+    [Output('live status', 'children'),
+     Output('live interval', 'disabled')],
+    [Input('live interval', 'n_intervals')])
+def update_live_metrics(_):
+    """Adds the new trades of the followed statement, KPIs are updated per new trade instead of rebuilt. The
+    figures depending on 'live status' are then redrawn from the appended metrics"""
+    global random_metric
+    if live is None:
+        return dash.no_update, True
+    if not live.refresh():
+        return dash.no_update, False  # nothing to redraw, polling goes on
+    random_metric = live.metrics
+    return live_status(), False
@@ -2,6 +2,7 @@ from config import get_logger, _COLORS, _PLOTLY_GRAPH_COLORS
 from data_classes.statistics_m import Metrics
 import plotly.graph_objects as go
 import pandas as pd
+import numpy as np
 
 logger = get_logger(__name__)
 _PLOTLY_GRAPH_TEMPLATE = 'plotly_dark'
@@ -187,8 +188,8 @@ class MetricsRadar(BoxGraph):
             # don't return a figure if there's only one metric object to plot. This radar uses normalized values
             # we cant normalize KPI if there's only one float value for each KPI
             return None
-        normed_kpi_df = self._normalized_kpi_df()
         real_kpi_df = self._create_kpi_df()
+        normed_kpi_df = self._normalized_kpi_df(real_kpi_df)
         # name : KPI metric identifier e.g. 'monday'. values: KPI values in _THETA_ACCESS for the given metrics object
         for idx, ((name, values), (name_2, real_vals)) in enumerate(zip(normed_kpi_df.items(), real_kpi_df.items())):
             r = values.to_list()
@@ -213,29 +214,27 @@ class MetricsRadar(BoxGraph):
         """Return string names for each subset"""
         return self._unique_df_ids
 
-    def _get_subplots_metrics(self) -> dict:
-        """gets metrics for all unique subplot dataframes"""
-        if self.subplots_choice:
-            return {key: Metrics(df, pd.DataFrame(), self.metrics.currency_symbol)
-                    for key, df in zip(self.unique_df_ids, self.dfs)}
-        else:
-            return {'all': self.metrics}
-
     def _create_kpi_df(self) -> pd.DataFrame:
         """creates a dataframe with columns as the unique subset identifiers (e.g. ['USDCAD', 'EURGBP',...]) and
-        index ['profit_factor', 'efficiency', 'n_of_trades', 'expectancy']."""
-        metrics = self._get_subplots_metrics()
-        kpis = {name: [getattr(metric, name) for metric in metrics.values()] for name in MetricsRadar._THETA_ACCESS}
-        kpi_df = pd.DataFrame(data=kpis.values(), index=list(kpis.keys()), columns=self.unique_df_ids)
+        index ['profit_factor', 'efficiency', 'n_of_trades', 'expectancy']. KPIs of all subsets are computed
+        together by 'Metrics.grouped_kpis'"""
+        if self.subplots_choice:
+            kpi_df = self.metrics.grouped_kpis(by=self.subplots_choice)[MetricsRadar._THETA_ACCESS].T
+        else:
+            kpi_df = pd.DataFrame({'all': [getattr(self.metrics, name) for name in MetricsRadar._THETA_ACCESS]},
+                                  index=MetricsRadar._THETA_ACCESS)
         logger.info(f'kpis:\n{kpi_df.head()}')
         return kpi_df
 
-    def _normalized_kpi_df(self) -> pd.DataFrame:
-        """returns normalized dataframe with columns as the unique subset identifiers (e.g. ['USDCAD', 'EURGBP',...])
-        and index ['profit_factor', 'efficiency', 'n_of_trades', 'expectancy']"""
-        kpi_df = self._create_kpi_df()
+    def _normalized_kpi_df(self, kpi_df: pd.DataFrame) -> pd.DataFrame:
+        """returns normalized copy of 'kpi_df', a dataframe with columns as the unique subset identifiers (e.g.
+        ['USDCAD', 'EURGBP',...]) and index ['profit_factor', 'efficiency', 'n_of_trades', 'expectancy']"""
+        kpi_df = kpi_df.astype('float64')
         for idx in kpi_df.index:
-            kpi_df.loc[idx] = normalize_data(kpi_df.loc[idx])
+            # subsets without losses (profit factor inf) are drawn as the best finite one
+            row = kpi_df.loc[idx]
+            finite = row[np.isfinite(row)]
+            kpi_df.loc[idx] = normalize_data(row.replace(np.inf, finite.max() if len(finite) else 1))
         logger.info(f"normalized kpis:\n{kpi_df.head().to_string()}")
         return kpi_df
 
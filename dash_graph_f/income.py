@@ -1,5 +1,6 @@
 from data_classes.statistics_m import Metrics
 from config import get_logger, _METRICS_DF_KEYS, _PLOTLY_GRAPH_TEMPLATE, _PLOTLY_GRAPH_COLORS, _COLORS
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
@@ -204,6 +205,60 @@ class TimeOpenIncome(ScatterGraph):
         )
 
 
+class DriftGraph:
+    """Performance drift: a KPI of the rolling window ending at each trade (see 'Metrics.rolling_kpis')"""
+    _MAX_POINTS = 5000  # windows plotted, evenly spaced, so long histories stay interactive
+
+    def __init__(self, metrics_obj: Metrics, window: int | str, kpi: str, title: str, start_date=None, end_date=None):
+        self.metrics = metrics_obj
+        self.window = window
+        self.kpi = kpi
+        self.start_date = start_date
+        self.end_date = end_date
+        self._fig = go.Figure(layout=self._layout(title))
+
+    @property
+    def fig(self) -> go.Figure:
+        """Returns figure."""
+        return self._fig
+
+    def get_figure(self) -> go.Figure:
+        """Returns a line figure of the rolling KPI by close time"""
+        kpis = self.metrics.rolling_kpis(self.window, start_date=self.start_date, end_date=self.end_date)
+        kpis = kpis.iloc[::max(len(kpis) // DriftGraph._MAX_POINTS, 1)]
+        self.fig.add_trace(go.Scatter(
+            x=kpis['close_time'],
+            y=kpis[self.kpi].replace([np.inf, -np.inf], np.nan),  # e.g. profit factor of windows without losses
+            customdata=kpis[['n_of_trades']],
+            mode='lines',
+            name=self.kpi,
+            hovertemplate='<b>%{y:,.2f}</b><br>Close date: %{x}<br>Trades in window: %{customdata[0]}<extra></extra>',
+            line=dict(
+                width=2,
+                color=_PLOTLY_GRAPH_COLORS[0]
+            )))
+        return self.fig
+
+    def _layout(self, title: str) -> dict:
+        """Returns layout dictionary for the drift figure"""
+        return dict(template=_PLOTLY_GRAPH_TEMPLATE,
+                    showlegend=False,
+                    title=dict(
+                        text=f'{title} ({self.window} window)',
+                        x=0.5,
+                        font=dict(
+                            color="#2C74B3",
+                            family="sans-serif",
+                            size=34
+                        )
+                    ),
+                    yaxis=dict(
+                        griddash='solid',
+                        zerolinecolor=_COLORS['translucent_grey'],
+                        separatethousands=True,
+                    ))
+
+
 class BarGraph:
     def __init__(self, metrics_obj: Metrics, subplots_choice: str, period: str):
         self.metrics = metrics_obj
@@ -36,10 +36,15 @@ class TradesDataTable:
             {'name': 'Cumulative Profit', 'id': 'cum_profit', 'type': 'numeric', 'format': money_formats}
         ]
 
+    @property
+    def records(self) -> list[dict]:
+        """Rows of the displayed columns, the other columns (e.g. timedeltas) can't be serialized to JSON"""
+        return self.df[[column['id'] for column in self.columns]].to_dict('records')
+
     def get_dash_table_component(self, table_id: str, page_size: int = 20) -> dash.dash_table:
         return dash_table.DataTable(
             id=table_id,
-            data=self.df.to_dict("records"),
+            data=self.records,
             columns=self.columns,
             page_size=page_size,
             style_data_conditional=
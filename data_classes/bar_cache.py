@@ -0,0 +1,131 @@
+from config import get_logger, _BAR_CACHE_URL, _BAR_MINUTES
+from sqlalchemy import Column, DateTime, Float, Integer, MetaData, String, Table, and_, create_engine, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+import datetime as dt
+import pandas as pd
+
+logger = get_logger(__name__)
+
+
+class BarCache:
+    """Persistent OHLC bar store (SQLite through SQLAlchemy). Bars are keyed by symbol, interval, period and
+    timestamp. Fetched time ranges are saved too (adjacent or overlapping ones merged), so a range without bars
+    (e.g. a weekend) is not requested again. Bars of a finer resolution can serve a coarser request, see
+    'covering_resolution'"""
+    _BAR_FIELDS = ['open', 'high', 'low', 'close']
+
+    def __init__(self, url: str = _BAR_CACHE_URL):
+        """url is a SQLAlchemy SQLite url e.g. 'sqlite:///data/bars.sqlite'"""
+        self._engine = create_engine(url, connect_args={'timeout': 30})
+        metadata = MetaData()
+        self._bars = Table(
+            'bars', metadata,
+            Column('symbol', String, primary_key=True),
+            Column('interval', String, primary_key=True),
+            Column('period', Integer, primary_key=True),
+            Column('date', DateTime, primary_key=True),
+            *[Column(field, Float) for field in BarCache._BAR_FIELDS]
+        )
+        self._ranges = Table(
+            'fetched_ranges', metadata,
+            Column('id', Integer, primary_key=True, autoincrement=True),
+            Column('symbol', String, index=True),
+            Column('interval', String),
+            Column('period', Integer),
+            Column('start', DateTime),
+            Column('end', DateTime)
+        )
+        metadata.create_all(self._engine)
+        logger.info(f"{__name__} bar cache at {url}")
+
+    def missing_ranges(self, symbol: str, interval: str, period: int,
+                       start: dt.datetime, end: dt.datetime) -> list[tuple[dt.datetime, dt.datetime]]:
+        """Returns the (start, end) sub ranges of [start, end] that haven't been fetched yet, sorted by start"""
+        ranges = self._ranges
+        query = select(ranges.c.start, ranges.c.end).where(and_(
+            ranges.c.symbol == symbol, ranges.c.interval == interval, ranges.c.period == period,
+            ranges.c.start <= end, ranges.c.end >= start
+        )).order_by(ranges.c.start)
+        with self._engine.connect() as connection:
+            fetched = connection.execute(query).all()
+        return BarCache._gaps(fetched, start, end)
+
+    def covering_resolution(self, symbol: str, interval: str, period: int,
+                            start: dt.datetime, end: dt.datetime) -> tuple[str, int] | None:
+        """Returns the coarsest (interval, period) fetched over the whole [start, end] whose bar length divides the
+        requested one, e.g. hourly bars of period 1 for a daily request: intervals and periods are chosen from the
+        trades age, so the same trades analysed again later ask for coarser bars than the cached ones, and finer
+        bars give the same or a tighter high and low. None if no such resolution covers the range"""
+        requested = _BAR_MINUTES[interval] * int(period)
+        ranges = self._ranges
+        query = select(ranges.c.interval, ranges.c.period, ranges.c.start, ranges.c.end).where(and_(
+            ranges.c.symbol == symbol, ranges.c.start <= end, ranges.c.end >= start
+        )).order_by(ranges.c.start)
+        with self._engine.connect() as connection:
+            fetched = connection.execute(query).all()
+
+        resolutions = {}
+        for fetched_interval, fetched_period, fetched_start, fetched_end in fetched:
+            minutes = _BAR_MINUTES.get(fetched_interval, 0) * fetched_period
+            if minutes and requested % minutes == 0:
+                resolutions.setdefault((minutes, fetched_interval, fetched_period), []).append(
+                    (fetched_start, fetched_end))
+        for minutes, fetched_interval, fetched_period in sorted(resolutions, reverse=True):
+            if not BarCache._gaps(resolutions[minutes, fetched_interval, fetched_period], start, end):
+                return fetched_interval, fetched_period
+        return None
+
+    def store(self, symbol: str, interval: str, period: int,
+              start: dt.datetime, end: dt.datetime, bars: pd.DataFrame) -> None:
+        """Saves 'bars' (a 'date' column and any of open, high, low, close) and marks [start, end] as fetched. The
+        fetched ranges of the same resolution overlapping or adjacent to it are merged into one"""
+        fields = [field for field in BarCache._BAR_FIELDS if field in bars.columns]
+        records = [
+            {'symbol': symbol, 'interval': interval, 'period': period, 'date': date.to_pydatetime(),
+             **{field: (None if pd.isna(value) else float(value)) for field, value in zip(fields, values)}}
+            for date, *values in zip(pd.to_datetime(bars['date']), *(bars[field] for field in fields))
+        ] if not bars.empty else []
+
+        with self._engine.begin() as connection:
+            if records:
+                statement = sqlite_insert(self._bars)
+                statement = statement.on_conflict_do_update(
+                    index_elements=['symbol', 'interval', 'period', 'date'],
+                    set_={field: statement.excluded[field] for field in fields}
+                )
+                connection.execute(statement, records)
+            ranges = self._ranges
+            touching = and_(ranges.c.symbol == symbol, ranges.c.interval == interval, ranges.c.period == period,
+                            ranges.c.start <= end, ranges.c.end >= start)
+            for fetched_start, fetched_end in connection.execute(select(ranges.c.start, ranges.c.end).where(touching)):
+                start, end = min(start, fetched_start), max(end, fetched_end)
+            connection.execute(ranges.delete().where(touching))
+            connection.execute(ranges.insert().values(
+                symbol=symbol, interval=interval, period=period, start=start, end=end))
+
+    def load(self, symbol: str, interval: str, period: int, start: dt.datetime, end: dt.datetime) -> pd.DataFrame:
+        """Returns cached bars with start <= date <= end, sorted by date"""
+        bars = self._bars
+        query = select(bars.c.date, *[bars.c[field] for field in BarCache._BAR_FIELDS]).where(and_(
+            bars.c.symbol == symbol, bars.c.interval == interval, bars.c.period == period,
+            bars.c.date >= start, bars.c.date <= end
+        )).order_by(bars.c.date)
+        with self._engine.connect() as connection:
+            rows = connection.execute(query).all()
+        return pd.DataFrame(rows, columns=['date'] + BarCache._BAR_FIELDS)
+
+    @staticmethod
+    def _gaps(fetched: list[tuple[dt.datetime, dt.datetime]], start: dt.datetime,
+              end: dt.datetime) -> list[tuple[dt.datetime, dt.datetime]]:
+        """Sub ranges of [start, end] not covered by 'fetched' (start, end) ranges sorted by start"""
+        gaps = []
+        cursor = start
+        for fetched_start, fetched_end in fetched:
+            if fetched_start > cursor:
+                gaps.append((cursor, fetched_start))
+            cursor = max(cursor, fetched_end)
+            if cursor >= end:
+                break
+        if cursor < end:
+            gaps.append((cursor, end))
+        return gaps
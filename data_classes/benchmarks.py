@@ -0,0 +1,395 @@
+from data_classes.mt4data import FileParser, TradeData, BarFileClient, RangeExtremaIndex
+from data_classes.statistics_m import Metrics
+from data_classes.fx_rates import contract_sizes
+from data_classes.resampling import MonteCarloSimulator
+from config import get_logger
+import numpy as np
+import pandas as pd
+import tempfile
+import time
+import tracemalloc
+import os
+
+logger = get_logger(__name__)
+
+_STATEMENT_HEADER = """<html>
+<body topmargin=1 marginheight=1>
+<table cellspacing=1 cellpadding=3 border=0>
+<tr align=left>
+    <td colspan=2><b>Account: 100000</b></td>
+    <td colspan=5><b>Name: Synthetic Account</b></td>
+    <td colspan=2><b>Currency: USD</b></td>
+    <td colspan=2><b>Leverage: <!--LEVERAGE--></b></td>
+    <td colspan=3 align=right><b>2025 June 12, 15:47</b></td></tr>
+
+<tr align=left><td colspan=14><b>Closed Transactions:</b></td></tr>
+<tr align=center bgcolor="#C0C0C0">
+   <td>Ticket</td><td nowrap>Open Time</td><td>Type</td><td>Size</td><td>Item</td>
+   <td>Price</td><td>S / L</td><td>T / P</td><td nowrap>Close Time</td>
+   <td>Price</td><td>Commission</td><td>Taxes</td><td>Swap</td><td>Profit</td></tr>
+<tr align=right><td title="deposit">1</td><td class=msdate nowrap>2020.01.01 00:00:00</td><td>balance</td><td colspan=10 align=left>deposit</td><td class=mspt>100 000.00</td></tr>
+"""
+_STATEMENT_FOOTER = """
+<tr align=right>
+    <td colspan=12 align=right><b>Closed P/L:</b></td>
+</tr>
+</table>
+</body>
+</html>
+"""
+_TRADE_ROW = '<tr align=right><td>{}</td><td class=msdate nowrap>{}</td><td>{}</td>' \
+             '<td class=mspt>{}</td><td>{}</td>' \
+             '<td style="mso-number-format:0\\.00000;">{}</td>' \
+             '<td style="mso-number-format:0\\.00000;">{}</td>' \
+             '<td style="mso-number-format:0\\.00000;">{}</td>' \
+             '<td class=msdate nowrap>{}</td>' \
+             '<td style="mso-number-format:0\\.00000;">{}</td>' \
+             '<td class=mspt>{}</td><td class=mspt>{}</td><td class=mspt>{}</td>' \
+             '<td class=mspt>{}</td></tr>'
+_SYMBOLS = ['eurusd', 'gbpusd', 'usdcad', 'usdjpy', 'audcad', 'usdchf']
+_STATEMENT_DATE_FORMAT = '%Y.%m.%d %H:%M:%S'
+
+
+def synthetic_trade_rows(n_trades: int, seed: int = 0) -> list[list[str]]:
+    """Returns 'n_trades' closed trade rows as 'FileParser.get_operations_info' returns them (lists of strings)"""
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2020-01-02T00:00:00')
+    open_times = start + np.sort(rng.integers(0, 3 * 365 * 24 * 3600, n_trades)).astype('timedelta64[s]')
+    close_times = open_times + rng.integers(60, 3 * 24 * 3600, n_trades).astype('timedelta64[s]')
+    open_prices = rng.uniform(0.8, 1.5, n_trades)
+    close_prices = open_prices * rng.uniform(0.99, 1.01, n_trades)
+    volumes = rng.integers(1, 100, n_trades) / 100
+    buys = rng.random(n_trades) < 0.5
+    profits = np.where(buys, 1, -1) * 10 ** 5 * volumes * (close_prices - open_prices)
+
+    columns = [
+        (10 ** 6 + np.arange(n_trades)).astype(str),
+        pd.Series(open_times).dt.strftime(_STATEMENT_DATE_FORMAT).to_numpy(),
+        np.where(buys, 'buy', 'sell'),
+        np.char.mod('%.2f', volumes),
+        np.array(_SYMBOLS)[rng.integers(0, len(_SYMBOLS), n_trades)],
+        np.char.mod('%.5f', open_prices),
+        np.full(n_trades, '0.00000'),
+        np.full(n_trades, '0.00000'),
+        pd.Series(close_times).dt.strftime(_STATEMENT_DATE_FORMAT).to_numpy(),
+        np.char.mod('%.5f', close_prices),
+        np.full(n_trades, '0.00'),
+        np.full(n_trades, '0.00'),
+        np.full(n_trades, '0.00'),
+        np.char.mod('%.2f', profits),
+    ]
+    return [list(row) for row in zip(*(column.tolist() for column in columns))]
+
+
+def synthetic_statement(n_trades: int, seed: int = 0) -> str:
+    """Returns an MT4 statement html string with 'n_trades' closed trades, written with the same layout
+    (one <tr> per line) MT4 uses for its reports"""
+    rows = [_TRADE_ROW.format(*row) for row in synthetic_trade_rows(n_trades, seed)]
+    return _STATEMENT_HEADER + '\n'.join(rows) + '\n' + _STATEMENT_FOOTER
+
+
+def _timed(func, *args, **kwargs) -> tuple[float, object]:
+    """Returns (elapsed seconds, result) of calling func(*args, **kwargs)"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def benchmark_tokenizer(n_trades: int = 20_000) -> dict:
+    """Rows per second of 'FileParser.get_operations_info' with the fast tokenizer and with BeautifulSoup.
+    Both parsers must return the same rows"""
+    statement = synthetic_statement(n_trades)
+    fast_time, fast_rows = _timed(FileParser(statement, fast_tokenizer=True).get_operations_info)
+    soup_time, soup_rows = _timed(FileParser(statement, fast_tokenizer=False).get_operations_info)
+    if fast_rows != soup_rows:
+        raise AssertionError("fast tokenizer rows differ from BeautifulSoup rows")
+
+    results = {
+        'rows': len(fast_rows),
+        'fast_rows_per_second': len(fast_rows) / fast_time,
+        'soup_rows_per_second': len(soup_rows) / soup_time,
+        'speedup': soup_time / fast_time,
+    }
+    logger.info(f"tokenizer benchmark: {results}")
+    return results
+
+
+def benchmark_trade_parsing(n_trades: int = 1_000_000) -> dict:
+    """Compares the per row trade parser ('TradeData._parse_trade') with the batch column parser
+    ('TradeData._create_trade_frame') on 'n_trades' synthetic rows"""
+    rows = synthetic_trade_rows(n_trades)
+    date_format = TradeData._HTML_DATE_SOURCE_FORMAT
+    batch_time, (frame, malformed) = _timed(TradeData._create_trade_frame, rows, date_format)
+    row_time, trades = _timed(lambda: [TradeData._parse_trade(row, date_format) for row in rows])
+    if len(frame) != len(trades) or malformed:
+        raise AssertionError("batch parser and per row parser returned a different number of trades")
+
+    results = {
+        'rows': n_trades,
+        'row_parser_seconds': row_time,
+        'batch_parser_seconds': batch_time,
+        'speedup': row_time / batch_time,
+    }
+    logger.info(f"trade parsing benchmark: {results}")
+    return results
+
+
+def _peak_memory(func, *args, **kwargs) -> tuple[int, object]:
+    """Returns (peak traced memory in bytes, result) of calling func(*args, **kwargs)"""
+    tracemalloc.start()
+    try:
+        result = func(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1], result
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_streaming_memory(n_trades: int = 200_000) -> dict:
+    """Peak memory of loading a statement file into a columnar TradeData, reading the whole file first
+    vs streaming it ('FileParser.from_filepath(stream=True)')"""
+    with tempfile.TemporaryDirectory() as directory:
+        filepath = os.path.join(directory, 'statement.htm')
+        with open(filepath, 'w') as f:
+            f.write(synthetic_statement(n_trades))
+
+        def load(stream: bool) -> TradeData:
+            return TradeData(FileParser.from_filepath(filepath, stream=stream), columnar=True)
+
+        read_peak, read_data = _peak_memory(load, False)
+        stream_peak, stream_data = _peak_memory(load, True)
+        file_size = os.path.getsize(filepath)
+    if not read_data.frame.equals(stream_data.frame):
+        raise AssertionError("streamed trades differ from the trades of the fully read statement")
+
+    results = {
+        'file_mb': file_size / 2 ** 20,
+        'frame_mb': float(stream_data.frame.memory_usage(deep=True).sum()) / 2 ** 20,
+        'read_peak_mb': read_peak / 2 ** 20,
+        'stream_peak_mb': stream_peak / 2 ** 20,
+    }
+    logger.info(f"streaming memory benchmark: {results}")
+    return results
+
+
+def write_synthetic_bar_files(directory: str, freq: str = 'h', seed: int = 0) -> None:
+    """Writes a '<SYMBOL>.csv' random walk bar file for every synthetic trade symbol, covering the synthetic
+    trades period with bars of 'freq' (a pandas frequency e.g. 'min' or 'h')"""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2020-01-01', '2023-01-10', freq=freq)
+    for symbol in _SYMBOLS:
+        close = 1 + np.cumsum(rng.normal(0, 1e-4, len(dates)))
+        spread = np.abs(rng.normal(0, 5e-4, (2, len(dates))))
+        pd.DataFrame({'date': dates, 'open': close, 'high': close + spread[0], 'low': close - spread[1],
+                      'close': close}).to_csv(os.path.join(directory, f'{symbol.upper()}.csv'), index=False)
+
+
+def benchmark_bar_file_enrichment(n_trades: int = 100_000) -> dict:
+    """Seconds taken by 'BarFileClient' to complete high and low of 'n_trades' columnar trades from H1 bar files"""
+    trade_data = TradeData(FileParser(synthetic_statement(n_trades)), columnar=True)
+    with tempfile.TemporaryDirectory() as directory:
+        write_synthetic_bar_files(directory)
+        client = BarFileClient(directory)
+        enrichment_time, _ = _timed(trade_data.complete_high_low, client)
+    frame = trade_data.frame
+    if (frame['high'] < frame['low']).any():
+        raise AssertionError("bar file enrichment returned a high lower than the low")
+
+    results = {
+        'trades': trade_data.n_of_trades,
+        'enrichment_seconds': enrichment_time,
+        'trades_per_second': trade_data.n_of_trades / enrichment_time,
+    }
+    logger.info(f"bar file enrichment benchmark: {results}")
+    return results
+
+
+def benchmark_range_extrema_index(n_bars: int = 1_500_000, n_queries: int = 1_000_000, seed: int = 0) -> dict:
+    """Build and query time of a 'RangeExtremaIndex' over 'n_bars' M1 bars (about 3 years), queried with
+    'n_queries' ranges of up to two days. A sample of the answers is checked against a scan of the bars"""
+    rng = np.random.default_rng(seed)
+    dates = np.datetime64('2020-01-01') + np.arange(n_bars).astype('timedelta64[m]')
+    highs, lows = rng.random(n_bars) + 1, rng.random(n_bars)
+    build_time, index = _timed(RangeExtremaIndex, dates, highs, lows)
+    first = rng.integers(0, n_bars, n_queries)
+    last = np.minimum(first + rng.integers(1, 2 * 24 * 60, n_queries), n_bars)
+    query_time, extremes = _timed(index.query_positions, first, last)
+    for i in rng.integers(0, n_queries, 100):
+        if extremes['high'][i] != highs[first[i]:last[i]].max() or extremes['low'][i] != lows[first[i]:last[i]].min():
+            raise AssertionError("range extrema index answer differs from a scan of the bars")
+
+    results = {
+        'bars': n_bars,
+        'queries': n_queries,
+        'build_seconds': build_time,
+        'query_seconds': query_time,
+        'queries_per_second': n_queries / query_time,
+    }
+    logger.info(f"range extrema index benchmark: {results}")
+    return results
+
+
+def synthetic_metrics_frame(n_trades: int, seed: int = 0) -> pd.DataFrame:
+    """Returns the forex trades frame of 'n_trades' synthetic trades, with high and low set around open and close
+    prices, ready to create a Metrics object"""
+    rng = np.random.default_rng(seed)
+    trade_data = TradeData(FileParser(synthetic_statement(n_trades, seed)), columnar=True)
+    frame = trade_data.forex_frame
+    prices = frame[['open_price', 'close_price']]
+    frame['high'] = prices.max(axis='columns') * rng.uniform(1, 1.01, len(frame))
+    frame['low'] = prices.min(axis='columns') * rng.uniform(0.99, 1, len(frame))
+    return frame
+
+
+def benchmark_metrics_columns(n_trades: int = 200_000) -> dict:
+    """Compares row by row max_possible_gain/loss and pips columns ('_row_max_gain', '_row_pips' through df.apply)
+    with the vectorized columns computed when a Metrics object is created. Both must be equal"""
+    frame = synthetic_metrics_frame(n_trades)
+    vectorized_time, metrics = _timed(Metrics, frame, pd.DataFrame(), 'USD')
+    df = metrics.df
+
+    def row_columns() -> pd.DataFrame:
+        return pd.DataFrame({
+            'max_possible_gain': df.apply(lambda row: round(_row_max_gain(metrics, row, False), 2), axis='columns'),
+            'max_possible_loss': df.apply(lambda row: round(_row_max_gain(metrics, row, True), 2), axis='columns'),
+            'pips': df.apply(_row_pips, axis='columns'),
+        })
+
+    row_time, columns = _timed(row_columns)
+    if not columns.equals(df[columns.columns]):
+        raise AssertionError("vectorized Metrics columns differ from the row by row columns")
+
+    results = {
+        'trades': len(df),
+        'metrics_init_seconds': vectorized_time,
+        'row_columns_seconds': row_time,
+        'speedup': row_time / vectorized_time,
+    }
+    logger.info(f"metrics columns benchmark: {results}")
+    return results
+
+
+def _row_max_gain(metrics: Metrics, row: pd.Series, max_loss: bool = False) -> float:
+    """Row by row reference of the max_possible_gain column (max_possible_loss for max_loss=True): the profit if
+    closed at the high (low for sells), the profit itself when that's less"""
+    limits = [row.high, row.low]
+    if max_loss:
+        limits.reverse()
+    gain = - 10 ** 100
+    if row.order_type == 'buy':
+        gain = _row_trade_profit(metrics, row, limits[0])
+    elif row.order_type == 'sell':
+        gain = _row_trade_profit(metrics, row, limits[1])
+    replaced = round(gain, 2) > round(row.profit, 2) if max_loss else round(gain, 2) < round(row.profit, 2)
+    return row.profit if replaced else gain
+
+
+def _row_trade_profit(metrics: Metrics, row: pd.Series, final_value: float) -> float:
+    """Row by row reference of the profit of a trade if closed at 'final_value'"""
+    lot = contract_sizes([row.base])[0]
+    sign = (-1) ** (row.order_type == 'sell')
+    if row.quote == metrics.currency:
+        return sign * lot * row.volume * (final_value - row.open_price)
+    elif row.base == metrics.currency:
+        return sign * lot * row.volume * (final_value - row.open_price) / final_value
+    rate = metrics.fx_rates.rates([row.quote], [row.close_time])[0]
+    if np.isnan(rate):
+        return row.profit
+    return sign * lot * row.volume * (final_value - row.open_price) * rate
+
+
+def _row_pips(row: pd.Series) -> int:
+    """Row by row reference of the pips column, a pip is 0.01 for JPY pairs and 0.0001 for other pairs"""
+    sign = (-1) ** (row.won_trade + 1) if isinstance(row.won_trade, (bool, np.bool_)) else 1
+    pip_factor = 100 if 'JPY' in row.symbol else 10 ** 4
+    return int(round(sign * pip_factor * abs(row.close_price - row.open_price), 0))
+
+
+def benchmark_kpi_range_index(n_trades: int = 100_000, n_windows: int = 100_000, seed: int = 0) -> dict:
+    """Build time of 'Metrics.kpi_index' over 'n_trades' trades and windows per second of 'Metrics.range_kpis' for
+    'n_windows' random date windows. A sample of windows is checked against Metrics objects of the filtered trades"""
+    rng = np.random.default_rng(seed)
+    metrics = Metrics(synthetic_metrics_frame(n_trades, seed), pd.DataFrame(), 'USD')
+    build_time, _ = _timed(lambda: metrics.kpi_index)
+    close_times = metrics.df.close_time
+    bounds = np.sort(rng.integers(0, len(close_times), (n_windows, 2)), axis=1)
+    starts, ends = close_times.to_numpy()[bounds[:, 0]], close_times.to_numpy()[bounds[:, 1]]
+    query_time, kpis = _timed(metrics.range_kpis, starts, ends)
+    for i in rng.integers(0, n_windows, 20):
+        window = metrics.df[(close_times >= starts[i]) & (close_times <= ends[i])].reset_index(drop=True)
+        window['cum_profit'] = window['profit'].cumsum()
+        expected = Metrics.view(window, pd.DataFrame(), 'USD')
+        for kpi in ('net_income', 'win_rate', 'expectancy', 'max_runup', 'max_drawdown'):
+            if not np.isclose(kpis[kpi][i], getattr(expected, kpi)):
+                raise AssertionError(f"kpi range index {kpi} differs from the Metrics of the window trades")
+
+    results = {
+        'trades': n_trades,
+        'windows': n_windows,
+        'build_seconds': build_time,
+        'query_seconds': query_time,
+        'windows_per_second': n_windows / query_time,
+    }
+    logger.info(f"kpi range index benchmark: {results}")
+    return results
+
+
+def benchmark_monte_carlo(n_trades: int = 50_000, n_simulations: int = 10_000, n_workers: int = 1) -> dict:
+    """Seconds to simulate 'n_simulations' reshuffled sequences of 'n_trades' trades with 'MonteCarloSimulator'.
+    Shuffled sequences keep the same final pnl, checked on every simulation"""
+    profits = synthetic_metrics_frame(n_trades).profit.to_numpy('float64')
+    simulator = MonteCarloSimulator(n_simulations, method='shuffle', seed=0, n_workers=n_workers)
+    seconds, result = _timed(simulator.simulate, profits)
+    if not np.allclose(result.final_pnl, profits.sum()):
+        raise AssertionError("shuffled trade sequences changed the final pnl")
+
+    results = {
+        'trades': n_trades,
+        'simulations': n_simulations,
+        'workers': n_workers,
+        'seconds': seconds,
+        'simulations_per_second': n_simulations / seconds,
+    }
+    logger.info(f"monte carlo benchmark: {results}")
+    return results
+
+
+def benchmark_statement_merge(trades_per_week: int = 2_000, n_weeks: int = 52) -> dict:
+    """Seconds per 'TradeData.merge' of 'n_weeks' overlapping statements (each one holds its week's trades and the
+    previous week's ones) into a TradeData of every week so far. Finding the new trades costs the same every week,
+    the frame of every trade is built again on each merge (compare first and last merge seconds)"""
+    rows = synthetic_trade_rows(trades_per_week * (n_weeks + 1))
+    statements = [_STATEMENT_HEADER + '\n'.join(_TRADE_ROW.format(*row) for row in
+                                                 rows[week * trades_per_week:(week + 2) * trades_per_week])
+                  + '\n' + _STATEMENT_FOOTER for week in range(n_weeks)]
+    trade_data = TradeData(FileParser(statements[0]), columnar=True)
+    merge_times = []
+    for statement in statements[1:]:
+        other = TradeData(FileParser(statement), columnar=True)
+        seconds, _ = _timed(trade_data.merge, other)
+        merge_times.append(seconds)
+    if trade_data.n_of_trades != len(rows) or trade_data.merge_conflicts:
+        raise AssertionError("merged statements lost trades or found conflicts in identical trades")
+
+    results = {
+        'weeks': n_weeks,
+        'trades': trade_data.n_of_trades,
+        'merge_seconds': sum(merge_times),
+        'first_merge_seconds': merge_times[0],
+        'last_merge_seconds': merge_times[-1],
+        'mean_merge_seconds': sum(merge_times) / len(merge_times),
+    }
+    logger.info(f"statement merge benchmark: {results}")
+    return results
+
+
+# Running this module as main runs every benchmark. Run it from the repository root: python -m data_classes.benchmarks
+if __name__ == '__main__':
+    benchmark_tokenizer()
+    benchmark_trade_parsing()
+    benchmark_streaming_memory()
+    benchmark_bar_file_enrichment()
+    benchmark_range_extrema_index()
+    benchmark_metrics_columns()
+    benchmark_kpi_range_index()
+    benchmark_monte_carlo()
+    benchmark_statement_merge()
@@ -0,0 +1,138 @@
+from config import get_logger
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+
+logger = get_logger(__name__)
+
+
+@dataclass(frozen=True)
+class RiskRatios:
+    """Annualized ratios of the daily time weighted returns of an account"""
+    sharpe_ratio: float
+    sortino_ratio: float
+    calmar_ratio: float
+    annual_return: float
+    max_drawdown_pct: float
+
+
+class EquityCurve:
+    """Account equity over time: trades (profit plus commission, taxes and swap, at close time) and balance
+    operations (deposits and withdrawals) merged into one sorted timeline, equity is its cumulative sum.
+    Returns of each trade are relative to the equity before it, so deposits and withdrawals are not returns.
+    Returns are undefined (and skipped) while equity is not positive, e.g. for trades before the first deposit"""
+    _TRADE_COSTS = ['commission', 'taxes', 'swap']
+    _DAYS_PER_YEAR = 365  # forex trades close on any day, daily equity is sampled on calendar days
+
+    def __init__(self, trades_df: pd.DataFrame, balance_df: pd.DataFrame):
+        """trades_df: Metrics.df like dataframe (close_time, profit and optionally commission, taxes, swap).
+        balance_df: dataframe of Balance objects (date, amount), may be empty"""
+        pnl = trades_df['profit'].to_numpy('float64').copy()
+        for column in EquityCurve._TRADE_COSTS:
+            if column in trades_df.columns:
+                pnl += np.nan_to_num(trades_df[column].to_numpy('float64'))
+        has_balances = not balance_df.empty and {'date', 'amount'} <= set(balance_df.columns)
+        flows = balance_df['amount'].to_numpy('float64') if has_balances else np.empty(0)
+        flow_times = balance_df['date'].to_numpy('datetime64[ns]') if has_balances else np.empty(0, 'datetime64[ns]')
+
+        # balance operations go before trades closed at the same time
+        times = np.concatenate([flow_times, trades_df['close_time'].to_numpy('datetime64[ns]')])
+        order = np.lexsort((np.repeat([0, 1], [len(flows), len(pnl)]), times))
+        curve = pd.DataFrame({
+            'time': times[order],
+            'flow': np.concatenate([flows, np.zeros(len(pnl))])[order],
+            'pnl': np.concatenate([np.zeros(len(flows)), pnl])[order],
+        })
+        curve['equity'] = (curve['flow'] + curve['pnl']).cumsum()
+        before = (curve['equity'] - curve['pnl']).to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            curve['return'] = np.where(before > 0, curve['pnl'] / before, 0)
+        curve['growth'] = (1 + curve['return']).cumprod()  # value of 1 invested at the start, flows excluded
+        curve['drawdown_pct'] = curve['growth'] / curve['growth'].cummax() - 1
+        self.curve = curve
+        self._daily = None
+
+    @property
+    def equity(self) -> pd.Series:
+        """Equity after each trade or balance operation, indexed by time"""
+        return self.curve.set_index('time')['equity']
+
+    @property
+    def daily(self) -> pd.DataFrame:
+        """Equity, growth and drawdown at the end of each calendar day (last event at or before it), and the daily
+        time weighted return. Computed once"""
+        if self._daily is None:
+            self._daily = self._resample_daily()
+        return self._daily
+
+    @property
+    def time_weighted_return(self) -> float:
+        """Compounded return of the trades over the whole period, independent of deposits and withdrawals"""
+        return float(self.curve['growth'].iat[-1] - 1) if len(self.curve) else 0.0
+
+    @property
+    def max_drawdown_pct(self) -> float:
+        """Largest fall of the time weighted growth from a previous peak, as a negative fraction"""
+        return float(self.curve['drawdown_pct'].min()) if len(self.curve) else 0.0
+
+    @property
+    def money_weighted_return(self) -> float:
+        """Annual internal rate of return of the account: the rate at which deposits and withdrawals, discounted
+        from their dates, equal the final equity. NaN if there are no deposits or the rate can't be bracketed"""
+        flows = self.curve[self.curve['flow'] != 0]
+        if flows.empty:
+            return np.nan
+        end = self.curve['time'].iat[-1]
+        years = (end - flows['time']).dt.total_seconds().to_numpy() / (EquityCurve._DAYS_PER_YEAR * 86400)
+        amounts = flows['flow'].to_numpy()
+        final_equity = self.curve['equity'].iat[-1]
+
+        def future_value(rate: float) -> float:
+            return float(np.sum(amounts * (1 + rate) ** years)) - final_equity
+
+        low, high = -0.9999, 1.0
+        while future_value(high) < 0 and high < 1e6:
+            high *= 10
+        if np.sign(future_value(low)) == np.sign(future_value(high)):
+            return np.nan
+        for _ in range(200):  # bisection, the future value of deposits grows with the rate
+            middle = (low + high) / 2
+            if (future_value(middle) < 0) == (future_value(low) < 0):
+                low = middle
+            else:
+                high = middle
+        return (low + high) / 2
+
+    @property
+    def risk_ratios(self) -> RiskRatios:
+        """Sharpe, Sortino and Calmar ratios (risk free rate 0) of the cached daily returns, in one pass"""
+        returns = self.daily['return'].to_numpy()[1:]  # the first day has no previous equity
+        n_days = len(returns)
+        if n_days < 2:
+            return RiskRatios(0.0, 0.0, 0.0, 0.0, self.max_drawdown_pct)
+        mean, std = returns.mean(), returns.std(ddof=1)
+        downside = np.sqrt(np.mean(np.minimum(returns, 0) ** 2))
+        annual_return = float(self.daily['growth'].iat[-1] ** (EquityCurve._DAYS_PER_YEAR / n_days) - 1)
+        max_drawdown_pct = self.max_drawdown_pct
+        annualize = np.sqrt(EquityCurve._DAYS_PER_YEAR)
+        return RiskRatios(
+            sharpe_ratio=float(mean / std * annualize) if std else 0.0,
+            sortino_ratio=float(mean / downside * annualize) if downside else 0.0,
+            calmar_ratio=annual_return / -max_drawdown_pct if max_drawdown_pct else 0.0,
+            annual_return=annual_return,
+            max_drawdown_pct=max_drawdown_pct,
+        )
+
+    def _resample_daily(self) -> pd.DataFrame:
+        """Samples the timeline at each day end with merge_asof, days without events keep the previous values"""
+        if self.curve.empty:
+            return pd.DataFrame(columns=['equity', 'growth', 'drawdown_pct', 'flow', 'return'])
+        first, last = self.curve['time'].iat[0].normalize(), self.curve['time'].iat[-1].normalize()
+        days = pd.DataFrame({'day': pd.date_range(first, last, freq='D')})
+        days['end'] = days['day'] + pd.Timedelta(days=1) - pd.Timedelta(1, 'ns')
+        daily = pd.merge_asof(days, self.curve[['time', 'equity', 'growth', 'drawdown_pct']],
+                              left_on='end', right_on='time', direction='backward')
+        daily['flow'] = self.curve.groupby(self.curve['time'].dt.normalize())['flow'].sum().reindex(
+            daily['day'], fill_value=0).to_numpy()
+        daily['return'] = daily['growth'].pct_change().fillna(0)
+        return daily.set_index('day')[['equity', 'growth', 'drawdown_pct', 'flow', 'return']]
@@ -1,13 +1,145 @@
-from data_classes.mt4data import FileParser, TradeData, TraderMadeClient
+from data_classes.mt4data import FileParser, TradeData, TraderMadeClient, BarFileClient
 from data_classes.statistics_m import Metrics
-from config import _TM_API_KEY
+from data_classes.bar_cache import BarCache
+from config import _TM_API_KEY, _CONCURRENT_REQUESTS, get_logger
+import threading
+import time
 
+logger = get_logger(__name__)
 
-def metrics_from_file(file_path: str) -> Metrics:
-    """Create metrics object from a file. uses Parser, TradeData and TradermadeClient"""
-    parsed = FileParser.from_filepath(file_path)
-    trades_obj = TradeData(parsed)
-    client_tm = TraderMadeClient(_TM_API_KEY)
-    client_tm.complete_trade_high_low(trades_obj.trades)
+
+class BackgroundEnrichment:
+    """Completes trades high and low with a market data provider in a worker thread. The Metrics object built from
+    the same trades is refreshed every '_REFRESH_SECONDS' while trades are completed, and once more at the end"""
+    _REFRESH_SECONDS = 5
+
+    def __init__(self, trade_data: TradeData, metrics: Metrics, provider: TraderMadeClient | BarFileClient,
+                 **options):
+        """options are passed to 'trade_data.complete_high_low' (e.g. coalesce=True for a TraderMadeClient)"""
+        self._trade_data = trade_data
+        self._metrics = metrics
+        self._provider = provider
+        self._options = options
+        self._completed = 0
+        self._total = trade_data.n_of_trades
+        self._last_refresh = time.monotonic()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='high-low-enrichment', daemon=True)
+        self.error = None
+
+    def start(self) -> 'BackgroundEnrichment':
+        """Starts the worker thread, returns self"""
+        self._thread.start()
+        return self
+
+    def join(self, timeout: float | None = None) -> bool:
+        """Waits for the enrichment to finish, returns True if it did"""
+        return self._done.wait(timeout)
+
+    @property
+    def metrics(self) -> Metrics:
+        """Returns the Metrics object being refreshed"""
+        return self._metrics
+
+    @property
+    def done(self) -> bool:
+        """True once every trade is completed (or the enrichment failed, see 'error')"""
+        return self._done.is_set()
+
+    @property
+    def progress(self) -> float:
+        """Fraction of trades completed, from 0 to 1"""
+        if self.done or not self._total:
+            return 1.0
+        return min(self._completed / self._total, 1.0)
+
+    def _run(self) -> None:
+        """Worker thread: completes high and low, then refreshes metrics with the final values"""
+        try:
+            self._trade_data.complete_high_low(self._provider, progress=self._on_progress, **self._options)
+            self._refresh_metrics()
+            logger.info(f"{__name__} high and low of {self._total} trades completed")
+        except Exception as e:
+            self.error = e
+            logger.error(f"{__name__} high and low enrichment failed: {e}")
+        finally:
+            self._done.set()
+
+    def _on_progress(self, completed: int, total: int) -> None:
+        """Progress callback given to the provider, refreshes metrics at most every '_REFRESH_SECONDS'"""
+        self._completed, self._total = completed, total
+        if time.monotonic() - self._last_refresh >= BackgroundEnrichment._REFRESH_SECONDS:
+            self._refresh_metrics()
+
+    def _refresh_metrics(self) -> None:
+        """Copies the current trades high and low into the metrics (not completed trades keep their seed values)"""
+        self._metrics.update_high_low(self._trade_data.frame[['order', 'high', 'low']])
+        self._last_refresh = time.monotonic()
+
+
+def metrics_from_file(file_path: str, provider: TraderMadeClient | BarFileClient | None = None,
+                      concurrent: bool = _CONCURRENT_REQUESTS) -> Metrics:
+    """Create metrics object from a file. uses Parser, TradeData and TradermadeClient.
+    Bars downloaded from Tradermade are cached on disk, analysing the same trades again makes no API calls.
+    Trades of the same symbol share coalesced timeseries requests (see 'TraderMadeClient.plan_timeseries_requests').
+    provider: market data used to complete trades high and low, e.g. BarFileClient('data/bars') to read local bar
+    files instead of calling Tradermade. Defaults to a TraderMadeClient.
+    concurrent: Tradermade requests are sent concurrently, rate limited (see 'complete_trade_high_low_async')"""
+    trades_obj = TradeData(FileParser.from_filepath(file_path, stream=True), columnar=True)
+    provider, options = _provider_and_options(provider, concurrent)
+    trades_obj.complete_high_low(provider, **options)
     metrics = Metrics.from_trade_data(trades_obj)
     return metrics
+
+
+def metrics_from_files(file_paths: list[str], provider: TraderMadeClient | BarFileClient | None = None,
+                       trade_data: TradeData | None = None, concurrent: bool = _CONCURRENT_REQUESTS) -> Metrics:
+    """Create a metrics object from overlapping statements (e.g. weekly files), merged in order with
+    'TradeData.merge': each trade is parsed from every file it's in, but its high and low are completed once.
+    Every call parses all 'file_paths' and builds a new Metrics object of all trades (a full rebuild, O(all
+    trades)). To add next week's statement pass only its file with the TradeData of the previous weeks (already
+    completed), which is merged into in place: only the new file is parsed and only its new trades are completed,
+    the trades frame and the Metrics object are still built again from every trade.
+    Raises ValueError if there are no files and no trade_data"""
+    if not file_paths and trade_data is None:
+        raise ValueError("metrics_from_files needs at least one statement file or a trade_data")
+    provider, options = _provider_and_options(provider, concurrent)
+    trades_obj = trade_data
+    for file_path in file_paths:
+        statement = TradeData(FileParser.from_filepath(file_path, stream=True), columnar=True)
+        if trades_obj is None:
+            statement.complete_high_low(provider, **options)
+            trades_obj = statement
+        else:
+            trades_obj.merge(statement, provider, **options)
+    return Metrics.from_trade_data(trades_obj)
+
+
+def metrics_from_file_in_background(file_path: str, provider: TraderMadeClient | BarFileClient | None = None,
+                                    concurrent: bool = _CONCURRENT_REQUESTS) -> tuple[Metrics, BackgroundEnrichment]:
+    """Same as 'metrics_from_file', but returns as soon as the file is parsed. Trades high and low start as the
+    max and min of their open and close prices, and are completed by the returned (running) BackgroundEnrichment,
+    which keeps the returned Metrics object up to date"""
+    return metrics_from_parser_in_background(FileParser.from_filepath(file_path, stream=True), provider, concurrent)
+
+
+def metrics_from_parser_in_background(file_parser: FileParser,
+                                      provider: TraderMadeClient | BarFileClient | None = None,
+                                      concurrent: bool = _CONCURRENT_REQUESTS) -> tuple[Metrics, BackgroundEnrichment]:
+    """Same as 'metrics_from_file_in_background' for a statement already given to a FileParser, e.g. an uploaded
+    one ('FileParser.from_dash_upload')"""
+    trades_obj = TradeData(file_parser, columnar=True)
+    trades_obj.seed_high_low()
+    metrics = Metrics.from_trade_data(trades_obj)
+    provider, options = _provider_and_options(provider, concurrent)
+    return metrics, BackgroundEnrichment(trades_obj, metrics, provider, **options).start()
+
+
+def _provider_and_options(provider: TraderMadeClient | BarFileClient | None,
+                          concurrent: bool = _CONCURRENT_REQUESTS) -> tuple[object, dict]:
+    """Returns the market data provider (a cached TraderMadeClient by default) and its 'complete_high_low' options:
+    coalesced requests, sent concurrently if 'concurrent'"""
+    if provider is None:
+        provider = TraderMadeClient(_TM_API_KEY, bar_cache=BarCache())
+    options = {'coalesce': True, 'concurrent': concurrent} if isinstance(provider, TraderMadeClient) else {}
+    return provider, options
@@ -0,0 +1,138 @@
+from config import get_logger, _CONTRACT_SIZES, _LOT_SIZE
+import numpy as np
+import pandas as pd
+
+logger = get_logger(__name__)
+
+
+def contract_sizes(bases) -> np.ndarray:
+    """Units in a lot of every base currency (or metal) e.g. 100 000 for EUR, 100 for XAU"""
+    sizes = pd.Series(np.asarray(bases, dtype=object)).map(_CONTRACT_SIZES)
+    return sizes.fillna(_LOT_SIZE).to_numpy('float64')
+
+
+class FxRateTable:
+    """Rates converting currencies to an account currency: value in account currency of 1 unit of 'currency' at
+    'time'. Rates are kept per currency as arrays sorted by time, lookups are vectorized as-of joins on time (the
+    last rate at or before each time, the first rate for earlier times). The account currency rate is 1"""
+
+    def __init__(self, account_currency: str, rates: pd.DataFrame | None = None):
+        """rates: optional dataframe with 'time', 'currency' and 'rate' columns (see 'add')"""
+        self.account_currency = account_currency.upper()
+        self._rates = {}  # currency: (sorted times, rates)
+        if rates is not None:
+            self.add(rates)
+
+    @classmethod
+    def from_trades(cls, trades_df: pd.DataFrame, account_currency: str) -> 'FxRateTable':
+        """Rates found in the trades themselves (Metrics.df like dataframe): open and close prices of pairs with the
+        account currency (e.g. USDCAD trades give CAD rates on a USD account), and for other pairs the quote currency
+        rate implied by the profit at close time (profit / profit in quote currency, as precise as the rounded
+        profit). Implied rates are added last, a trade converted at its own close time gets its own profit back"""
+        table = cls(account_currency)
+        if trades_df.empty:
+            return table
+        base, quote = _upper(trades_df['base']), _upper(trades_df['quote'])
+        for side in ('open', 'close'):
+            table.add(table._pair_rates(base, quote, trades_df[f'{side}_time'], trades_df[f'{side}_price']))
+
+        sign = np.where(trades_df['order_type'].to_numpy() == 'sell', -1, 1)
+        open_price = trades_df['open_price'].to_numpy('float64')
+        units = sign * contract_sizes(base) * trades_df['volume'].to_numpy('float64') * (
+            trades_df['close_price'].to_numpy('float64') - open_price)
+        profit = trades_df['profit'].to_numpy('float64')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            implied = profit / units
+        cross = (base != table.account_currency) & (quote != table.account_currency)
+        valid = cross & (profit != 0) & np.isfinite(implied) & (implied > 0)
+        table.add(pd.DataFrame({'time': trades_df['close_time'].to_numpy('datetime64[ns]')[valid],
+                                'currency': quote[valid], 'rate': implied[valid]}))
+        logger.debug(f"{__name__} {len(table)} rates of {table.currencies} found in {len(trades_df)} trades")
+        return table
+
+    def add(self, rates: pd.DataFrame) -> None:
+        """Adds rates from a dataframe with 'time', 'currency' and 'rate' columns. A rate at the same currency and
+        time as an existing one replaces it, rates not positive or NaN are skipped"""
+        values = rates['rate'].to_numpy('float64')
+        valid = (values > 0) & np.isfinite(values)
+        times = rates['time'].to_numpy('datetime64[ns]')[valid]
+        values = values[valid]
+        codes, currencies = pd.factorize(_upper(rates['currency'])[valid])
+        for code, currency in enumerate(currencies):
+            positions = np.flatnonzero(codes == code)
+            self._insert(currency, times[positions], values[positions])
+
+    def update(self, other: 'FxRateTable') -> None:
+        """Adds the rates of another table of the same account currency (e.g. the rates of newer trades), as 'add'
+        does: its rates replace the ones at the same currency and time"""
+        for currency, (times, values) in other._rates.items():
+            self._insert(currency, times, values)
+
+    def add_bars(self, symbol: str, bars: pd.DataFrame) -> None:
+        """Adds the close prices of a pair's bars ('date' and 'close' columns, as 'BarCache.load' returns them) as
+        rates, if the pair includes the account currency e.g. table.add_bars('USDCAD', bar_cache.load(...))"""
+        symbol = symbol.upper()
+        if bars.empty or len(symbol) != 6:
+            return
+        size = len(bars)
+        self.add(self._pair_rates(np.full(size, symbol[:3], dtype=object), np.full(size, symbol[3:], dtype=object),
+                                  bars['date'], bars['close']))
+
+    def rates(self, currencies, times) -> np.ndarray:
+        """Rate of every currency at every time (as-of join, one binary search per currency group), NaN for
+        currencies without rates"""
+        times = np.asarray(times, dtype='datetime64[ns]')
+        result = np.full(len(times), np.nan)
+        codes, uniques = pd.factorize(_upper(currencies))
+        for code, currency in enumerate(uniques):
+            positions = np.flatnonzero(codes == code)
+            if currency == self.account_currency:
+                result[positions] = 1.0
+            elif currency in self._rates:
+                rate_times, rates = self._rates[currency]
+                found = np.searchsorted(rate_times, times[positions], side='right') - 1
+                result[positions] = rates[np.maximum(found, 0)]
+        return result
+
+    @property
+    def currencies(self) -> list[str]:
+        """Currencies with at least one rate"""
+        return list(self._rates)
+
+    def __len__(self) -> int:
+        return sum(len(times) for times, _ in self._rates.values())
+
+    def _insert(self, currency: str, times: np.ndarray, values: np.ndarray) -> None:
+        """Merges valid rates of a currency into its sorted arrays"""
+        old_times, old_values = self._rates.get(currency, (times[:0], values[:0]))
+        all_times = np.concatenate([old_times, times])
+        all_values = np.concatenate([old_values, values])
+        if len(old_times) and len(times) and times[0] > old_times[-1] and (np.diff(times) > 0).all():
+            self._rates[currency] = (all_times, all_values)  # newer rates, e.g. of new trades: already sorted
+            return
+        order = np.argsort(all_times, kind='stable')
+        all_times, all_values = all_times[order], all_values[order]
+        last = np.append(all_times[1:] != all_times[:-1], True)  # the last rate added at a time wins
+        self._rates[currency] = (all_times[last], all_values[last])
+
+    def _pair_rates(self, base: np.ndarray, quote: np.ndarray, times, prices) -> pd.DataFrame:
+        """Rates given by pair prices: the base rate is the price when the quote is the account currency, the quote
+        rate is 1 / price when the base is the account currency. Other pairs give no rate"""
+        prices = np.asarray(prices, dtype='float64')
+        times = np.asarray(times, dtype='datetime64[ns]')
+        quoted = quote == self.account_currency
+        based = (base == self.account_currency) & ~quoted
+        with np.errstate(divide='ignore'):
+            rates = np.where(quoted, prices, 1 / prices)
+        return pd.DataFrame({
+            'time': times[quoted | based],
+            'currency': np.where(quoted, base, quote)[quoted | based],
+            'rate': rates[quoted | based],
+        })
+
+
+def _upper(values) -> np.ndarray:
+    """Upper case strings of an array, series or list, converted once per unique value"""
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object) if isinstance(values, list) else values)
+    upper = np.array([str(value).upper() for value in uniques] + [''], dtype=object)
+    return upper[codes]  # code -1 (missing values) takes the last ''
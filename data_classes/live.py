@@ -0,0 +1,322 @@
+from data_classes.fx_rates import FxRateTable
+from data_classes.mt4data import FileParser, Trade, TradeData
+from data_classes.statistics_m import Metrics, zero_division_to_zero
+from config import _PAIRS, get_logger
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+import threading
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class OnlineKpis:
+    """KPIs of an append only sequence of trades, updated in O(1) per trade: running sums and counts, Welford's
+    mean and variance of profit, running peak and low of cum_profit for max drawdown and run up, and win/loss streak
+    counters. Names and values are the ones of the Metrics properties for the same trades in the same order"""
+    n_of_trades: int = 0
+    n_trades_won: int = 0
+    n_trades_loss: int = 0
+    gross_revenue: float = 0.0
+    gross_loss: float = 0.0
+    perfect_efficiency_income: float = 0.0
+    largest_earning_trade: float = np.nan
+    largest_loss_trade: float = np.nan
+    cum_profit: float = 0.0
+    mean_profit: float = 0.0
+    squared_deviations: float = 0.0  # sum of squared deviations from the mean profit (Welford)
+    peak: float = 0.0  # highest cum_profit so far, the starting 0 included
+    low: float = 0.0  # lowest cum_profit so far, the starting 0 included
+    max_runup: float = 0.0
+    max_drawdown: float = 0.0  # <= 0, as 'Metrics.max_drawdown'
+    win_streak: int = 0
+    loss_streak: int = 0
+    consecutive_wins: int = 0
+    consecutive_losses: int = 0
+
+    @classmethod
+    def from_metrics(cls, metrics: Metrics) -> 'OnlineKpis':
+        """State after the trades of a Metrics object, from its vectorized KPIs (O(n), once)"""
+        profit = metrics.df['profit'].to_numpy('float64')
+        if not len(profit):
+            return cls()
+        won = metrics.df['won_trade'].to_numpy(dtype=bool)
+        cum_profit = profit.cumsum()
+        summary = metrics.summary
+        # trades since the last loss (win streak) or the last win (loss streak)
+        losses, wins = np.flatnonzero(~won), np.flatnonzero(won)
+        win_streak = len(won) - 1 - losses[-1] if len(losses) else len(won)
+        loss_streak = len(won) - 1 - wins[-1] if len(wins) else len(won)
+        return cls(
+            n_of_trades=int(summary.n_of_trades),
+            n_trades_won=int(summary.n_trades_won),
+            n_trades_loss=int(summary.n_trades_loss),
+            gross_revenue=float(summary.gross_revenue),
+            gross_loss=float(summary.gross_loss),
+            perfect_efficiency_income=float(summary.perfect_efficiency_income),
+            largest_earning_trade=float(summary.largest_earning_trade),
+            largest_loss_trade=float(summary.largest_loss_trade),
+            cum_profit=float(cum_profit[-1]),
+            mean_profit=float(profit.mean()),
+            squared_deviations=float(((profit - profit.mean()) ** 2).sum()),
+            peak=max(float(cum_profit.max()), 0.0),
+            low=min(float(cum_profit.min()), 0.0),
+            max_runup=float(metrics.max_runup),
+            max_drawdown=float(metrics.max_drawdown),
+            win_streak=int(win_streak),
+            loss_streak=int(loss_streak),
+            consecutive_wins=metrics.consecutive_wins,
+            consecutive_losses=metrics.consecutive_losses,
+        )
+
+    def update(self, profit: float, max_possible_gain: float) -> None:
+        """Adds a trade, trades without profit are losses (as 'Metrics.won_trade')"""
+        self.n_of_trades += 1
+        if profit > 0:
+            self.n_trades_won += 1
+            self.gross_revenue += profit
+            self.win_streak, self.loss_streak = self.win_streak + 1, 0
+            self.consecutive_wins = max(self.consecutive_wins, self.win_streak)
+        else:
+            self.n_trades_loss += 1
+            self.gross_loss += profit
+            self.win_streak, self.loss_streak = 0, self.loss_streak + 1
+            self.consecutive_losses = max(self.consecutive_losses, self.loss_streak)
+        self.perfect_efficiency_income += max_possible_gain
+        first = self.n_of_trades == 1
+        self.largest_earning_trade = profit if first else max(self.largest_earning_trade, profit)
+        self.largest_loss_trade = profit if first else min(self.largest_loss_trade, profit)
+
+        delta = profit - self.mean_profit
+        self.mean_profit += delta / self.n_of_trades
+        self.squared_deviations += delta * (profit - self.mean_profit)
+
+        self.cum_profit += profit
+        self.peak = max(self.peak, self.cum_profit)
+        self.low = min(self.low, self.cum_profit)
+        self.max_runup = max(self.max_runup, self.cum_profit - self.low)
+        self.max_drawdown = min(self.max_drawdown, self.cum_profit - self.peak)
+
+    @property
+    def std_profit(self) -> float:
+        """Sample standard deviation of profit"""
+        return float(np.sqrt(self.squared_deviations / (self.n_of_trades - 1))) if self.n_of_trades > 1 else 0
+
+    @property
+    def net_income(self) -> float:
+        return self.gross_revenue + self.gross_loss
+
+    @property
+    @zero_division_to_zero
+    def win_rate(self) -> float:
+        return self.n_trades_won / self.n_of_trades
+
+    @property
+    @zero_division_to_zero
+    def expectancy(self) -> float:
+        return self.net_income / self.n_of_trades
+
+    @property
+    @zero_division_to_zero
+    def avg_win_trade_profit(self) -> float:
+        return self.gross_revenue / self.n_trades_won
+
+    @property
+    @zero_division_to_zero
+    def avg_lose_trade_loss(self) -> float:
+        return self.gross_loss / self.n_trades_loss
+
+    @property
+    @zero_division_to_zero
+    def profit_factor(self) -> float:
+        return abs(self.gross_revenue / self.gross_loss)
+
+    @property
+    @zero_division_to_zero
+    def efficiency(self) -> float:
+        return self.gross_revenue / self.perfect_efficiency_income
+
+
+class _StatementTail:
+    """Reads the operations rows a statement file gained since the last read. The file is exported again (rewritten)
+    over time, only its header (lines to the 'Closed Transactions:' line) and the bytes after the rows already read
+    are read: the rows read must still end at the same offset with the same last row, otherwise every row is read
+    again. Rows are read up to the empty line ending the section"""
+    _SECTION_START = FileParser._ABOVE_TRADES_REF_LINE.encode()
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._rows_size = 0  # bytes of the rows read, from the end of the header
+        self._last_row = b''
+
+    def read(self, skip_orders: set[int]) -> tuple[TradeData | None, bool]:
+        """TradeData of the new rows (None without new rows), and whether every row was read again. Raises
+        ValueError while the section has no end yet (an export being written), the rows read are then kept"""
+        with open(self.file_path, 'rb') as file:
+            header = self._read_header(file)
+            full = not self._last_row or not self._known_rows_unchanged(file, len(header))
+            if full:
+                file.seek(len(header))
+            rows = []
+            for line in file:
+                if not line.endswith(b'\n'):
+                    break  # last line being written
+                if line.rstrip(b'\r\n') == b'':  # the next line after the last trade is an empty line
+                    return self._parse(header, rows, skip_orders, full), full
+                rows.append(line)
+        raise ValueError(f"{self.file_path}: no empty line after the last trade, the statement may be incomplete")
+
+    def _read_header(self, file) -> bytes:
+        """Lines from the start of the file to the section start line, included"""
+        lines = []
+        for line in file:
+            lines.append(line)
+            if _StatementTail._SECTION_START in line:
+                return b''.join(lines)
+        raise ValueError(f"{self.file_path}: start line '{FileParser._ABOVE_TRADES_REF_LINE}' not found")
+
+    def _known_rows_unchanged(self, file, header_size: int) -> bool:
+        """Whether the rows read end at the same offset with the same last row, leaves the file at their end"""
+        file.seek(header_size + self._rows_size - len(self._last_row))
+        return file.readline() == self._last_row
+
+    def _parse(self, header: bytes, rows: list[bytes], skip_orders: set[int], full: bool) -> TradeData | None:
+        """TradeData of the header and rows (an html text ending the section), then moves past the rows"""
+        trade_data = None
+        if rows:
+            text = (header + b''.join(rows)).decode(errors='replace').replace('\r\n', '\n') + '\n'
+            trade_data = TradeData(FileParser(text), columnar=True, skip_orders=skip_orders)
+        if full:
+            self._rows_size, self._last_row = 0, b''
+        if rows:
+            self._rows_size += sum(map(len, rows))
+            self._last_row = rows[-1]
+        return trade_data
+
+
+class LiveMetrics:
+    """Append only live mode of a Metrics object, for a statement exported again every few minutes. New trades
+    (rows of the statement not seen yet, or Trade objects) update 'kpis' in O(1) per trade and are kept as completed
+    dataframe chunks, 'metrics' appends them to the trades dataframe once per refresh: known trades are neither
+    parsed nor completed again, and 'refresh' only reads the bytes the statement gained (see '_StatementTail').
+    Trades are appended in the order they arrive (by close time within a batch), the high and low of new trades
+    are the max and min of their open and close prices (no market data is requested). Max possible gain and loss
+    of new trades use the rates of every trade so far"""
+
+    def __init__(self, metrics: Metrics, file_path: str | None = None):
+        """file_path: statement read again by 'refresh'"""
+        self._metrics = metrics
+        self._balance_df = metrics.balance_df
+        self._tail = _StatementTail(file_path) if file_path is not None else None
+        self._fx_rates = FxRateTable(metrics.currency)
+        self._fx_rates.update(metrics.fx_rates)
+        self._orders = set(metrics.all_trades_df['order'].tolist())
+        self._pending = []  # completed dataframes of the trades added since the last 'metrics' access
+        self._pending_all = []  # equity columns of every trade (Forex or not) added since then
+        self._lock = threading.Lock()
+        self.kpis = OnlineKpis.from_metrics(metrics)
+
+    @classmethod
+    def from_file(cls, file_path: str) -> 'LiveMetrics':
+        """Live metrics of a statement file, new trades are read from it by 'refresh'"""
+        tail = _StatementTail(file_path)
+        trade_data, _ = tail.read(skip_orders=set())
+        if trade_data is None:
+            raise ValueError(f"{file_path}: no operations found in the statement")
+        trade_data.seed_high_low()
+        live = cls(Metrics.from_trade_data(trade_data), file_path)
+        live._tail = tail
+        return live
+
+    def refresh(self) -> int:
+        """Reads the rows the statement file gained and adds the trades not seen yet. New balance operations are
+        appended (replaced by the ones of the file when every row is read again). A statement that can't be read yet
+        (e.g. still being written) is logged and read again on the next call. Returns the number of new trades"""
+        with self._lock:
+            known = set(self._orders)
+        try:
+            trade_data, full = self._tail.read(skip_orders=known)
+        except (OSError, ValueError, IndexError) as error:
+            logger.warning(f"{__name__} statement not read, retried on next refresh: {error}")
+            return 0
+        if trade_data is None:
+            return 0
+        trade_data.seed_high_low()
+        balance_df = pd.DataFrame([balance.__dict__ for balance in trade_data.balances])
+        if not full:
+            balance_df = pd.concat([frame for frame in [self._balance_df, balance_df] if not frame.empty],
+                                   ignore_index=True) if not balance_df.empty else None
+        return self._add_frame(trade_data.forex_frame, balance_df, trade_data.frame[Metrics._EQUITY_COLUMNS])
+
+    def add_trades(self, trades: list[Trade]) -> int:
+        """Adds Trade objects (Forex trades of orders not seen yet). Trades without high and low (0) take the max and
+        min of their open and close prices. Returns the number of new trades"""
+        frame = pd.DataFrame([trade.__dict__ for trade in trades], columns=list(Trade.__dataclass_fields__))
+        symbols = frame['symbol'].astype(str).str.upper()
+        frame['base'] = symbols.str[:3].where(symbols.str.len() == 6, '')
+        frame['quote'] = symbols.str[3:].where(symbols.str.len() == 6, '')
+        frame['delta_time'] = frame['close_time'] - frame['open_time']
+        prices = frame[['open_price', 'close_price']]
+        frame['high'] = frame['high'].where(frame['high'] > 0, prices.max(axis='columns'))
+        frame['low'] = frame['low'].where(frame['low'] > 0, prices.min(axis='columns'))
+        return self._add_frame(frame[frame['base'].isin(list(_PAIRS)) & frame['quote'].isin(list(_PAIRS))])
+
+    @property
+    def metrics(self) -> Metrics:
+        """Metrics object of every trade. Trades added since the last access are appended to its dataframe here, in
+        one concatenation (a copy of the dataframe, the category columns keep their codes), and KPIs computed from
+        the dataframe (figures) are computed again on next access. Use 'kpis' for KPIs only"""
+        with self._lock:
+            if self._pending_all or self._balance_df is not self._metrics.balance_df:
+                frames = [df for df in [self._metrics.df, *self._pending] if not df.empty]
+                df = pd.concat(self._with_same_categories(frames), ignore_index=True) if frames else self._metrics.df
+                all_frames = [self._metrics.all_trades_df[Metrics._EQUITY_COLUMNS], *self._pending_all]
+                all_trades_df = pd.concat([frame for frame in all_frames if not frame.empty] or all_frames[:1],
+                                          ignore_index=True)
+                self._metrics = Metrics.view(df, self._balance_df, self._metrics.currency, all_trades_df)
+                self._pending, self._pending_all = [], []
+            return self._metrics
+
+    @staticmethod
+    def _with_same_categories(frames: list[pd.DataFrame]) -> list[pd.DataFrame]:
+        """Frames whose category columns (in any frame) share the categories of the first frame plus the new ones,
+        so their concatenation keeps the category dtype without factorizing the values again. The first frame is
+        only copied when a category is new (e.g. a symbol traded for the first time)"""
+        frames = list(frames)
+        for column in [name for name in frames[0].columns
+                       if any(isinstance(frame[name].dtype, pd.CategoricalDtype) for frame in frames)]:
+            values = [frame[column].astype('category') for frame in frames]
+            categories = values[0].cat.categories
+            new = dict.fromkeys(category for chunk in values[1:] for category in chunk.cat.categories
+                                if category not in categories)
+            categories = categories.append(pd.Index(list(new))) if new else categories
+            for i, chunk in enumerate(values):
+                if frames[i][column].dtype != chunk.dtype or not chunk.cat.categories.equals(categories):
+                    frames[i] = frames[i].assign(**{column: chunk.cat.set_categories(categories)})
+        return frames
+
+    def _add_frame(self, frame: pd.DataFrame, balance_df: pd.DataFrame | None = None,
+                   all_trades: pd.DataFrame | None = None) -> int:
+        """Completes the columns of new trades (a TradeData.frame like dataframe), continues cum_profit from the
+        last trade and updates 'kpis' trade by trade. all_trades: equity columns of every new trade, Forex or not
+        (defaults to frame)"""
+        with self._lock:
+            if balance_df is not None:
+                self._balance_df = balance_df
+            frame = frame[~frame['order'].isin(self._orders)].drop_duplicates('order')
+            all_trades = frame if all_trades is None else all_trades
+            all_trades = all_trades[~all_trades['order'].isin(self._orders)].drop_duplicates('order')
+            if not all_trades.empty:
+                self._pending_all.append(all_trades[Metrics._EQUITY_COLUMNS])
+                self._orders.update(all_trades['order'].tolist())
+            if frame.empty:
+                return 0
+            self._fx_rates.update(FxRateTable.from_trades(frame, self._metrics.currency))
+            chunk = Metrics(frame, pd.DataFrame(), self._metrics.currency, fx_rates=self._fx_rates).df
+            chunk['cum_profit'] += self.kpis.cum_profit
+            for profit, max_possible_gain in zip(chunk['profit'].tolist(), chunk['max_possible_gain'].tolist()):
+                self.kpis.update(profit, max_possible_gain)
+            self._pending.append(chunk)
+        logger.info(f"{__name__} {len(chunk)} new trades, {self.kpis.n_of_trades} trades")
+        return len(chunk)
@@ -1,16 +1,30 @@
 import datetime
-from config import _ORDER_TYPES, get_logger, _PAIRS, _TM_API_KEY
+from config import _ORDER_TYPES, get_logger, _PAIRS, _TM_API_KEY, _BAR_MINUTES
+from data_classes.bar_cache import BarCache
 from bs4 import BeautifulSoup
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator
+from requests.adapters import HTTPAdapter
 import datetime as dt
 import tradermade as tm
 import requests
+import asyncio
+import bisect
+import functools
+import operator
+import time
 import pandas as pd
+from pandas.api.types import union_categoricals
+import numpy as np
 import base64
+import html
+import os
 import re
 import pickle
 
 logger = get_logger(__name__)
+_EPOCH = dt.datetime(1970, 1, 1)  # reference of times in seconds (see '_GroupWindows.member')
 
 
 @dataclass
@@ -51,51 +65,62 @@ class FileParser:
     """Parser class, parses MT4 history report file (html or txt are accepted)"""
     _ABOVE_TRADES_REF_LINE = 'Closed Transactions:'
     _ABOVE_ACCT_REF_LINE = '<tr align=left>'
-
-    def __init__(self, txt: str):
-        """txt is the raw html string of the mt4 statement"""
+    # patterns used by the fast tokenizer. MT4 writes one <tr> per line with every <td> closed, so a regex scan
+    # is enough for the whole section; lines that don't match that layout are handed to BeautifulSoup.
+    # a '>' inside a quoted attribute value doesn't end the tag
+    _TD_PATTERN = re.compile(r'<td\b(?:[^>"\']|"[^"]*"|\'[^\']*\')*>(.*?)</td\s*>', re.IGNORECASE | re.DOTALL)
+    _TD_OPEN_PATTERN = re.compile(r'<td\b', re.IGNORECASE)
+    _COMMENT_PATTERN = re.compile(r'<!--.*?-->', re.DOTALL)
+    _TAG_PATTERN = re.compile(r'<(?:[^>"\']|"[^"]*"|\'[^\']*\')*>')
+
+    def __init__(self, txt: str | None, fast_tokenizer: bool = True, filepath: str | None = None):
+        """txt is the raw html string of the mt4 statement. fast_tokenizer=False parses every line with
+        BeautifulSoup instead of the regex tokenizer.
+        If txt is None the statement is streamed line by line from 'filepath' each time a section is read,
+        so the file content is never held in memory (see 'from_filepath' stream argument)"""
         self._raw_html = txt
-        self.my_html_list = FileParser._create_html_list(self.raw_html)
+        self._filepath = filepath
+        self.fast_tokenizer = fast_tokenizer
+        self.my_html_list = FileParser._create_html_list(self.raw_html) if txt is not None else None
         logger.info(f"FileParser creation")
 
     @classmethod
-    def from_dash_upload(cls, uploaded_file, unicode_encoding='utf-8'):
+    def from_dash_upload(cls, uploaded_file, unicode_encoding='utf-8', fast_tokenizer: bool = True):
         """decodes string content from dash upload.
         returns a list of string, each index represents each line in the .txt"""
         decoded = base64.b64decode(uploaded_file)
         file_text = decoded.decode(unicode_encoding)
         file_text = file_text.replace('\r\n', '\n')
-        return cls(file_text)
+        return cls(file_text, fast_tokenizer=fast_tokenizer)
 
     @classmethod
-    def from_filepath(cls, filepath: str):
-        """Instantiates a class object from a filepath to the MT4 report"""
+    def from_filepath(cls, filepath: str, fast_tokenizer: bool = True, stream: bool = False):
+        """Instantiates a class object from a filepath to the MT4 report.
+        stream=True doesn't read the file here, rows are read from disk lazily by 'iter_operations_info'"""
+        if stream:
+            return cls(None, fast_tokenizer=fast_tokenizer, filepath=filepath)
+
         with open(filepath) as d:
             html_text = d.read()
 
-        return cls(html_text)
+        return cls(html_text, fast_tokenizer=fast_tokenizer)
 
     def get_operations_info(self) -> list[list[str]]:
         """returns a list with the meaningful data of the trades and balances of the MT4 operations report"""
-        operations_raw = FileParser._extract_section_from_html_list(
-            my_list=self.my_html_list,
-            start=FileParser._ABOVE_TRADES_REF_LINE,
-        )
-        operations_info = list()
+        return list(self.iter_operations_info())
+
+    def iter_operations_info(self) -> Iterator[list[str]]:
+        """yields the meaningful data of each row of the trades and balances of the MT4 operations report"""
+        operations_raw = FileParser._iter_section(self._lines(), start=FileParser._ABOVE_TRADES_REF_LINE)
         for line in operations_raw:
-            td_content = FileParser._parse_td(line)
-            operations_info.append(td_content)  # adds all values in the trade row from operations table
-        return operations_info
+            yield self._tokenize(line)  # all values in the trade row from operations table
 
     def get_account_info(self) -> dict:
         """returns account, name, currency and leverage from MT4 report"""
-        acct_info_raw = FileParser._extract_section_from_html_list(
-            my_list=self.my_html_list,
-            start=FileParser._ABOVE_ACCT_REF_LINE,
-        )
+        acct_info_raw = FileParser._iter_section(self._lines(), start=FileParser._ABOVE_ACCT_REF_LINE)
         acct_info = dict()
         for line in acct_info_raw:
-            td_content = FileParser._parse_td(line)
+            td_content = self._tokenize(line)
             values = re.split(r':', td_content[0])
 
             try:
@@ -110,25 +135,46 @@ class FileParser:
         """returns a list of strings with each line being a line from my_txt_string"""
         return my_txt_string.split('\n')
 
+    def _lines(self) -> Iterator[str]:
+        """yields the statement lines, the same values 'my_html_list' holds. When streaming they are read from disk"""
+        if self.my_html_list is not None:
+            yield from self.my_html_list
+            return
+
+        with open(self._filepath) as d:
+            line = ''
+            for line in d:
+                yield line[:-1] if line.endswith('\n') else line
+            if not line or line.endswith('\n'):
+                yield ''  # 'str.split' returns a last empty string when the text ends with a line break
+
     @staticmethod
     def _extract_section_from_html_list(my_list: list[str], start: str) -> list:
         """slices 'my_list' from a line reference (string) to the next empty line, empty and start
          line not included in returned list"""
+        return list(FileParser._iter_section(my_list, start))
 
-        for idx, line in enumerate(my_list):
+    @staticmethod
+    def _iter_section(lines: Iterable[str], start: str) -> Iterator[str]:
+        """yields lines from a line reference (string) to the next empty line, empty and start line not included"""
+        lines = iter(lines)
+        for line in lines:
             if start in line:
-                start_idx = idx
                 break
         else:
             raise ValueError(f"Start line '{start}' not found in HTML content.")
 
-        sliced_list = my_list[start_idx + 1:]  # sliced from the start of the trade's table to the end of the file
-        try:
-            end_idx = sliced_list.index('')  # index of the next line after the last trade (an empty line)
-        except ValueError:
-            raise ValueError("Could not find an empty line after the start reference.")
-        section = sliced_list[: end_idx]
-        return section
+        for line in lines:
+            if line == '':  # the next line after the last trade is an empty line
+                return
+            yield line
+        raise ValueError("Could not find an empty line after the start reference.")
+
+    def _tokenize(self, line: str) -> list[str]:
+        """Returns the <td> inner text values of a line, using the fast tokenizer when enabled"""
+        if self.fast_tokenizer:
+            return FileParser._tokenize_td(line)
+        return FileParser._parse_td(line)
 
     @staticmethod
     def _parse_td(td: str) -> list[str]:
@@ -136,6 +182,26 @@ class FileParser:
         all_td_content = [td.text for td in BeautifulSoup(td, 'html.parser')('td')]
         return all_td_content
 
+    @staticmethod
+    def _tokenize_td(td: str) -> list[str]:
+        """Regex version of '_parse_td', returns the same values without building a soup tree.
+        Falls back to '_parse_td' when a <td> tag is not closed on the same line"""
+        if '<' not in td:
+            return []
+        cells = FileParser._TD_PATTERN.findall(td)
+        if len(cells) != len(FileParser._TD_OPEN_PATTERN.findall(td)):
+            return FileParser._parse_td(td)
+        return [FileParser._td_text(cell) for cell in cells]
+
+    @staticmethod
+    def _td_text(cell: str) -> str:
+        """Removes comments and inner tags from a <td> content and decodes html entities ('&nbsp;' -> '\\xa0')"""
+        if '<' in cell:
+            cell = FileParser._TAG_PATTERN.sub('', FileParser._COMMENT_PATTERN.sub('', cell))
+        if '&' in cell:
+            cell = html.unescape(cell)
+        return cell
+
     @property
     def raw_html(self) -> str:
         """Return input html file"""
@@ -146,20 +212,77 @@ class FileParser:
 #  if the broker uses another timezone every data gotten from the TraderMadeClient would awfully inaccurate
 class TradeData:
     _HTML_DATE_SOURCE_FORMAT = "%Y.%m.%d %H:%M:%S"
-
-    def __init__(self, trades_info: FileParser):
-        self.raw_operations = trades_info.get_operations_info()
+    # MT4 column order of a trade row, and dtypes used by the columnar trades frame
+    _TRADE_ROW_COLUMNS = ['order', 'open_time', 'order_type', 'volume', 'symbol', 'open_price', 'sl', 'tp',
+                          'close_time', 'close_price', 'commission', 'taxes', 'swap', 'profit']
+    _TRADE_FLOAT_COLUMNS = ['volume', 'open_price', 'sl', 'tp', 'close_price', 'commission', 'taxes', 'swap', 'profit']
+    _TRADE_FRAME_COLUMNS = _TRADE_ROW_COLUMNS + ['high', 'low', 'delta_time', 'base', 'quote']
+    _TRADE_CATEGORY_COLUMNS = ['order_type', 'symbol', 'base', 'quote']
+    _STREAM_CHUNK_ROWS = 50_000  # trade rows parsed at once by the columnar mode
+
+    def __init__(self, trades_info: FileParser, columnar: bool = False, batch_parse: bool = False,
+                 skip_orders: Iterable[int] = ()):
+        """columnar=True stores trades as typed columns (see 'frame') instead of creating a Trade object per row.
+        Trade objects are then only created if 'trades' is accessed. Operation rows are read from
+        'trades_info.iter_operations_info' and parsed in chunks, they are not kept ('raw_operations' is empty), so
+        together with a streaming FileParser memory grows with the trades frame, not with the statement size.
+        batch_parse=True parses the trade rows column by column (as the columnar mode does) before creating the
+        Trade objects. In both modes malformed rows are kept in 'malformed_rows' instead of being logged one by one.
+        skip_orders: order numbers of trades already known (e.g. by a 'LiveMetrics'), their rows are not parsed"""
+        self.columnar = columnar
+        self._skip_orders = {str(order) for order in skip_orders}
         self._currency = trades_info.get_account_info()['currency']
         self._trades_raw = []
         self._balances_raw = []
-        self._split_operations()
-        self._create_trade_objects()
+        self._trade_objects = None
+        self._trade_frame = None
+        self._malformed_rows = []
+        self._merge_conflicts = {}  # order: {column: (kept value, merged value)}
+        self._order_index = None
+        if columnar:
+            self.raw_operations = []
+            self._trade_frame = self._stream_trade_frame(trades_info.iter_operations_info())
+        else:
+            self.raw_operations = trades_info.get_operations_info()
+            self._split_operations()
+            if batch_parse:
+                frame = self._parse_trade_chunk(self._trades_raw)
+                self._trade_objects = TradeData._trades_from_frame(frame)
+            else:
+                self._create_trade_objects()
+                self._insert_delta_time()
+                self._update_base_and_quote()
+        if self._malformed_rows:
+            logger.warning(f"{len(self._malformed_rows)} malformed trade rows skipped, see 'TradeData.malformed_rows'")
         self._create_balance_objects()
         self._insert_balance_type()
-        self._insert_delta_time()
-        self._update_base_and_quote()
 
-        logger.info(f" {__name__} amount of traes {len(self.trades)} amount of balances {len(self.balances)}")
+        logger.info(f" {__name__} amount of traes {self.n_of_trades} amount of balances {len(self.balances)}")
+
+    def _stream_trade_frame(self, operations: Iterable[list[str]]) -> pd.DataFrame:
+        """Returns the trades frame of 'operations' rows, parsed in chunks of '_STREAM_CHUNK_ROWS' trade rows.
+        Balance rows are stored in 'self._balances_raw', trade rows are dropped once their chunk is parsed"""
+        frames = []
+        chunk = []
+        for row in operations:
+            if TradeData._is_trade(row):
+                if row[0].strip() in self._skip_orders:
+                    continue
+                chunk.append(row)
+                if len(chunk) == TradeData._STREAM_CHUNK_ROWS:
+                    frames.append(self._parse_trade_chunk(chunk))
+                    chunk = []
+
+            elif TradeData._is_balance(row):
+                self._balances_raw.append(row)
+        frames.append(self._parse_trade_chunk(chunk))
+        return TradeData._concat_trade_frames(frames)
+
+    def _parse_trade_chunk(self, rows: list[list[str]]) -> pd.DataFrame:
+        """Returns the trades frame of trade 'rows', malformed rows are added to 'self._malformed_rows'"""
+        frame, malformed = TradeData._create_trade_frame(rows, self._HTML_DATE_SOURCE_FORMAT)
+        self._malformed_rows.extend(malformed)
+        return frame
 
     def _insert_delta_time(self) -> None:
         """Assigns dt.timedelta value for opening and closing times in Trade.delta_time"""
@@ -186,7 +309,8 @@ class TradeData:
         and balances are stored in self._balances"""
         for row in self.raw_operations:
             if TradeData._is_trade(row):
-                self._trades_raw.append(row)
+                if row[0].strip() not in self._skip_orders:
+                    self._trades_raw.append(row)
 
             elif TradeData._is_balance(row):
                 self._balances_raw.append(row)
@@ -250,6 +374,99 @@ class TradeData:
             logger.warning(f"Failed to parse trade row: {row} | Error: {e}")
             return None
 
+    @staticmethod
+    def _create_trade_frame(rows: list[list[str]], date_format: str) -> tuple[pd.DataFrame, list[tuple[list, str]]]:
+        """Returns a dataframe with a typed column for each Trade field, parsed column by column from MT4 rows.
+        int64 order, datetime64 times, float64 prices and categorical order_type, symbol, base and quote.
+        Rows that can't be parsed are not logged one by one, they are returned as (row, reason) tuples in a list"""
+        n_columns = len(TradeData._TRADE_ROW_COLUMNS)
+        malformed = []
+        if any(length != n_columns for length in set(map(len, rows))):
+            malformed = [(row, 'too few columns') for row in rows if len(row) < n_columns]
+            rows = [row[:n_columns] for row in rows if len(row) >= n_columns]
+        # one 2-D block of strings, every column is then converted with a single call
+        values = np.array(rows, dtype=object).reshape(len(rows), n_columns)
+        raw = pd.DataFrame(values, columns=TradeData._TRADE_ROW_COLUMNS)
+
+        frame = pd.DataFrame({
+            'order': TradeData._to_float_column(raw['order']),
+            'open_time': pd.to_datetime(raw['open_time'], format=date_format, errors='coerce'),
+            'order_type': raw['order_type'].astype('category'),
+            'symbol': TradeData._upper_categorical(raw['symbol']),
+        })
+        float_block = raw[TradeData._TRADE_FLOAT_COLUMNS]
+        try:
+            frame[TradeData._TRADE_FLOAT_COLUMNS] = float_block.astype('float64')
+        except ValueError:
+            for name in TradeData._TRADE_FLOAT_COLUMNS:
+                frame[name] = TradeData._to_float_column(float_block[name])
+        frame['close_time'] = pd.to_datetime(raw['close_time'], format=date_format, errors='coerce')
+
+        # a row is malformed when any of its values could not be converted (NaN/NaT) or the order is not an integer
+        unparsed = frame.drop(columns=['order_type', 'symbol']).isna()
+        invalid = unparsed.any(axis='columns') | (frame['order'] % 1 != 0)
+        if invalid.any():
+            for idx in invalid.to_numpy().nonzero()[0]:
+                bad_columns = unparsed.columns[unparsed.iloc[idx].to_numpy()].to_list() or ['order']
+                malformed.append((rows[idx], f"unparsable {', '.join(bad_columns)}"))
+            frame = frame[~invalid].reset_index(drop=True)
+            frame['symbol'] = frame['symbol'].cat.remove_unused_categories()
+
+        frame['order'] = frame['order'].astype('int64')
+        frame['high'] = 0.0
+        frame['low'] = 0.0
+        frame['delta_time'] = frame['close_time'] - frame['open_time']
+        frame['base'], frame['quote'] = TradeData._base_and_quote_columns(frame['symbol'])
+        return frame[TradeData._TRADE_FRAME_COLUMNS], malformed
+
+    @staticmethod
+    def _concat_trade_frames(frames: list[pd.DataFrame]) -> pd.DataFrame:
+        """Concatenates trades frames keeping categorical columns categorical (categories are unified first)"""
+        if len(frames) == 1:
+            return frames[0]
+        for name in TradeData._TRADE_CATEGORY_COLUMNS:
+            categories = union_categoricals([frame[name] for frame in frames]).categories
+            for frame in frames:
+                frame[name] = frame[name].cat.set_categories(categories)
+        return pd.concat(frames, ignore_index=True)
+
+    @staticmethod
+    def _to_float_column(values: pd.Series) -> pd.Series:
+        """Converts a column of strings to float64 at once. Values that can't be converted are NaN"""
+        try:
+            return values.astype('float64')
+        except ValueError:
+            numbers = pd.to_numeric(values, errors='coerce')
+            retry = numbers.isna()
+            # mspt cells use a blank space as thousands separator e.g. '1 000.00'
+            numbers[retry] = pd.to_numeric(values[retry].str.replace(' ', ''), errors='coerce')
+            return numbers
+
+    @staticmethod
+    def _upper_categorical(values: pd.Series) -> pd.Categorical:
+        """Returns 'values' as an upper case categorical. Upper case is applied once per category, not per row"""
+        categorical = pd.Categorical(values)
+        codes_map, upper_categories = pd.Index(categorical.categories.str.upper()).factorize()
+        codes = codes_map[categorical.codes] if len(codes_map) else categorical.codes
+        return pd.Categorical.from_codes(codes, categories=pd.Index(upper_categories, dtype=object))
+
+    @staticmethod
+    def _base_and_quote_columns(symbols: pd.Series) -> tuple[pd.Categorical, pd.Categorical]:
+        """Vectorized '_update_base_and_quote'. Returns (base, quote) categorical columns from a categorical
+        symbol column, both '' when the symbol is not 6 characters long"""
+        categories = symbols.cat.categories.astype(str)
+        is_pair = categories.str.len() == 6
+        base = pd.Index(categories.str[:3].where(is_pair, ''))
+        quote = pd.Index(categories.str[3:].where(is_pair, ''))
+        codes = symbols.cat.codes.to_numpy()
+        return (pd.Categorical(base[codes] if len(codes) else base[:0]),
+                pd.Categorical(quote[codes] if len(codes) else quote[:0]))
+
+    @staticmethod
+    def _trades_from_frame(frame: pd.DataFrame) -> list[Trade]:
+        """Creates a list of Trade objects from a trades frame (see '_create_trade_frame')"""
+        return [Trade(**record) for record in frame.to_dict('records')]
+
     @staticmethod
     def _is_trade(row) -> bool:
         """returns True if a list contains a trade's information"""
@@ -280,11 +497,160 @@ class TradeData:
         except ValueError:
             raise ValueError("Balance amount can't be converted to float")
 
+    def seed_high_low(self) -> None:
+        """Sets every trade high and low to the max and min of its open and close prices, the values used when no
+        market data is available. Lets metrics be computed before the high and low are completed"""
+        if self.columnar and self._trade_objects is None:
+            prices = self._trade_frame[['open_price', 'close_price']]
+            self._trade_frame['high'] = prices.max(axis='columns')
+            self._trade_frame['low'] = prices.min(axis='columns')
+            return
+        for trade in self.trades:
+            trade.high = max(trade.open_price, trade.close_price)
+            trade.low = min(trade.open_price, trade.close_price)
+
+    def complete_high_low(self, provider, **kwargs) -> None:
+        """Completes high and low of every trade with a market data provider (TraderMadeClient or BarFileClient).
+        In columnar mode, providers with a 'complete_frame_high_low' method fill the frame columns at once and no
+        Trade objects are created. Otherwise 'provider.complete_trade_high_low(self.trades, **kwargs)' is called"""
+        if self.columnar and self._trade_objects is None and hasattr(provider, 'complete_frame_high_low'):
+            provider.complete_frame_high_low(self._trade_frame, **kwargs)
+        else:
+            provider.complete_trade_high_low(self.trades, **kwargs)
+
+    def merge(self, other: 'TradeData', provider=None, **kwargs) -> pd.DataFrame:
+        """Adds the trades and balances of another statement (e.g. the next weekly statement, overlapping this
+        one) whose order numbers are not known yet, found with a hash index on order number (dict). Known orders
+        with different statement values are conflicts: the known values are kept, and the differences are recorded
+        once per order in 'merge_conflicts'. Orders repeated in 'other' are handled the same way, the first row is
+        kept. Only the new trades high and low are completed with 'provider' (if given, kwargs are passed to it as
+        in 'complete_high_low'). Returns the new trades frame (see 'frame').
+        Finding the new trades costs O(trades of 'other'), but in columnar mode the frame of every trade is built
+        again with the new ones (one concatenation, O(all trades)) on each merge"""
+        index = self._orders_index()
+        incoming = other.frame.reset_index(drop=True)
+        for name in TradeData._TRADE_CATEGORY_COLUMNS:
+            incoming[name] = incoming[name].astype('category')  # Trade objects frames hold strings
+        repeated = incoming['order'].duplicated().to_numpy()
+        duplicates, incoming = incoming[repeated], incoming[~repeated].reset_index(drop=True)
+        positions = [index.get(order, -1) for order in incoming['order'].tolist()]
+        known = np.array(positions, dtype='int64') >= 0
+        if known.any():
+            self._record_conflicts(incoming[known], np.array(positions, dtype='int64')[known])
+
+        new = incoming[~known].reset_index(drop=True)
+        if provider is not None and not new.empty:
+            if hasattr(provider, 'complete_frame_high_low'):
+                provider.complete_frame_high_low(new, **kwargs)
+            else:
+                new_trades = TradeData._trades_from_frame(new)
+                provider.complete_trade_high_low(new_trades, **kwargs)
+                new['high'] = [trade.high for trade in new_trades]
+                new['low'] = [trade.low for trade in new_trades]
+        if not new.empty:
+            n_known = self.n_of_trades  # positions of the new trades in 'frame' follow the rows already there
+            if self._trade_frame is not None:
+                self._trade_frame = TradeData._concat_trade_frames([self._trade_frame, new.copy()])
+            if self._trade_objects is not None:
+                self._trade_objects.extend(TradeData._trades_from_frame(new))
+            index.update(zip(new['order'].tolist(), range(n_known, n_known + len(new))))
+        if len(duplicates):
+            logger.warning(f"{len(duplicates)} trades of the merged statement repeat an order of it, first one kept")
+            self._record_conflicts(duplicates, np.array([index[order] for order in duplicates['order'].tolist()],
+                                                        dtype='int64'))
+
+        known_balances = {balance.order for balance in self._balance_objects}
+        self._balance_objects.extend(balance for balance in other.balances if balance.order not in known_balances)
+        logger.info(f"{__name__} {len(new)} new trades merged, {int(known.sum())} already known, "
+                    f"{len(self._merge_conflicts)} conflicts")
+        return new
+
+    def _orders_index(self) -> dict[int, int]:
+        """Returns {order number: position in 'frame'}, built once then updated by 'merge'. A repeated order maps to
+        its first position"""
+        if self._order_index is None:
+            if self._trade_objects is not None:
+                orders = [trade.order for trade in self._trade_objects]
+            else:
+                orders = self._trade_frame['order'].tolist()
+            self._order_index = {}
+            for position, order in enumerate(orders):
+                self._order_index.setdefault(order, position)
+            if len(self._order_index) != len(orders):
+                logger.warning(f"{len(orders) - len(self._order_index)} trades repeat an order, merged trades are "
+                               f"compared with the first one")
+        return self._order_index
+
+    def _record_conflicts(self, incoming: pd.DataFrame, positions: np.ndarray) -> None:
+        """Compares the statement columns of known trades (at 'positions' of 'frame') with their incoming rows and
+        adds the ones that differ to 'merge_conflicts'"""
+        if self._trade_objects is not None:
+            existing = pd.DataFrame([self._trade_objects[position].__dict__ for position in positions])
+        else:
+            existing = self._trade_frame.iloc[positions].reset_index(drop=True)
+        incoming = incoming.reset_index(drop=True)
+        differs = {}
+        for name in TradeData._TRADE_ROW_COLUMNS:
+            if name in TradeData._TRADE_FLOAT_COLUMNS:
+                differs[name] = ~np.isclose(existing[name].to_numpy('float64'), incoming[name].to_numpy('float64'),
+                                            equal_nan=True)
+            elif name in TradeData._TRADE_CATEGORY_COLUMNS:
+                differs[name] = existing[name].astype(str).to_numpy() != incoming[name].astype(str).to_numpy()
+            else:
+                differs[name] = existing[name].to_numpy() != incoming[name].to_numpy()
+        conflicting = np.flatnonzero(np.logical_or.reduce(list(differs.values())))
+        recorded = 0
+        for row in conflicting:
+            order = int(existing['order'].iat[row])
+            recorded += order not in self._merge_conflicts  # the same statement merged again adds no conflict
+            self._merge_conflicts.setdefault(order, {}).update({
+                name: (existing[name].iat[row], incoming[name].iat[row]) for name, mask in differs.items() if mask[row]
+            })
+        if recorded:
+            logger.warning(f"{recorded} merged trades differ from the known trades with the same order, "
+                           f"known values kept, see 'TradeData.merge_conflicts'")
+
+    @property
+    def merge_conflicts(self) -> list[tuple[int, dict]]:
+        """Returns (order, {column: (kept value, merged value)}) of the trades 'merge' found with different values,
+        one per order"""
+        return list(self._merge_conflicts.items())
+
     @property
     def trades(self) -> list[Trade]:
-        """Returns a list with all trades (Trade objects)"""
+        """Returns a list with all trades (Trade objects). In columnar mode they are created on first access"""
+        if self._trade_objects is None:
+            self._trade_objects = TradeData._trades_from_frame(self._trade_frame)
         return self._trade_objects
 
+    @property
+    def frame(self) -> pd.DataFrame:
+        """Returns all trades as a dataframe with a column per Trade field"""
+        if not self.columnar:
+            return pd.DataFrame([trade.__dict__ for trade in self.trades], columns=TradeData._TRADE_FRAME_COLUMNS)
+        if self._trade_objects is not None:
+            # Trade objects were handed out (e.g. to TraderMadeClient to complete high and low), bring their values back
+            self._trade_frame['high'] = [trade.high for trade in self._trade_objects]
+            self._trade_frame['low'] = [trade.low for trade in self._trade_objects]
+        return self._trade_frame
+
+    @property
+    def forex_frame(self) -> pd.DataFrame:
+        """Returns 'frame' rows of Forex trades only"""
+        frame = self.frame
+        pairs = list(_PAIRS)
+        return frame[frame['base'].isin(pairs) & frame['quote'].isin(pairs)].reset_index(drop=True)
+
+    @property
+    def n_of_trades(self) -> int:
+        """Returns the number of trades"""
+        return len(self._trade_frame) if self._trade_objects is None else len(self._trade_objects)
+
+    @property
+    def malformed_rows(self) -> list[tuple[list, str]]:
+        """Returns (row, reason) tuples of the trade rows skipped by the batch/columnar parser"""
+        return self._malformed_rows
+
     @property
     def balances(self) -> list[Balance]:
         """Returns a list with all balance objects"""
@@ -301,6 +667,97 @@ class TradeData:
         return [t for t in self.trades if t.base in _PAIRS and t.quote in _PAIRS]
 
 
+class TokenBucket:
+    """Asyncio rate limiter. 'rate' tokens per second are added to the bucket, up to 'capacity' tokens.
+    Each request takes a token, waiting for one when the bucket is empty"""
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Waits until a token is available and takes it"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class TimeseriesWindow:
+    """One coalesced 'timeseries' request: bars of 'symbol' from 'start' to 'end', covering every trade in 'trades'"""
+    symbol: str
+    interval: str
+    period: int
+    start: dt.datetime
+    end: dt.datetime
+    trades: list[Trade] = field(default_factory=list)
+
+    @property
+    def estimated_rows(self) -> int:
+        """Number of bars the request returns at most (one per bar length from start to end)"""
+        return int((self.end - self.start) / TraderMadeClient._bar_length(self.interval, self.period)) + 1
+
+
+@dataclass
+class TimeseriesPlan:
+    """Coalesced 'timeseries' requests needed to complete the high and low of a list of trades.
+    max_requests and max_rows are the budget the plan was made for (None: no limit), 'downgraded' the number of
+    trades planned with a coarser interval than their optimal one to fit it"""
+    windows: list[TimeseriesWindow] = field(default_factory=list)
+    max_requests: int | None = None
+    max_rows: int | None = None
+    downgraded: int = 0
+
+    @property
+    def n_requests(self) -> int:
+        """Number of planned requests"""
+        return len(self.windows)
+
+    @property
+    def n_trades(self) -> int:
+        """Number of trades covered by the planned requests"""
+        return sum(len(window.trades) for window in self.windows)
+
+    @property
+    def estimated_rows(self) -> int:
+        """Number of bars all planned requests return at most"""
+        return sum(window.estimated_rows for window in self.windows)
+
+    @property
+    def within_budget(self) -> bool:
+        """True if the plan doesn't exceed max_requests nor max_rows"""
+        return ((self.max_requests is None or self.n_requests <= self.max_requests)
+                and (self.max_rows is None or self.estimated_rows <= self.max_rows))
+
+    def cost_report(self) -> dict:
+        """Dry run report of the plan: requests and rows it costs, budget, and trades per interval"""
+        trades_per_interval = {interval: 0 for interval in TraderMadeClient._ACCEPTABLE_PERIODS}
+        requests_per_interval = {interval: 0 for interval in TraderMadeClient._ACCEPTABLE_PERIODS}
+        for window in self.windows:
+            trades_per_interval[window.interval] += len(window.trades)
+            requests_per_interval[window.interval] += 1
+        return {
+            'trades': self.n_trades,
+            'requests': self.n_requests,
+            'estimated_rows': self.estimated_rows,
+            'max_requests': self.max_requests,
+            'max_rows': self.max_rows,
+            'within_budget': self.within_budget,
+            'downgraded_trades': self.downgraded,
+            'trades_per_interval': trades_per_interval,
+            'requests_per_interval': requests_per_interval,
+        }
+
+
 class TraderMadeClient:
     _BASE_URL = 'https://marketdata.tradermade.com/api/v1/'
     _TIMESERIES_ENDPOINT = 'timeseries'
@@ -314,37 +771,282 @@ class TraderMadeClient:
     _MAX_DAYS_FOR_MINUTE_CALL = 2
     _MAX_DAYS_FOR_DAILY_CALL = 28
     _ACCEPTABLE_PERIODS = ('minute', 'hourly', 'daily')
-
-    def __init__(self, tm_api_key):
+    # longest time span a single coalesced request may cover, per interval (see 'plan_timeseries_requests')
+    _MAX_WINDOW_DAYS = {'minute': _MAX_DAYS_FOR_MINUTE_CALL, 'hourly': _MAX_DAYS_FOR_DAILY_CALL,
+                        'daily': _DAYS_IN_A_YEAR}
+    # concurrent requests settings (see 'complete_trade_high_low_async')
+    _MAX_CONCURRENT_REQUESTS = 8
+    _REQUESTS_PER_SECOND = 5
+    _MAX_RETRIES = 3
+    _RETRY_BACKOFF_SECONDS = 1
+    _RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+    _REQUEST_TIMEOUT_SECONDS = 30
+
+    def __init__(self, tm_api_key, base_url: str = _BASE_URL, bar_cache: BarCache | None = None):
+        """base_url can point to any server implementing the Tradermade endpoints (e.g. a local stub server).
+        bar_cache: persistent bar store used as a read-through cache for 'timeseries' requests"""
         self._API_KEY = tm_api_key
+        self._base_url = base_url
+        self._bar_cache = bar_cache
+        self._session = TraderMadeClient._create_session(TraderMadeClient._MAX_CONCURRENT_REQUESTS)
         self._set_api_key()
 
-    def complete_trade_high_low(self, trades: list[Trade]) -> None:
+    def complete_trade_high_low(self, trades: list[Trade], coalesce: bool = False,
+                                progress: Callable[[int, int], None] | None = None,
+                                plan: TimeseriesPlan | None = None, concurrent: bool = False) -> None:
         """Completes 'trades.high' and 'trades.low' from a list of trades. Uses tradermade api to complete it
         'trades.high' is the max value in between 'trade.open_time' and 'trade.close_time'
-        'trades.low' is the min value in between 'trade.open_time' and 'trade.close_time'"""
-        for trade in trades:
+        'trades.low' is the min value in between 'trade.open_time' and 'trade.close_time'
+        coalesce=True sends one request per window of 'plan_timeseries_requests' instead of one per trade.
+        plan: a plan of these trades made beforehand (e.g. with a budget), implies coalesce=True.
+        progress(completed trades, total trades) is called after each request.
+        concurrent=True sends the requests concurrently with the default settings of 'complete_trade_high_low_async'
+        (rate limited, retried), it blocks until they're done"""
+        if concurrent:
+            self.complete_trade_high_low_concurrently(trades, coalesce=coalesce, progress=progress, plan=plan)
+            return
+        if coalesce or plan is not None:
+            plan = plan or self.plan_timeseries_requests(trades)
+            completed = 0
+            for window in plan.windows:
+                try:
+                    df = self._request_timeseries(self._window_params(window), ['high', 'low'],
+                                                  fetch=self._get_request)
+                    TraderMadeClient._fill_window_high_low(window, df)
+                except Exception as e:
+                    logger.warning(f"Failed to fetch high/low for {len(window.trades)} {window.symbol} trades "
+                                   f"from {window.start} to {window.end}: {e}")
+                completed += len(window.trades)
+                if progress:
+                    progress(completed, plan.n_trades)
+            return
+
+        for completed, trade in enumerate(trades, start=1):
             try:
                 df = self.patched_request(
                     endpoint='timeseries',
                     fields=['high', 'low'],
                     trade=trade
                 )
-
-                if df.empty:
-                    logger.warning(f"No data for trade {trade.order},"
-                                   f" high and low equal to max and minimum of trade's open and close prices")
-                    # if no data could be retrieved, return max and minimum from close and open prices
-                    trade.high = max(trade.open_price, trade.close_price)
-                    trade.low = min(trade.open_price, trade.close_price)
-                    continue
-                # high and low could be open or close prices, so we check weather the max and min values are
-                # in the api df call or in the trade object
-                trade.high = max(df['high'].max(), trade.open_price, trade.close_price)
-                trade.low = min(df['low'].min(), trade.open_price, trade.close_price)
+                TraderMadeClient._fill_high_low(trade, df)
 
             except Exception as e:
                 logger.warning(f"Failed to fetch high/low for trade {trade.order}: {e}")
+            if progress:
+                progress(completed, len(trades))
+
+    def complete_trade_high_low_concurrently(self, trades: list[Trade], **kwargs) -> None:
+        """Blocking version of 'complete_trade_high_low_async', for callers that are not running an event loop"""
+        asyncio.run(self.complete_trade_high_low_async(trades, **kwargs))
+
+    async def complete_trade_high_low_async(self, trades: list[Trade],
+                                            max_concurrency: int = _MAX_CONCURRENT_REQUESTS,
+                                            requests_per_second: float = _REQUESTS_PER_SECOND,
+                                            max_retries: int = _MAX_RETRIES,
+                                            backoff: float = _RETRY_BACKOFF_SECONDS,
+                                            coalesce: bool = False,
+                                            progress: Callable[[int, int], None] | None = None,
+                                            plan: TimeseriesPlan | None = None) -> None:
+        """Completes 'trades.high' and 'trades.low' exactly like 'complete_trade_high_low', sending up to
+        'max_concurrency' requests at once. Requests are rate limited to 'requests_per_second' (token bucket) and
+        retried up to 'max_retries' times on connection errors and 429/5xx responses, waiting backoff * 2 ** attempt.
+        Trades are completed as their request finishes, progress(completed trades, total trades) is called then"""
+        if coalesce or plan is not None:
+            plan = plan or self.plan_timeseries_requests(trades)
+            groups = [window.trades for window in plan.windows]
+            jobs = [functools.partial(self._request_timeseries, self._window_params(window), ['high', 'low'],
+                                      self._fetch_json) for window in plan.windows]
+
+            def fill(position: int, df: pd.DataFrame | None) -> None:
+                TraderMadeClient._fill_window_high_low(plan.windows[position],
+                                                       df if df is not None else pd.DataFrame())
+        else:
+            groups, jobs = [], []
+            for trade in trades:
+                try:
+                    params = self.build_params(endpoint='timeseries', trade=trade)
+                    jobs.append(functools.partial(self._request_timeseries, params, ['high', 'low'], self._fetch_json))
+                    groups.append([trade])
+                except Exception as e:
+                    logger.warning(f"Failed to build request for trade {trade.order}: {e}")
+
+            def fill(position: int, df: pd.DataFrame | None) -> None:
+                TraderMadeClient._fill_high_low(groups[position][0], df if df is not None else pd.DataFrame())
+
+        total = sum(len(group) for group in groups)
+        completed = 0
+
+        def on_result(position: int, df: pd.DataFrame | None) -> None:
+            nonlocal completed
+            fill(position, df)
+            completed += len(groups[position])
+            if progress:
+                progress(completed, total)
+
+        await self._run_concurrently(jobs, max_concurrency, requests_per_second, max_retries, backoff, on_result)
+
+    async def _run_concurrently(self, jobs: list[Callable], max_concurrency: int, requests_per_second: float,
+                                max_retries: int, backoff: float,
+                                on_result: Callable[[int, object], None] | None = None) -> list:
+        """Runs blocking request 'jobs' in a thread pool, at most 'max_concurrency' at once and rate limited.
+        Returns their results in order, None for jobs that still failed after 'max_retries' retries (connection
+        errors and 429/5xx responses) or failed with any other error.
+        on_result(job position, result) is called in the event loop as soon as each job is done"""
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(max_concurrency)
+        bucket = TokenBucket(rate=requests_per_second)  # capacity 1: no burst of 'max_concurrency' requests at start
+
+        async def attempt_job(job: Callable):
+            async with semaphore:
+                for attempt in range(max_retries + 1):
+                    await bucket.acquire()
+                    try:
+                        return await loop.run_in_executor(executor, job)
+                    except requests.exceptions.RequestException as e:
+                        if attempt == max_retries:
+                            logger.warning(f"Request failed after {attempt + 1} attempts: {e}")
+                            return None
+                        await asyncio.sleep(backoff * 2 ** attempt)
+                    except Exception as e:
+                        # e.g. a malformed response or a locked bar cache, the other jobs keep running
+                        logger.warning(f"Request failed: {e}")
+                        return None
+
+        async def run(position: int, job: Callable):
+            result = await attempt_job(job)
+            if on_result:
+                on_result(position, result)
+            return result
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            return await asyncio.gather(*(run(position, job) for position, job in enumerate(jobs)))
+
+    def plan_timeseries_requests(self, trades: list[Trade], max_requests: int | None = None,
+                                 max_rows: int | None = None) -> TimeseriesPlan:
+        """Groups trades by symbol and interval (see '_optimal_interval') and merges their time ranges into as few
+        'timeseries' requests as possible. A window is extended with the next trade (sorted by start) as long as it
+        stays within '_MAX_WINDOW_DAYS' of its interval; its period is the smallest optimal period of its trades.
+        With a budget (max_requests and/or max_rows, e.g. the remaining API quota), trades are moved to coarser
+        intervals until the plan fits it, starting with the trades losing the least accuracy: the ones whose new
+        bar length is the smallest relative to their duration. 'plan.cost_report()' is a dry run of the plan"""
+        ladders = []
+        for trade in trades:
+            try:
+                ladders.append((trade, TraderMadeClient._allowed_intervals(trade)))
+            except Exception as e:
+                logger.warning(f"Failed to plan request for trade {trade.order}: {e}")
+
+        if max_requests is None and max_rows is None:
+            plan = TraderMadeClient._plan_windows(ladders, [0] * len(ladders))
+        else:
+            plan = TraderMadeClient._plan_within_budget(ladders, max_requests, max_rows)
+
+        logger.info(f"{__name__} planned {plan.n_requests} timeseries requests for {plan.n_trades} trades "
+                    f"({plan.estimated_rows} rows at most)")
+        if not plan.within_budget:
+            logger.warning(f"{__name__} timeseries plan exceeds the budget even with every trade at its coarsest "
+                           f"interval: {plan.cost_report()}")
+        return plan
+
+    @staticmethod
+    def _plan_within_budget(ladders: list[tuple[Trade, list[str]]], max_requests: int | None,
+                            max_rows: int | None) -> TimeseriesPlan:
+        """Plan with few interval downgrades fitting the budget. Downgrades (trade, coarser interval) are sorted by
+        the resulting bar length / trade duration and applied one at a time until the plan fits (greedy). The plan
+        cost is not monotone in the downgrades (a downgraded trade can open a new window at its coarser interval),
+        so it's checked after each one, and downgrades that turn out not to be needed are undone afterwards: the
+        downgraded trades, last downgraded first, go back to the finest interval keeping the plan within budget.
+        Each move only updates the windows of the two (symbol, interval) groups the trade leaves and joins (see
+        '_GroupWindows')"""
+        downgrades = []
+        members = []  # '_GroupWindows' member of every trade at every interval of its ladder
+        for position, (trade, intervals) in enumerate(ladders):
+            duration = max(trade.delta_time.total_seconds(), 60)
+            members.append([])
+            for level, interval in enumerate(intervals):
+                period = TraderMadeClient._get_optimal_period(trade.delta_time, interval)
+                start = trade.open_time + TraderMadeClient._start_date_correction(
+                    interval, trade.open_time, trade.close_time)
+                members[position].append(_GroupWindows.member(start, trade.close_time, period, position))
+                if level:
+                    bar_length = TraderMadeClient._bar_length(interval, period)
+                    downgrades.append((bar_length.total_seconds() / duration, position, level))
+        downgrades.sort()
+        coarsest = TraderMadeClient._plan_windows(ladders, [len(intervals) - 1 for _, intervals in ladders],
+                                                  max_requests, max_rows)
+        coarsest.downgraded = sum(1 for _, intervals in ladders if len(intervals) > 1)
+        if not coarsest.within_budget:
+            return coarsest
+
+        levels = [0] * len(ladders)
+        groups = {}  # (symbol, interval): members of its trades, then their windows
+        for position, (trade, intervals) in enumerate(ladders):
+            groups.setdefault((trade.symbol, intervals[0]), []).append(members[position][0])
+        groups = {key: _GroupWindows(key[1], group) for key, group in groups.items()}
+        cost = [sum(group.n_requests for group in groups.values()), sum(group.n_rows for group in groups.values())]
+
+        def fits() -> bool:
+            return (max_requests is None or cost[0] <= max_requests) and (max_rows is None or cost[1] <= max_rows)
+
+        def move(position: int, level: int) -> None:
+            """Moves a trade to the interval at 'level' of its ladder, updating the plan cost"""
+            trade, intervals = ladders[position]
+            if (trade.symbol, intervals[level]) not in groups:
+                groups[trade.symbol, intervals[level]] = _GroupWindows(intervals[level])
+            left, joined = groups[trade.symbol, intervals[levels[position]]], groups[trade.symbol, intervals[level]]
+            requests_before, rows_before = left.n_requests + joined.n_requests, left.n_rows + joined.n_rows
+            left.remove(members[position][levels[position]])
+            joined.add(members[position][level])
+            cost[0] += left.n_requests + joined.n_requests - requests_before
+            cost[1] += left.n_rows + joined.n_rows - rows_before
+            levels[position] = level
+
+        applied = []
+        for _, position, level in downgrades:
+            if fits():
+                break
+            if level > levels[position]:
+                applied.append(position)
+                move(position, level)
+
+        for position in dict.fromkeys(reversed(applied)):  # last downgraded first, once per trade
+            downgraded = levels[position]
+            for level in range(downgraded):
+                move(position, level)
+                if fits():
+                    break
+            else:
+                move(position, downgraded)
+
+        plan = TraderMadeClient._plan_windows(ladders, levels, max_requests, max_rows)
+        plan.downgraded = sum(1 for level in levels if level)
+        return plan
+
+    @staticmethod
+    def _plan_windows(ladders: list[tuple[Trade, list[str]]], levels: list[int], max_requests: int | None = None,
+                      max_rows: int | None = None) -> TimeseriesPlan:
+        """Coalesced windows of trades, each trade at interval ladders[i][1][levels[i]]"""
+        groups = {}
+        for (trade, intervals), level in zip(ladders, levels):
+            interval = intervals[level]
+            period = TraderMadeClient._get_optimal_period(trade.delta_time, interval)
+            start = trade.open_time + TraderMadeClient._start_date_correction(
+                interval, trade.open_time, trade.close_time)
+            groups.setdefault((trade.symbol, interval), []).append((start, period, trade))
+
+        plan = TimeseriesPlan(max_requests=max_requests, max_rows=max_rows)
+        for (symbol, interval), members in groups.items():
+            max_span = dt.timedelta(days=TraderMadeClient._MAX_WINDOW_DAYS[interval])
+            window = None
+            for start, period, trade in sorted(members, key=lambda member: member[0]):
+                if window is not None and max(window.end, trade.close_time) - window.start <= max_span:
+                    window.end = max(window.end, trade.close_time)
+                    window.period = min(window.period, period)
+                    window.trades.append(trade)
+                    continue
+                window = TimeseriesWindow(symbol, interval, period, start, trade.close_time, [trade])
+                plan.windows.append(window)
+        return plan
 
     def patched_request(self, endpoint: str, fields, **kwargs) -> pd.DataFrame:
         """Gets data of a trade from the Tradermade API. Tradermade API requests functions raises Keyvalue error
@@ -354,10 +1056,44 @@ class TraderMadeClient:
         interval= one of ['daily', 'hourly', 'minute']"""
         # Create parameters for the API call
         params = self.build_params(endpoint=endpoint, **kwargs)
+        if endpoint == 'timeseries':
+            return self._request_timeseries(params, fields, fetch=self._get_request)
         # Request call
-        data = TraderMadeClient._get_request(params, endpoint=endpoint)
+        data = self._get_request(params, endpoint=endpoint)
         return TraderMadeClient._parse_response(data, fields=fields)
 
+    def _request_timeseries(self, params: dict, fields: list[str], fetch: Callable[[dict, str], dict]) -> pd.DataFrame:
+        """Returns the timeseries bars of 'params' with [date] + fields columns. 'fetch' sends the request,
+        ('_get_request' or '_fetch_json'). With a bar cache, a range cached with finer bars is served from them
+        (see 'BarCache.covering_resolution'), otherwise only the time ranges not cached yet are requested"""
+        if self._bar_cache is None:
+            return TraderMadeClient._parse_response(fetch(params, 'timeseries'), fields=fields)
+
+        symbol, interval, period = params['currency'], params['interval'], int(params['period'])
+        start = dt.datetime.strptime(params['start_date'], TraderMadeClient._TM_DATE_FORMAT_MINUTE)
+        end = dt.datetime.strptime(params['end_date'], TraderMadeClient._TM_DATE_FORMAT_MINUTE)
+        resolution = self._bar_cache.covering_resolution(symbol, interval, period, start, end)
+        if resolution is None:
+            resolution = (interval, period)
+            gaps = self._bar_cache.missing_ranges(symbol, interval, period, start, end)
+        else:
+            gaps = []  # cached with bars finer than (or as fine as) the requested ones
+        for gap_start, gap_end in gaps:
+            gap_params = dict(params,
+                              start_date=dt.datetime.strftime(gap_start, TraderMadeClient._TM_DATE_FORMAT_MINUTE),
+                              end_date=dt.datetime.strftime(gap_end, TraderMadeClient._TM_DATE_FORMAT_MINUTE))
+            data = fetch(gap_params, 'timeseries')
+            if 'quotes' not in data:
+                # errors are not saved as fetched ranges, they'll be requested again next time
+                logger.info(f'quotes not in response {data}')
+                continue
+            bars = pd.DataFrame(data['quotes']['data'], columns=data['quotes']['columns'])
+            self._bar_cache.store(symbol, interval, period, gap_start, gap_end, bars)
+
+        df = self._bar_cache.load(symbol, *resolution, start - TraderMadeClient._bar_length(interval, period), end)
+        df = df.iloc[TraderMadeClient._first_bar(df['date'].to_numpy('datetime64[ns]'), interval, period, start):]
+        return df[['date'] + fields] if fields else df
+
     def _build_historical_params(self, trade: Trade, time_unit: str = 'day') -> dict:
         """Create hour historical request parameters given:
          fields: any of ['open', 'close', 'high', 'low'];
@@ -391,13 +1127,21 @@ class TraderMadeClient:
 
         # Correct API inconsistent inclusion/exclusion logic for start date
         tm_start_correction = TraderMadeClient._start_date_correction(interval, trade.open_time, trade.close_time)
+        return self._timeseries_params(trade.symbol, interval, period, trade.open_time + tm_start_correction,
+                                       trade.close_time)
+
+    def _window_params(self, window: TimeseriesWindow) -> dict:
+        """Time series request parameters of a coalesced window (see 'plan_timeseries_requests')"""
+        return self._timeseries_params(window.symbol, window.interval, window.period, window.start, window.end)
 
+    def _timeseries_params(self, symbol: str, interval: str, period: int,
+                           start: dt.datetime, end: dt.datetime) -> dict:
+        """Time series request parameters of 'symbol' bars from 'start' to 'end'"""
         params = {
-            'currency': trade.symbol,
+            'currency': symbol,
             'api_key': self.api_key,
-            'start_date': dt.datetime.strftime(trade.open_time + tm_start_correction,
-                                               TraderMadeClient._TM_DATE_FORMAT_MINUTE),
-            'end_date': dt.datetime.strftime(trade.close_time, TraderMadeClient._TM_DATE_FORMAT_MINUTE),
+            'start_date': dt.datetime.strftime(start, TraderMadeClient._TM_DATE_FORMAT_MINUTE),
+            'end_date': dt.datetime.strftime(end, TraderMadeClient._TM_DATE_FORMAT_MINUTE),
             'interval': interval,
             'period': period,
             'format': 'split'
@@ -433,18 +1177,68 @@ class TraderMadeClient:
         except Exception as e:
             logger.info(f"Exception while trying to set the restful API {e}")
 
-    @staticmethod
-    def _get_request(params: dict, endpoint: str) -> dict:
+    def _get_request(self, params: dict, endpoint: str) -> dict:
         """make a request to tradermade.
          Type must be any of the available functionalities: 'timeseries', 'historical',
          'minute_historical', 'hourly_historical"""
-        request_url = TraderMadeClient._BASE_URL + endpoint
         try:
-            return requests.get(request_url, params).json()
+            return self._fetch_json(params, endpoint)
         except requests.exceptions.RequestException as e:
             logger.warning(f"Bad request: {e}")
             return {}
 
+    def _fetch_json(self, params: dict, endpoint: str) -> dict:
+        """Same request as '_get_request' through the pooled keep-alive session, but raises
+        'requests.exceptions.RequestException' on errors (and on retryable status codes) so they can be retried"""
+        response = self._session.get(self._base_url + endpoint, params=params,
+                                     timeout=TraderMadeClient._REQUEST_TIMEOUT_SECONDS)
+        if response.status_code in TraderMadeClient._RETRY_STATUS_CODES:
+            raise requests.exceptions.HTTPError(f"{response.status_code} response from {endpoint}", response=response)
+        return response.json()
+
+    @staticmethod
+    def _create_session(pool_size: int) -> requests.Session:
+        """Returns a session keeping up to 'pool_size' connections alive, one per concurrent request"""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    @staticmethod
+    def _fill_high_low(trade: Trade, df: pd.DataFrame) -> None:
+        """Sets 'trade.high' and 'trade.low' from a Tradermade response dataframe with 'high' and 'low' columns"""
+        if df.empty:
+            logger.warning(f"No data for trade {trade.order},"
+                           f" high and low equal to max and minimum of trade's open and close prices")
+            # if no data could be retrieved, return max and minimum from close and open prices
+            trade.high = max(trade.open_price, trade.close_price)
+            trade.low = min(trade.open_price, trade.close_price)
+            return
+        # high and low could be open or close prices, so we check weather the max and min values are
+        # in the api df call or in the trade object
+        trade.high = max(df['high'].max(), trade.open_price, trade.close_price)
+        trade.low = min(df['low'].min(), trade.open_price, trade.close_price)
+
+    @staticmethod
+    def _fill_window_high_low(window: TimeseriesWindow, df: pd.DataFrame) -> None:
+        """Sets high and low of every trade of a coalesced window from the bars of the shared response.
+        A trade takes the bars overlapping its own time range (see '_first_bar') and starting no later than its
+        close time"""
+        if df.empty:
+            for trade in window.trades:
+                TraderMadeClient._fill_high_low(trade, df)
+            return
+
+        df = df.assign(date=pd.to_datetime(df['date'])).sort_values('date')
+        dates = df['date'].to_numpy()
+        for trade in window.trades:
+            start = trade.open_time + TraderMadeClient._start_date_correction(
+                window.interval, trade.open_time, trade.close_time)
+            first = TraderMadeClient._first_bar(dates, window.interval, window.period, start)
+            last = np.searchsorted(dates, np.datetime64(trade.close_time), side='right')
+            TraderMadeClient._fill_high_low(trade, df.iloc[first:last])
+
     @staticmethod
     def _optimal_interval(trade: Trade) -> str:
         """Selects the correct, most optimal interval ('daily', 'hourly', 'minute') to get tm.time_series info
@@ -474,6 +1268,13 @@ class TraderMadeClient:
         logger.info(f"{__name__} is less than month old: {less_than_month_old} less than_year_old {less_than_year_old}")
         return interval
 
+    @staticmethod
+    def _allowed_intervals(trade: Trade) -> list[str]:
+        """Intervals the API serves for a trade, from the finest ('_optimal_interval') to the coarsest ('daily'): a
+        trade served at an interval is served at every coarser one"""
+        intervals = list(TraderMadeClient._ACCEPTABLE_PERIODS)
+        return intervals[intervals.index(TraderMadeClient._optimal_interval(trade)):]
+
     @staticmethod
     def _get_optimal_period(delta_time: dt.timedelta, interval: str) -> int:
         """Selects the largest possible period for a trade,
@@ -509,6 +1310,23 @@ class TraderMadeClient:
                         f'returned 1 to avoid crash, not optimal')
         return 1
 
+    @staticmethod
+    def _bar_length(interval: str, period: int) -> dt.timedelta:
+        """Returns the time covered by a bar of a given interval ('minute', 'hourly', 'daily') and period"""
+        return dt.timedelta(minutes=_BAR_MINUTES[interval] * int(period))
+
+    @staticmethod
+    def _first_bar(dates: np.ndarray, interval: str, period: int, start: dt.datetime) -> int:
+        """Position of the first bar (in sorted bar dates) overlapping a timeseries range starting at 'start', as
+        given to the API. Bars starting up to one bar length before 'start' overlap it. Daily starts already include
+        '_start_date_correction' (a day before the open day), so the days after the start day overlap it: no bar
+        length is subtracted again, and finer cached bars serving a daily request start at midnight too"""
+        if interval == 'daily':
+            day_after = dt.datetime.combine(start.date(), dt.time()) + dt.timedelta(days=1)
+            return int(np.searchsorted(dates, np.datetime64(day_after), side='left'))
+        bar_start = start - TraderMadeClient._bar_length(interval, period)
+        return int(np.searchsorted(dates, np.datetime64(bar_start), side='right'))
+
     @staticmethod
     def _is_recent_than(date: dt.datetime, days: int) -> bool:
         """checks weather a date is older than 'days' days"""
@@ -558,6 +1376,267 @@ class TraderMadeClient:
         return self._API_KEY
 
 
+class _GroupWindows:
+    """Requests and rows of the windows 'TraderMadeClient._plan_windows' makes of one (symbol, interval) group of
+    trades, kept up to date as trades join or leave the group. Windows are formed from the earliest trade on, so
+    after a change only the windows from the one before the changed trade are formed again, until a window starts
+    at the same trade as before: the following windows are the same.
+    Invariants, after every change the windows are the ones '_plan_windows' would form:
+    - '_members' is sorted, '_starts' holds the first member of every window in that order, and the members of
+      window i are the ones from '_starts[i]' up to (not including) '_starts[i + 1]'.
+    - '_ends', '_periods' and '_rows' of window i are the max end, min period and rows of its members, 'n_rows' is
+      the sum of '_rows'.
+    - A member starting window i + 1 ends after '_ends[i]' (it didn't fit window i), so a member of window i
+      ending before '_ends[i]' is neither the first member of a window nor the one that makes the next one start"""
+
+    def __init__(self, interval: str, members: list[tuple] = ()):
+        """members: see 'member', in any order"""
+        self._max_span = TraderMadeClient._MAX_WINDOW_DAYS[interval] * 24 * 60 * 60
+        self._bar_seconds = _BAR_MINUTES[interval] * 60
+        self._members = sorted(members)
+        # first member, end, period and rows of every window
+        self._starts, self._ends, self._periods, self._rows = [], [], [], []
+        self.n_rows = 0
+        self._form_windows(0, 0)
+
+    @staticmethod
+    def member(start: dt.datetime, end: dt.datetime, period: int, position: int) -> tuple[float, int, float, int]:
+        """Member of a trade: (start, position, end, period), times in seconds. Sorted as '_plan_windows' sorts
+        trades: by start, then in the order they are given"""
+        return (start - _EPOCH).total_seconds(), position, (end - _EPOCH).total_seconds(), int(period)
+
+    @property
+    def n_requests(self) -> int:
+        """Number of windows, one request each"""
+        return len(self._starts)
+
+    def add(self, member: tuple) -> None:
+        """Adds a trade's member. If it fits the window of the member before it, only that window changes"""
+        index = bisect.bisect_left(self._members, member)
+        self._members.insert(index, member)
+        window = self._first_window(index)
+        if index:
+            start, end = self._starts[window][0], max(self._ends[window], member[2])
+            if end - start <= self._max_span:
+                # every later member of the window still fits it, and the next window start still doesn't
+                period = min(self._periods[window], member[3])
+                rows = self._window_rows(start, end, period)
+                self.n_rows += rows - self._rows[window]
+                self._ends[window], self._periods[window], self._rows[window] = end, period, rows
+                return
+        self._form_windows(index, window)
+
+    def remove(self, member: tuple) -> None:
+        """Removes a trade's member. If it ends before the end of the window of the member before it, it's in that
+        window and the windows keep their members: only the window period can change"""
+        index = bisect.bisect_left(self._members, member)
+        del self._members[index]
+        window = self._first_window(index)
+        if not index or member[2] >= self._ends[window]:
+            self._form_windows(index, window)
+        elif member[3] <= self._periods[window]:
+            first = bisect.bisect_left(self._members, self._starts[window])
+            last = bisect.bisect_left(self._members, self._starts[window + 1]) if window + 1 < len(self._starts) \
+                else len(self._members)
+            period = min(map(operator.itemgetter(3), self._members[first:last]))
+            rows = self._window_rows(self._starts[window][0], self._ends[window], period)
+            self.n_rows += rows - self._rows[window]
+            self._periods[window], self._rows[window] = period, rows
+
+    def _first_window(self, index: int) -> int:
+        """Window holding the member before 'index', the first one a change at 'index' can affect"""
+        return max(bisect.bisect_right(self._starts, self._members[index - 1]) - 1, 0) if index else 0
+
+    def _window_rows(self, start: float, end: float, period: int) -> int:
+        """Rows of a window, as 'TimeseriesWindow.estimated_rows'"""
+        return int((end - start) / (self._bar_seconds * period)) + 1
+
+    def _form_windows(self, changed: int, first_window: int) -> None:
+        """Forms windows again from 'first_window' on, after a change of the members at index 'changed'"""
+        members = self._members
+        old_starts = {start: number for number, start in enumerate(self._starts[first_window + 1:], first_window + 1)}
+        resumed = len(self._starts)
+        index = bisect.bisect_left(members, self._starts[first_window]) if first_window else 0
+        windows = []  # (first member, end, period)
+        while index < len(members):
+            member = members[index]
+            if not windows or max(windows[-1][1], member[2]) - windows[-1][0][0] > self._max_span:
+                if index >= changed and member in old_starts:
+                    resumed = old_starts[member]
+                    break
+                windows.append((member, member[2], member[3]))
+            else:
+                first, end, period = windows[-1]
+                windows[-1] = (first, max(end, member[2]), min(period, member[3]))
+            index += 1
+        self._starts[first_window:resumed] = [first for first, _, _ in windows]
+        self._ends[first_window:resumed] = [end for _, end, _ in windows]
+        self._periods[first_window:resumed] = [period for _, _, period in windows]
+        self._rows[first_window:resumed] = [self._window_rows(first[0], end, period) for first, end, period in windows]
+        self.n_rows = sum(self._rows)
+
+
+class RangeExtremaIndex:
+    """Sparse table over a bar series. Answers the max high and min low of any range of consecutive bars, and the
+    bars at which they occurred, in O(1) per range after an O(n log n) build (int32 bar positions, log2(n) levels).
+    dates must be sorted"""
+
+    def __init__(self, dates: np.ndarray, highs: np.ndarray, lows: np.ndarray):
+        self.dates = np.asarray(dates)
+        self.highs = np.asarray(highs, dtype='float64')
+        self.lows = np.asarray(lows, dtype='float64')
+        self._argmax = RangeExtremaIndex._build_table(self.highs, np.greater)
+        self._argmin = RangeExtremaIndex._build_table(self.lows, np.less)
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def query(self, starts: np.ndarray, ends: np.ndarray) -> pd.DataFrame:
+        """Returns a dataframe with a row per (start, end) pair and columns high, low, high_date, low_date, for
+        the bars with start < date <= end. Ranges without bars are NaN/NaT"""
+        first = np.searchsorted(self.dates, starts, side='right')
+        last = np.searchsorted(self.dates, ends, side='right')
+        return self.query_positions(first, last)
+
+    def query_positions(self, first: np.ndarray, last: np.ndarray) -> pd.DataFrame:
+        """Same as 'query' for bar positions, ranges are [first, last)"""
+        first = np.asarray(first, dtype='int64')
+        last = np.asarray(last, dtype='int64')
+        empty = first >= last
+        if not len(self):
+            return pd.DataFrame({'high': np.nan, 'low': np.nan, 'high_date': pd.NaT, 'low_date': pd.NaT},
+                                index=range(len(first)))
+        high_at = RangeExtremaIndex._query_table(self._argmax, self.highs, first, last, empty, np.greater)
+        low_at = RangeExtremaIndex._query_table(self._argmin, self.lows, first, last, empty, np.less)
+        result = pd.DataFrame({
+            'high': self.highs[high_at],
+            'low': self.lows[low_at],
+            'high_date': self.dates[high_at],
+            'low_date': self.dates[low_at],
+        })
+        result.loc[empty, :] = None
+        return result
+
+    @staticmethod
+    def _build_table(values: np.ndarray, better: Callable) -> np.ndarray:
+        """Returns a (levels, n) table, table[k, i] is the position of the best value in [i, i + 2 ** k)
+        ('better' is np.greater for maxima and np.less for minima, ties keep the earliest bar)"""
+        n = len(values)
+        table = np.empty((max(n, 1).bit_length(), n), dtype='int32')
+        table[0] = np.arange(n, dtype='int32')
+        for k in range(1, len(table)):
+            half, width = 2 ** (k - 1), n - 2 ** k + 1
+            left, right = table[k - 1, :width], table[k - 1, half:half + width]
+            table[k, :width] = np.where(better(values[right], values[left]), right, left)
+            table[k, width:] = table[k - 1, width:]  # ranges running past the last bar are never queried
+        return table
+
+    @staticmethod
+    def _query_table(table: np.ndarray, values: np.ndarray, first: np.ndarray, last: np.ndarray, empty: np.ndarray,
+                     better: Callable) -> np.ndarray:
+        """Positions of the best value of every [first, last) range, two overlapping power of two blocks each.
+        Empty ranges return position 0 (they are masked by the caller)"""
+        length = np.where(empty, 1, last - first)
+        k = np.frexp(length)[1] - 1  # floor(log2(length))
+        left = table[k, np.where(empty, 0, first)]
+        right = table[k, np.where(empty, 0, last - 2 ** k)]
+        return np.where(better(values[right], values[left]), right, left)
+
+
+class BarFileClient:
+    """Offline market data provider, stands in for TraderMadeClient. Reads local bar files, one per symbol, named
+    '<SYMBOL>.csv' or '<SYMBOL>.parquet' (any case) with 'date', 'high' and 'low' columns e.g. M1 or H1 bars"""
+    _BAR_FILE_EXTENSIONS = ('.csv', '.parquet')
+
+    def __init__(self, directory: str):
+        """directory: folder holding the bar files. Files are read the first time their symbol is needed"""
+        self._directory = directory
+        self._files = {
+            os.path.splitext(name)[0].upper(): os.path.join(directory, name)
+            for name in sorted(os.listdir(directory))
+            if os.path.splitext(name)[1].lower() in BarFileClient._BAR_FILE_EXTENSIONS
+        }
+        self._bars = {}
+        logger.info(f"{__name__} bar files for {len(self._files)} symbols in {directory}")
+
+    def complete_trade_high_low(self, trades: list[Trade], progress: Callable[[int, int], None] | None = None) -> None:
+        """Completes 'trade.high' and 'trade.low' of Trade objects, same result as 'complete_frame_high_low'"""
+        frame = pd.DataFrame({
+            'symbol': [trade.symbol for trade in trades],
+            'open_time': pd.to_datetime([trade.open_time for trade in trades]),
+            'close_time': pd.to_datetime([trade.close_time for trade in trades]),
+            'open_price': np.array([trade.open_price for trade in trades], dtype='float64'),
+            'close_price': np.array([trade.close_price for trade in trades], dtype='float64'),
+        })
+        self.complete_frame_high_low(frame, progress)
+        for trade, high, low in zip(trades, frame['high'].to_list(), frame['low'].to_list()):
+            trade.high = high
+            trade.low = low
+
+    def complete_frame_high_low(self, frame: pd.DataFrame, progress: Callable[[int, int], None] | None = None) -> None:
+        """Sets the 'high' and 'low' columns of a trades frame (see 'TradeData.frame') in place, one vectorized
+        pass per symbol. A trade takes the bars overlapping its time range (starting after open time - bar length
+        and no later than close time). As in 'TraderMadeClient', high and low also account for the open and close
+        prices, and are the max/min of those prices when there are no bars.
+        progress(processed trades, total trades) is called after each symbol, columns are written at the end"""
+        highs = np.full(len(frame), np.nan)
+        lows = np.full(len(frame), np.nan)
+        completed = 0
+        for symbol, positions in frame.groupby('symbol', observed=True).indices.items():
+            extremes = self.range_extremes(symbol, frame['open_time'].to_numpy()[positions],
+                                           frame['close_time'].to_numpy()[positions])
+            if extremes is not None:
+                highs[positions] = extremes['high'].to_numpy('float64')
+                lows[positions] = extremes['low'].to_numpy('float64')
+            completed += len(positions)
+            if progress:
+                progress(completed, len(frame))
+
+        no_bars = np.isnan(highs).sum()
+        if no_bars:
+            logger.warning(f"No bars for {no_bars} trades, high and low equal to max and minimum of trade's open"
+                           f" and close prices")
+        open_prices = frame['open_price'].to_numpy()
+        close_prices = frame['close_price'].to_numpy()
+        frame['high'] = np.fmax(highs, np.maximum(open_prices, close_prices))
+        frame['low'] = np.fmin(lows, np.minimum(open_prices, close_prices))
+
+    def range_extremes(self, symbol: str, open_times: np.ndarray, close_times: np.ndarray) -> pd.DataFrame | None:
+        """Returns the high, low, high_date and low_date (see 'RangeExtremaIndex.query') of the bars overlapping
+        each open time - close time range of a symbol. None if there is no bar file for the symbol"""
+        bars = self._symbol_bars(symbol)
+        if bars is None:
+            return None
+        index, bar_length = bars
+        return index.query(np.asarray(open_times) - bar_length, close_times)
+
+    def _symbol_bars(self, symbol: str) -> tuple[RangeExtremaIndex, np.timedelta64] | None:
+        """Returns (bars index, bar length) of a symbol's bar file, None if there is no file"""
+        symbol = str(symbol).upper()
+        if symbol not in self._bars:
+            self._bars[symbol] = self._read_bars(symbol)
+        return self._bars[symbol]
+
+    def _read_bars(self, symbol: str) -> tuple[RangeExtremaIndex, np.timedelta64] | None:
+        """Reads a symbol's bar file and indexes it. The bar length is the shortest time between two consecutive
+        bars"""
+        filepath = self._files.get(symbol)
+        if filepath is None:
+            logger.warning(f"No bar file for {symbol} in {self._directory}")
+            return None
+        if filepath.lower().endswith('.parquet'):
+            bars = pd.read_parquet(filepath, columns=['date', 'high', 'low'])
+        else:
+            bars = pd.read_csv(filepath, usecols=['date', 'high', 'low'])
+        bars['date'] = pd.to_datetime(bars['date'])
+        bars = bars.dropna().sort_values('date')
+        dates = bars['date'].to_numpy()
+        gaps = np.diff(dates)
+        bar_length = gaps[gaps > np.timedelta64(0)].min() if (gaps > np.timedelta64(0)).any() else np.timedelta64(0)
+        logger.info(f"{__name__} {len(bars)} bars of {symbol} read from {filepath}")
+        return RangeExtremaIndex(dates, bars['high'].to_numpy('float64'), bars['low'].to_numpy('float64')), bar_length
+
+
 if __name__ == '__main__':
     aux = FileParser.from_filepath('../data/statement.htm')
     now = TradeData(aux)
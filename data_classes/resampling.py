@@ -0,0 +1,277 @@
+from config import get_logger
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from statistics import NormalDist
+from typing import Callable
+import numpy as np
+import pandas as pd
+
+logger = get_logger(__name__)
+
+
+def _mean(samples: np.ndarray) -> np.ndarray:
+    """Mean of each resample (row)"""
+    return samples.mean(axis=1)
+
+
+def _median(samples: np.ndarray) -> np.ndarray:
+    """Median of each resample (row)"""
+    return np.median(samples, axis=1)
+
+
+def _profit_factor(samples: np.ndarray) -> np.ndarray:
+    """Gross revenue / gross loss of each resample (row), 0 when it has no losses"""
+    gross_revenue = np.where(samples > 0, samples, 0).sum(axis=1)
+    gross_loss = np.where(samples < 0, -samples, 0).sum(axis=1)
+    return np.divide(gross_revenue, gross_loss, out=np.zeros(len(samples)), where=gross_loss != 0)
+
+
+def _win_rate(samples: np.ndarray) -> np.ndarray:
+    """Share of positive values of each resample (row)"""
+    return (samples > 0).mean(axis=1)
+
+
+def _seeded_chunks(n_rows: int, row_size: int, chunk_elements: int,
+                   seed: int | None) -> list[tuple[int, np.random.SeedSequence]]:
+    """Splits 'n_rows' rows of 'row_size' values into chunks of at most 'chunk_elements' values (at least a row),
+    returns (number of rows, seed) pairs. Seeds are spawned from 'seed', so results don't depend on how chunks
+    are shared between workers"""
+    rows_per_chunk = max(1, chunk_elements // row_size)
+    sizes = [min(rows_per_chunk, n_rows - start) for start in range(0, n_rows, rows_per_chunk)]
+    return list(zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes))))
+
+
+def _map_chunks(function: Callable, args: tuple, chunks: list, n_workers: int) -> list:
+    """Returns [function(*args, group)] for contiguous groups of chunks: a single group without workers, else one
+    group per worker process, so 'args' (e.g. the data) is sent to each worker once"""
+    if n_workers <= 1 or len(chunks) == 1:
+        return [function(*args, chunks)]
+    bounds = np.linspace(0, len(chunks), min(n_workers, len(chunks)) + 1).astype(int)
+    groups = [chunks[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(function, *[[arg] * len(groups) for arg in args], groups))
+
+
+def _chunk_statistics(data: np.ndarray, statistic: Callable[[np.ndarray], np.ndarray],
+                      chunks: list[tuple[int, np.random.SeedSequence]]) -> np.ndarray:
+    """Statistic of every resample of 'chunks' ((number of resamples, seed) pairs), one chunk in memory at a time.
+    Module level function so it can run in a process pool"""
+    results = []
+    for n_rows, seed in chunks:
+        rng = np.random.default_rng(seed)
+        samples = data[rng.integers(0, len(data), size=(n_rows, len(data)))]
+        results.append(statistic(samples))
+    return np.concatenate(results) if results else np.empty(0)
+
+
+class BootstrapEngine:
+    """Bootstrap resampling of 1-D data in fixed size chunks: peak memory depends on 'chunk_elements', not on the
+    number of iterations. Every chunk has its own seed spawned from 'seed' (np.random.SeedSequence), so results are
+    the same with any number of worker processes. Statistics are functions of a 2-D array of resamples (one per row)
+    returning one value per row, by name: 'mean', 'median', 'profit_factor', 'win_rate'"""
+    _STATISTICS = {
+        'mean': _mean,
+        'median': _median,
+        'profit_factor': _profit_factor,
+        'win_rate': _win_rate,
+    }
+    _CHUNK_ELEMENTS = 2 ** 21  # resampled values held at once (16 MB of float64 plus their int64 indices)
+    _JACKKNIFE_CHUNK_ROWS = 256  # leave-one-out rows evaluated at once by the generic jackknife
+    _METHODS = ('percentile', 'bca')
+
+    def __init__(self, n_iterations: int = 10_000, seed: int | None = None, n_workers: int = 1,
+                 chunk_elements: int = _CHUNK_ELEMENTS):
+        """n_workers > 1 computes the chunks in a process pool. Custom statistics must then be picklable
+        (module level functions)"""
+        if n_iterations < 1:
+            raise ValueError(f"n_iterations must be at least 1, got {n_iterations}")
+        self.n_iterations = n_iterations
+        self.seed = seed
+        self.n_workers = n_workers
+        self.chunk_elements = chunk_elements
+
+    def distribution(self, data, statistic: str | Callable[[np.ndarray], np.ndarray] = 'mean') -> np.ndarray:
+        """Returns the 'n_iterations' bootstrap values of 'statistic' over 'data'"""
+        data = np.asarray(data, dtype='float64')
+        if data.size < 1:
+            raise ValueError("can't bootstrap an empty sample")
+        statistic = BootstrapEngine._statistic(statistic)
+        chunks = _seeded_chunks(self.n_iterations, data.size, self.chunk_elements, self.seed)
+        return np.concatenate(_map_chunks(_chunk_statistics, (data, statistic), chunks, self.n_workers))
+
+    def confidence_interval(self, data, statistic: str | Callable[[np.ndarray], np.ndarray] = 'mean', ci: float = 95,
+                            method: str = 'percentile') -> tuple[float, float]:
+        """Returns the (lower, upper) bounds of the 'ci'% bootstrap confidence interval of 'statistic'.
+        method: 'percentile', or 'bca' (bias corrected and accelerated, the acceleration comes from a jackknife,
+        closed form for the named statistics)"""
+        if not 0 < ci < 100:
+            raise ValueError(f"ci must be between 0 and 100, got {ci}")
+        if method not in BootstrapEngine._METHODS:
+            raise ValueError(f"method must be one of {BootstrapEngine._METHODS}, got {method}")
+        data = np.asarray(data, dtype='float64')
+        distribution = self.distribution(data, statistic)
+        alpha = (100 - ci) / 200
+        if method == 'percentile':
+            quantiles = (alpha, 1 - alpha)
+        else:
+            quantiles = BootstrapEngine._bca_quantiles(data, statistic, distribution, alpha)
+        lower, upper = np.quantile(distribution, quantiles)
+        return float(lower), float(upper)
+
+    @staticmethod
+    def _bca_quantiles(data: np.ndarray, statistic: str | Callable, distribution: np.ndarray,
+                       alpha: float) -> tuple[float, float]:
+        """BCa adjusted quantiles of the bootstrap distribution for a (alpha, 1 - alpha) interval"""
+        normal = NormalDist()
+        estimate = BootstrapEngine._statistic(statistic)(data[np.newaxis, :])[0]
+        below = (np.sum(distribution < estimate) + 0.5 * np.sum(distribution == estimate)) / len(distribution)
+        below = min(max(below, 1 / (2 * len(distribution))), 1 - 1 / (2 * len(distribution)))
+        bias = normal.inv_cdf(below)
+
+        jackknife = BootstrapEngine._jackknife(data, statistic)
+        deviations = jackknife.mean() - jackknife
+        denominator = 6 * np.sum(deviations ** 2) ** 1.5
+        acceleration = np.sum(deviations ** 3) / denominator if denominator else 0.0
+
+        quantiles = []
+        for z in (normal.inv_cdf(alpha), normal.inv_cdf(1 - alpha)):
+            quantiles.append(normal.cdf(bias + (bias + z) / (1 - acceleration * (bias + z))))
+        return quantiles[0], quantiles[1]
+
+    @staticmethod
+    def _jackknife(data: np.ndarray, statistic: str | Callable) -> np.ndarray:
+        """Leave-one-out values of 'statistic'. Closed form (linear time) for the named statistics, chunks of
+        leave-one-out resamples (quadratic time) for custom ones"""
+        n = len(data)
+        if n < 2:
+            return np.zeros(n)
+        if statistic == 'mean':
+            return (data.sum() - data) / (n - 1)
+        if statistic == 'win_rate':
+            wins = data > 0
+            return (wins.sum() - wins) / (n - 1)
+        if statistic == 'profit_factor':
+            revenue = np.where(data > 0, data, 0)
+            loss = np.where(data < 0, -data, 0)
+            gross_revenue, gross_loss = revenue.sum() - revenue, loss.sum() - loss
+            return np.divide(gross_revenue, gross_loss, out=np.zeros(n), where=gross_loss != 0)
+        if statistic == 'median':
+            # without the value of rank r, rank k of the remaining values is rank k + (k >= r) of the sorted data
+            ranks = np.empty(n, dtype='int64')
+            ranks[np.argsort(data, kind='stable')] = np.arange(n)
+            sorted_data = np.sort(data)
+            low, high = (n - 2) // 2, (n - 1) // 2
+            return (sorted_data[low + (low >= ranks)] + sorted_data[high + (high >= ranks)]) / 2
+
+        statistic = BootstrapEngine._statistic(statistic)
+        values = []
+        others = np.arange(n - 1)
+        for start in range(0, n, BootstrapEngine._JACKKNIFE_CHUNK_ROWS):
+            left_out = np.arange(start, min(start + BootstrapEngine._JACKKNIFE_CHUNK_ROWS, n))
+            values.append(statistic(data[others + (others >= left_out[:, np.newaxis])]))
+        return np.concatenate(values)
+
+    @staticmethod
+    def _statistic(statistic: str | Callable[[np.ndarray], np.ndarray]) -> Callable[[np.ndarray], np.ndarray]:
+        """Returns the statistic function of a statistic name (or the function itself)"""
+        if callable(statistic):
+            return statistic
+        try:
+            return BootstrapEngine._STATISTICS[statistic]
+        except KeyError:
+            raise ValueError(f"unknown statistic '{statistic}', expected one of {list(BootstrapEngine._STATISTICS)}"
+                             f" or a function")
+
+
+def _chunk_paths(profits: np.ndarray, method: str, chunks: list[tuple[int, np.random.SeedSequence]]) -> np.ndarray:
+    """Returns a (4, n) array: max drawdown, final pnl, lowest pnl and longest losing streak of every simulated
+    trade sequence of 'chunks', one 2-D chunk of sequences (one per row) in memory at a time. Module level function
+    so it can run in a process pool"""
+    results = []
+    for n_rows, seed in chunks:
+        rng = np.random.default_rng(seed)
+        if method == 'shuffle':
+            paths = rng.permuted(np.tile(profits, (n_rows, 1)), axis=1)
+        else:
+            paths = profits[rng.integers(0, len(profits), size=(n_rows, len(profits)))]
+        losing = paths <= 0  # as 'Metrics.won_trade', trades without profit are losses
+        losses = np.cumsum(losing, axis=1, dtype='int32')
+        # losses before the current losing streak: the count at the last winning trade
+        before_streak = np.where(losing, 0, losses)
+        np.maximum.accumulate(before_streak, axis=1, out=before_streak)
+        streak = (losses - before_streak).max(axis=1)
+
+        cum_profit = np.cumsum(paths, axis=1, out=paths)
+        peak = np.maximum.accumulate(cum_profit, axis=1)
+        np.maximum(peak, 0, out=peak)  # the starting 0 is the first peak
+        drawdown = np.subtract(peak, cum_profit, out=peak)
+        results.append(np.array([
+            -drawdown.max(axis=1),
+            cum_profit[:, -1],
+            np.minimum(cum_profit.min(axis=1), 0),
+            streak,
+        ]))
+    return np.concatenate(results, axis=1) if results else np.empty((4, 0))
+
+
+@dataclass(frozen=True)
+class MonteCarloResult:
+    """Distributions of path dependent statistics of simulated trade sequences, one value per simulation.
+    max_drawdown and lowest_pnl are <= 0 (as 'Metrics.max_drawdown'), lowest_pnl is the lowest cumulative profit"""
+    max_drawdown: np.ndarray
+    final_pnl: np.ndarray
+    lowest_pnl: np.ndarray
+    longest_losing_streak: np.ndarray
+
+    def probability_of_ruin(self, account_size: float, ruin_fraction: float = 1.0) -> float:
+        """Share of simulations where an account of 'account_size' loses 'ruin_fraction' of it at some point
+        (1: equity reaches 0, 0.5: half the account is lost)"""
+        return float(np.mean(self.lowest_pnl <= -account_size * ruin_fraction))
+
+    def summary(self, percentiles: tuple = (5, 25, 50, 75, 95)) -> pd.DataFrame:
+        """Percentiles (rows) of every statistic (columns)"""
+        distributions = {
+            'max_drawdown': self.max_drawdown,
+            'final_pnl': self.final_pnl,
+            'lowest_pnl': self.lowest_pnl,
+            'longest_losing_streak': self.longest_losing_streak,
+        }
+        return pd.DataFrame({name: np.percentile(values, percentiles) for name, values in distributions.items()},
+                            index=[f'p{percentile}' for percentile in percentiles])
+
+
+class MonteCarloSimulator:
+    """Simulates trade sequences from historical trade profits, in fixed size chunks of 2-D cumulative sums (peak
+    memory depends on 'chunk_elements', a few arrays of that size, not on the number of simulations). method:
+    'shuffle' reorders the same trades (final pnl never changes, drawdowns and streaks do), 'bootstrap' draws
+    trades with replacement. Seeded per chunk as 'BootstrapEngine', results are the same with any number of
+    worker processes"""
+    _CHUNK_ELEMENTS = 2 ** 21
+    _METHODS = ('shuffle', 'bootstrap')
+
+    def __init__(self, n_simulations: int = 10_000, method: str = 'shuffle', seed: int | None = None,
+                 n_workers: int = 1, chunk_elements: int = _CHUNK_ELEMENTS):
+        if n_simulations < 1:
+            raise ValueError(f"n_simulations must be at least 1, got {n_simulations}")
+        if method not in MonteCarloSimulator._METHODS:
+            raise ValueError(f"method must be one of {MonteCarloSimulator._METHODS}, got {method}")
+        self.n_simulations = n_simulations
+        self.method = method
+        self.seed = seed
+        self.n_workers = n_workers
+        self.chunk_elements = chunk_elements
+
+    def simulate(self, profits) -> MonteCarloResult:
+        """Returns the distributions of max drawdown, final pnl, lowest pnl and longest losing streak of
+        'n_simulations' sequences of 'profits' (e.g. Metrics.df.profit)"""
+        profits = np.asarray(profits, dtype='float64')
+        if profits.size < 1:
+            raise ValueError("can't simulate an empty trade sequence")
+        chunks = _seeded_chunks(self.n_simulations, profits.size, self.chunk_elements, self.seed)
+        paths = np.concatenate(_map_chunks(_chunk_paths, (profits, self.method), chunks, self.n_workers), axis=1)
+        return MonteCarloResult(
+            max_drawdown=paths[0],
+            final_pnl=paths[1],
+            lowest_pnl=paths[2],
+            longest_losing_streak=paths[3].astype('int64'),
+        )
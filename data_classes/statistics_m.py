@@ -1,5 +1,9 @@
 from data_classes.mt4data import Trade, TradeData, Balance  # noqa: F401
+from data_classes.resampling import BootstrapEngine, MonteCarloResult, MonteCarloSimulator
+from data_classes.equity import EquityCurve
+from data_classes.fx_rates import FxRateTable, contract_sizes
 from config import _METRICS_DF_KEYS, get_logger
+from dataclasses import dataclass
 import datetime as dt
 import numpy as np
 import pandas as pd
@@ -21,6 +25,176 @@ def zero_division_to_zero(func):
     return wrapper
 
 
+@dataclass(frozen=True)
+class KpiSummary:
+    """Sums and counts of a trades dataframe every KPI property of Metrics is derived from"""
+    n_of_trades: int
+    n_trades_won: int
+    n_trades_loss: int
+    gross_revenue: float
+    gross_loss: float
+    perfect_efficiency_income: float
+    largest_earning_trade: float
+    largest_loss_trade: float
+    std_profit: float
+
+    @classmethod
+    def from_df(cls, df: pd.DataFrame) -> 'KpiSummary':
+        """One pass over profit and won_trade (won and lost trades summed and counted together by np.bincount)"""
+        if df.empty:
+            # plain zeros, so KPI ratios of no trades divide by zero and fall back to 0 (see 'zero_division_to_zero')
+            return cls(0, 0, 0, 0, 0, 0, np.nan, np.nan, 0)
+        profit = df['profit'].to_numpy('float64')
+        won = df['won_trade'].to_numpy(dtype=bool)
+        counts = np.bincount(won, minlength=2)
+        sums = np.bincount(won, weights=profit, minlength=2)
+        return cls(
+            n_of_trades=len(profit),
+            n_trades_won=counts[1],
+            n_trades_loss=counts[0],
+            gross_revenue=sums[1],
+            gross_loss=sums[0],
+            perfect_efficiency_income=df['max_possible_gain'].to_numpy('float64').sum(),
+            largest_earning_trade=profit.max(),
+            largest_loss_trade=profit.min(),
+            std_profit=profit.std(ddof=1) if len(profit) > 1 else 0,
+        )
+
+
+class KpiRangeIndex:
+    """Range query index over a trades dataframe, built once in O(n log n). Prefix sums of profit, squared profit,
+    wins, losses and pips answer the sums, counts and profit std of any range of trades, and a segment tree over
+    cum_profit keeps the min, max, largest rise and largest fall of its nodes, so max run up and drawdown of a
+    range combine O(log n) nodes (8n floats, about 64 MB for a million trades). Each query is O(log n) and
+    independent of the number of trades in it, and many windows are answered at once with numpy. Trades are
+    ordered by close time"""
+    _PREFIX_COLUMNS = ['profit', 'gross_revenue', 'gross_loss', 'n_trades_won', 'n_trades_loss', 'pips',
+                       'squared_deviation']
+
+    def __init__(self, df: pd.DataFrame):
+        order = np.argsort(df['close_time'].to_numpy('datetime64[ns]'), kind='stable')
+        self.close_times = df['close_time'].to_numpy('datetime64[ns]')[order]
+        profit = df['profit'].to_numpy('float64')[order]
+        won = df['won_trade'].to_numpy(dtype=bool)[order]
+        # squares of deviations from the mean profit instead of squared profits, fewer digits lost in the variance
+        self._mean_profit = profit.mean() if len(profit) else 0.0
+        columns = {
+            'profit': profit,
+            'gross_revenue': np.where(won, profit, 0),
+            'gross_loss': np.where(won, 0, profit),
+            'n_trades_won': won,
+            'n_trades_loss': ~won,
+            'pips': df['pips'].to_numpy('float64')[order],
+            'squared_deviation': (profit - self._mean_profit) ** 2,
+        }
+        # prefix[:, i] is the sum of the first i trades, cum_profit with the starting 0 is the 'profit' row
+        self._prefix = np.zeros((len(columns), len(profit) + 1))
+        for row, column in enumerate(KpiRangeIndex._PREFIX_COLUMNS):
+            np.cumsum(columns[column], out=self._prefix[row, 1:])
+        self._tree = KpiRangeIndex._build_tree(self._prefix[0])
+
+    def __len__(self) -> int:
+        return len(self.close_times)
+
+    def query(self, starts, ends) -> pd.DataFrame:
+        """Returns a dataframe with a row per (start, end) pair, for the trades with start <= close_time <= end.
+        Columns: n_of_trades, n_trades_won, n_trades_loss, gross_revenue, gross_loss, net_income, pips, win_rate,
+        expectancy, profit_factor, std_profit, max_runup, max_drawdown (same definitions as the Metrics properties)
+        and sharpe_ratio (expectancy / std_profit, per trade and not annualized, 0 without deviation)"""
+        starts = pd.to_datetime(np.atleast_1d(starts)).to_numpy('datetime64[ns]')
+        ends = pd.to_datetime(np.atleast_1d(ends)).to_numpy('datetime64[ns]')
+        first = np.searchsorted(self.close_times, starts, side='left')
+        last = np.searchsorted(self.close_times, ends, side='right')
+        return self.query_positions(first, np.maximum(last, first))
+
+    def query_positions(self, first, last) -> pd.DataFrame:
+        """Same as 'query' for trade positions (in close time order), ranges are [first, last)"""
+        first = np.atleast_1d(np.asarray(first, dtype='int64'))
+        last = np.atleast_1d(np.asarray(last, dtype='int64'))
+        sums = self._prefix[:, last] - self._prefix[:, first]
+        result = pd.DataFrame(dict(zip(KpiRangeIndex._PREFIX_COLUMNS, sums)))
+        n_of_trades = last - first
+        result.insert(0, 'n_of_trades', n_of_trades)
+        result = result.rename(columns={'profit': 'net_income'})
+        result[['n_trades_won', 'n_trades_loss']] = result[['n_trades_won', 'n_trades_loss']].round().astype('int64')
+
+        traded = n_of_trades > 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # no trades: 0 (as 'zero_division_to_zero'), no losses: inf (as 'Metrics.profit_factor')
+            result['win_rate'] = np.where(traded, result['n_trades_won'] / n_of_trades, 0)
+            result['expectancy'] = np.where(traded, result['net_income'] / n_of_trades, 0)
+            result['profit_factor'] = np.where(traded, np.abs(result['gross_revenue'] / result['gross_loss']), 0)
+            deviation = result['net_income'] - n_of_trades * self._mean_profit
+            variance = (result['squared_deviation'] - deviation ** 2 / n_of_trades) / (n_of_trades - 1)
+            result['std_profit'] = np.where(n_of_trades > 1, np.sqrt(np.maximum(variance, 0)), 0)
+            result['sharpe_ratio'] = np.where(result['std_profit'] > 0, result['expectancy'] / result['std_profit'], 0)
+        runup, drawdown = self._runs(first, last)
+        result['max_runup'] = runup
+        result['max_drawdown'] = -drawdown
+        return result[['n_of_trades', 'n_trades_won', 'n_trades_loss', 'gross_revenue', 'gross_loss', 'net_income',
+                       'pips', 'win_rate', 'expectancy', 'profit_factor', 'std_profit', 'sharpe_ratio', 'max_runup',
+                       'max_drawdown']]
+
+    def _runs(self, first: np.ndarray, last: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Max run up and max drawdown (positive) of cum_profit over trades [first, last), from the cum_profit
+        before the first trade. Bottom up segment tree query of all ranges together, one tree level at a time:
+        nodes on the left edge of a range are combined into 'left' and nodes on its right edge into 'right'"""
+        n = len(self._tree[0]) // 2
+        # leaf n + p is cum_profit after p trades: the range is leaves first to last (both included)
+        low, high = first + n, last + 1 + n
+        left, right = KpiRangeIndex._empty_nodes(len(first)), KpiRangeIndex._empty_nodes(len(first))
+        pending = low < high
+        while pending.any():
+            # nodes out of their range (or of a done range) are combined as empty nodes
+            take = pending & (low & 1 == 1)
+            left = KpiRangeIndex._combine(left, self._nodes(np.where(take, low, 0)))
+            low += take
+            take = pending & (high & 1 == 1)
+            high -= take
+            right = KpiRangeIndex._combine(self._nodes(np.where(take, high, 0)), right)
+            low >>= 1
+            high >>= 1
+            pending = low < high
+        _, _, rise, fall = KpiRangeIndex._combine(left, right)
+        return rise, fall
+
+    def _nodes(self, positions: np.ndarray) -> list[np.ndarray]:
+        """(min, max, rise, fall) of tree nodes, node 0 is an empty node"""
+        return [column[positions] for column in self._tree]
+
+    @staticmethod
+    def _build_tree(values: np.ndarray) -> list[np.ndarray]:
+        """Returns a segment tree over 'values' as four arrays of 2n nodes: min, max, rise and fall. Leaves are at
+        [n, 2n) and node i covers nodes 2i and 2i + 1 (node 0 is unused and kept empty). rise and fall are the
+        largest values[j] - values[i] and values[i] - values[j] with i <= j in the node"""
+        n = len(values)
+        tree = KpiRangeIndex._empty_nodes(2 * n)
+        tree[0][n:] = tree[1][n:] = values
+        for k in range((n - 1).bit_length() - 1, -1, -1):
+            # children of nodes [2 ** k, 2 ** (k + 1)) are leaves or nodes from 2 ** (k + 1), computed before
+            nodes = np.arange(2 ** k, min(2 ** (k + 1), n))
+            combined = KpiRangeIndex._combine([column[2 * nodes] for column in tree],
+                                              [column[2 * nodes + 1] for column in tree])
+            for column, values_of_nodes in zip(tree, combined):
+                column[nodes] = values_of_nodes
+        return tree
+
+    @staticmethod
+    def _combine(left: list[np.ndarray], right: list[np.ndarray]) -> list[np.ndarray]:
+        """(min, max, rise, fall) of ranges 'left' each followed by ranges 'right'"""
+        return [
+            np.minimum(left[0], right[0]),
+            np.maximum(left[1], right[1]),
+            np.maximum(np.maximum(left[2], right[2]), right[1] - left[0]),
+            np.maximum(np.maximum(left[3], right[3]), left[1] - right[0]),
+        ]
+
+    @staticmethod
+    def _empty_nodes(size: int) -> list[np.ndarray]:
+        """(min, max, rise, fall) of 'size' empty ranges, neutral for '_combine'"""
+        return [np.full(size, np.inf), np.full(size, -np.inf), np.zeros(size), np.zeros(size)]
+
+
 class Metrics:
     _CURRENCIES = {
         'EUR': '€',
@@ -31,6 +205,8 @@ class Metrics:
         'GBP': '£',
         'JPY': '¥',
     }
+    _PERIOD_MEASURES = ['profit', 'pips', 'count', 'win_rate']
+    _EQUITY_COLUMNS = ['order', 'open_time', 'close_time', 'profit', 'commission', 'taxes', 'swap']
     _DOW = {
         0: 'monday',
         1: 'tuesday',
@@ -41,7 +217,15 @@ class Metrics:
         6: 'sunday'
     }
 
-    def __init__(self, trades_df: pd.DataFrame, balance_df: pd.DataFrame, currency: str):
+    def __init__(self, trades_df: pd.DataFrame, balance_df: pd.DataFrame, currency: str,
+                 all_trades_df: pd.DataFrame | None = None, fx_rates: FxRateTable | None = None):
+        """all_trades_df: trades of every symbol (Forex or not) for the equity curve, see 'all_trades_df'.
+        fx_rates: rates used instead of the ones found in trades_df (e.g. with the rates of earlier trades), see
+        'fx_rates'"""
+        self._df_cache = {}
+        self._added_fx_rates = []
+        self._given_fx_rates = fx_rates
+        self._all_trades_df = all_trades_df
         self.df = trades_df.reset_index(drop=True)
         self.balance_df = balance_df
         self._currency = currency.upper()
@@ -61,11 +245,189 @@ class Metrics:
         """Creates a Metrics object from a df created from a dataframe with all columns of self.df existing.
         Intended to create objects from self.df themselves"""
         currency = trade_data.currency
-        trade_dict = [trade.__dict__ for trade in trade_data.forex_trades]  # Create dict from Trade object
-        df = pd.DataFrame(trade_dict)
+        if trade_data.columnar:
+            df = trade_data.forex_frame  # columns are already typed, no per trade dict needed
+        else:
+            trade_dict = [trade.__dict__ for trade in trade_data.forex_trades]  # Create dict from Trade object
+            df = pd.DataFrame(trade_dict)
         balance_dict = [balance.__dict__ for balance in trade_data.balances]  # Crate dict from Balance object
         balance_df = pd.DataFrame(balance_dict)
-        return cls(df, balance_df, currency)
+        all_trades_df = trade_data.frame[Metrics._EQUITY_COLUMNS]
+        return cls(df, balance_df, currency, all_trades_df)
+
+    @classmethod
+    def view(cls, completed_df: pd.DataFrame, balance_df: pd.DataFrame, currency: str,
+             all_trades_df: pd.DataFrame | None = None) -> 'Metrics':
+        """Creates a Metrics object from a dataframe that already has every column of self.df (e.g. rows of another
+        Metrics object), without sorting it or computing its columns again"""
+        metrics = cls.__new__(cls)
+        metrics._df_cache = {}
+        metrics._added_fx_rates = []
+        metrics._given_fx_rates = None
+        metrics._all_trades_df = all_trades_df
+        metrics.df = completed_df
+        metrics.balance_df = balance_df
+        metrics._currency = currency.upper()
+        return metrics
+
+    @property
+    def df(self) -> pd.DataFrame:
+        """Returns the trades dataframe"""
+        return self._df
+
+    @df.setter
+    def df(self, df: pd.DataFrame) -> None:
+        """Replaces the trades dataframe, cached KPIs are computed again on next access"""
+        self._df = df
+        self._df_cache = {}
+
+    @property
+    def balance_df(self) -> pd.DataFrame:
+        """Returns the balance operations (deposits and withdrawals) dataframe"""
+        return self._balance_df
+
+    @balance_df.setter
+    def balance_df(self, balance_df: pd.DataFrame) -> None:
+        """Replaces the balance operations dataframe, the cached equity curve is computed again on next access"""
+        self._balance_df = balance_df
+        self._df_cache = {}
+
+    @property
+    def all_trades_df(self) -> pd.DataFrame:
+        """Returns order, open and close time, profit, commission, taxes and swap of every trade, Forex or not (e.g.
+        indices and metals trades that 'df' leaves out). Same as 'df' for objects created from Forex trades only"""
+        return self._df if self._all_trades_df is None else self._all_trades_df
+
+    @property
+    def equity(self) -> EquityCurve:
+        """Account equity curve of every trade (see 'all_trades_df') and balance operations, computed once per
+        dataframe (see 'EquityCurve': time and money weighted returns, percentage drawdown, Sharpe, Sortino and Calmar
+        ratios)"""
+        return self._cached('equity', lambda df: EquityCurve(self.all_trades_df, self.balance_df))
+
+    @property
+    def fx_rates(self) -> FxRateTable:
+        """Rates converting quote currencies to the account currency, found in the trades (see
+        'FxRateTable.from_trades', or the table given to __init__) plus the ones given to 'add_fx_rates'. Built once
+        per dataframe"""
+        return self._cached('fx_rates', self._build_fx_rates)
+
+    def add_fx_rates(self, rates: pd.DataFrame) -> None:
+        """Adds rates ('time', 'currency' and 'rate' columns, see 'FxRateTable.add') e.g. from daily bars of pairs
+        with the account currency, and computes max_possible_gain and max_possible_loss again with them"""
+        self._added_fx_rates.append(rates)
+        self._df_cache.pop('fx_rates', None)
+        if not self.df.empty:
+            df = self.df.copy()
+            self._add_max_possible_columns(df)
+            self.df = df
+
+    @property
+    def summary(self) -> KpiSummary:
+        """KPI sums and counts of 'df', computed once per dataframe (see 'KpiSummary')"""
+        return self._cached('summary', KpiSummary.from_df)
+
+    @property
+    def kpi_index(self) -> KpiRangeIndex:
+        """Range query index of 'df', built once per dataframe (see 'KpiRangeIndex')"""
+        return self._cached('kpi_index', KpiRangeIndex)
+
+    def range_kpis(self, starts, ends) -> pd.DataFrame:
+        """KPIs of the trades closed between each start and end date (scalars or arrays of dates), one row per
+        window, without filtering 'df' (see 'KpiRangeIndex.query')"""
+        return self.kpi_index.query(starts, ends)
+
+    def rolling_kpis(self, window: int | str, start_date=None, end_date=None) -> pd.DataFrame:
+        """KPIs of a rolling window ending at each trade, in close time order: the last 'window' trades (fewer for
+        the first trades), or the trades closed within a time window before it e.g. '30D'. One row per trade with
+        close_time and the columns of 'KpiRangeIndex.query' (win_rate, expectancy, profit_factor, std_profit,
+        sharpe_ratio, max_drawdown...), every window answered from 'kpi_index' without slicing 'df'.
+        start_date, end_date: only windows ending at trades closed between them (windows still include earlier
+        trades)"""
+        index = self.kpi_index
+        close_times = index.close_times
+        start, end = 0, len(index)
+        if start_date is not None:
+            start = close_times.searchsorted(pd.Timestamp(start_date).to_datetime64())
+        if end_date is not None:
+            end = max(close_times.searchsorted(pd.Timestamp(end_date).to_datetime64(), side='right'), start)
+        last = np.arange(start + 1, end + 1)
+        if isinstance(window, str):
+            window_starts = close_times[last - 1] - pd.Timedelta(window).to_timedelta64()
+            first = close_times.searchsorted(window_starts, side='right')
+        elif window >= 1:
+            first = np.maximum(last - window, 0)
+        else:
+            raise ValueError(f"window must be a number of trades (at least 1) or a time window, got {window}")
+        kpis = index.query_positions(first, last)
+        kpis.insert(0, 'close_time', close_times[last - 1])
+        return kpis
+
+    def _cached(self, name: str, compute):
+        """Returns compute(df), computed once per dataframe. The dataframe is kept with its value, so a value
+        computed while 'df' is being replaced (e.g. by 'update_high_low' in another thread) is never reused"""
+        df = self._df
+        cached = self._df_cache.get(name)
+        if cached is None or cached[0] is not df:
+            cached = (df, compute(df))
+            self._df_cache[name] = cached
+        return cached[1]
+
+    def between_dates(self, start_date, end_date) -> 'Metrics':
+        """Returns a Metrics view of the trades opened at or after 'start_date' and closed at or before 'end_date'.
+        The close time window is found by binary search, cum_profit is rebased to the window first trade and other
+        columns are reused as they are"""
+        df = self._df
+        close_times, is_sorted = self._close_times()
+        start, end = pd.Timestamp(start_date).to_datetime64(), pd.Timestamp(end_date).to_datetime64()
+        if is_sorted:
+            # open_time <= close_time, so trades opened after 'start_date' also closed after it
+            first, last = close_times.searchsorted(start), close_times.searchsorted(end, side='right')
+            window = df.iloc[first:last]
+        else:
+            first, last = 0, -1
+            window = df[(close_times >= start) & (close_times <= end)]
+        opened = window['open_time'].to_numpy() >= start
+        contiguous = len(window) == last - first and opened.all()
+        window = window[opened].reset_index(drop=True)
+
+        if contiguous:
+            # cum_profit of consecutive rows only moves by the profit of the trades before the window
+            window['cum_profit'] = window['cum_profit'] - (df['cum_profit'].iat[first - 1] if first else 0)
+        else:
+            window['cum_profit'] = window['profit'].cumsum()
+        all_trades_df = None
+        if self._all_trades_df is not None:
+            all_trades_df = self._all_trades_df
+            all_trades_df = all_trades_df[(all_trades_df['open_time'].to_numpy() >= start)
+                                          & (all_trades_df['close_time'].to_numpy() <= end)].reset_index(drop=True)
+        return Metrics.view(window, self._balance_between(start, end), self.currency, all_trades_df)
+
+    def _balance_between(self, start: np.datetime64, end: np.datetime64) -> pd.DataFrame:
+        """Balance operations of a date range view: the ones inside the range, after an opening balance at 'start'
+        with the account equity then (balance operations before it plus profit and costs of the trades closed
+        before it), so returns of the view are relative to the equity the account had"""
+        balance_df = self.balance_df
+        if balance_df.empty or not {'date', 'amount'} <= set(balance_df.columns):
+            return balance_df
+        dates = balance_df['date'].to_numpy('datetime64[ns]')
+        before = dates < start
+        inside = balance_df[~before & (dates <= end)]
+        if not before.any():
+            return inside.reset_index(drop=True)
+        trades = self.all_trades_df
+        closed = trades[trades['close_time'].to_numpy() < start]
+        opening = balance_df['amount'].to_numpy('float64')[before].sum() + closed['profit'].sum()
+        for column in EquityCurve._TRADE_COSTS:
+            if column in closed.columns:
+                opening += closed[column].fillna(0).sum()
+        opening_row = pd.DataFrame({'date': [pd.Timestamp(start)], 'amount': [float(opening)],
+                                    'balance_type': ['opening']})
+        return pd.concat([opening_row, inside], ignore_index=True)
+
+    def _close_times(self) -> tuple[np.ndarray, bool]:
+        """Returns close times of 'df' as an array and whether they are sorted, computed once per dataframe"""
+        return self._cached('close_times', Metrics._sorted_close_times)
 
     @property
     def currency(self) -> str:
@@ -83,17 +445,17 @@ class Metrics:
     @property
     def n_of_trades(self) -> int:
         """Returns total number of trades."""
-        return self.df.shape[0]
+        return self.summary.n_of_trades
 
     @property
     def n_trades_won(self) -> float:
         """Counts the number of winning trades"""
-        return self.df.won_trade.sum()
+        return self.summary.n_trades_won
 
     @property
     def n_trades_loss(self) -> float:
         """Counts the number of losing trades (negative profit)"""
-        return (self.df.won_trade == 0).sum()
+        return self.summary.n_trades_loss
 
     @property
     @zero_division_to_zero
@@ -104,12 +466,12 @@ class Metrics:
     @property
     def gross_revenue(self) -> float:
         """Sum of all wining trades profit"""
-        return self.df.profit[self.df['won_trade']].sum()
+        return self.summary.gross_revenue
 
     @property
     def gross_loss(self) -> float:
         """Sum of all losing trades loss"""
-        return self.df.profit[self.df.won_trade == 0].sum()
+        return self.summary.gross_loss
 
     @property
     def net_income(self) -> float:
@@ -148,7 +510,7 @@ class Metrics:
     @property
     def perfect_efficiency_income(self) -> float:
         """Profit if closed trade at best possible moment in between close time and open time"""
-        return self.df.max_possible_gain.sum()
+        return self.summary.perfect_efficiency_income
 
     @property
     @zero_division_to_zero
@@ -178,20 +540,17 @@ class Metrics:
     @property
     def largest_earning_trade(self) -> float:
         """Returns largest profit trade amount"""
-        return self.df.profit.max()
+        return self.summary.largest_earning_trade
 
     @property
     def largest_loss_trade(self) -> float:
         """Returns largest lose trade amount"""
-        return self.df.profit.min()
+        return self.summary.largest_loss_trade
 
     @property
     def std_profit(self) -> float:
         """Returns standard deviation of profit column"""
-        if self.n_of_trades < 2:
-            return 0
-        else:
-            return self.df.profit.std()
+        return self.summary.std_profit
 
     @property
     def max_runup(self):
@@ -201,128 +560,278 @@ class Metrics:
     def max_drawdown(self):
         return - self.get_max_run(drawdown=True)
 
+    @property
+    def underwater(self) -> pd.Series:
+        """Underwater curve: distance (<= 0) of cum_profit to its running peak, starting from a 0 peak"""
+        cum_profit = self.df.cum_profit.to_numpy('float64')
+        return pd.Series(cum_profit - Metrics._running_peak(cum_profit), index=self.df.index, name='underwater')
+
+    @property
+    def drawdown_bounds(self) -> tuple[int, int]:
+        """Returns (peak index, trough index) of the max drawdown in self.df. The peak index is -1 when the peak is
+        the starting 0 profit, (-1, -1) when there is no drawdown"""
+        cum_profit = self.df.cum_profit.to_numpy('float64')
+        if not len(cum_profit):
+            return -1, -1
+        drawdown = Metrics._running_peak(cum_profit) - cum_profit
+        trough = int(np.argmax(drawdown))
+        if drawdown[trough] <= 0:
+            return -1, -1
+        return int(Metrics._running_peak_position(cum_profit)[trough]), trough
+
+    @property
+    def drawdown_duration(self) -> dt.timedelta:
+        """Time from the max drawdown peak to its trough (close times, open time of the first trade for the
+        starting peak)"""
+        peak, trough = self.drawdown_bounds
+        if trough < 0:
+            return dt.timedelta(0)
+        return self.df.close_time.iloc[trough] - self._peak_time(peak)
+
+    @property
+    def longest_time_under_water(self) -> dt.timedelta:
+        """Longest time cum_profit stayed below a previous peak: from the peak to the first trade closing at or above
+        it again (or to the last trade if it never did)"""
+        starts, lengths = Metrics._true_runs(self.underwater.to_numpy() < 0)
+        if not len(starts):
+            return dt.timedelta(0)
+        close_times = self.df.close_time
+        ends = starts + lengths  # first trade back at the peak, len(df) if it never recovered
+        recovered = close_times.iloc[np.minimum(ends, len(close_times) - 1)].to_numpy()
+        peaks = close_times.iloc[np.maximum(starts - 1, 0)].to_numpy()
+        peaks = np.where(starts == 0, self.df.open_time.to_numpy()[0], peaks)
+        return pd.Timedelta((recovered - peaks).max()).to_pytimedelta()
+
     def get_max_run(self, drawdown=False) -> float:
         """Returns the value of the max run up of profit colum.  For drawdown = False get max drawdown"""
         # if we want the dropdown, we just flip the graph by changing sign (we flip the graph)
-        cum_profit = (-1) ** drawdown * self.df.cum_profit
-        min_val = 0
-        max_runup = 0
-        for val in cum_profit:
-            if val < min_val:
-                min_val = val
-            elif val - min_val > max_runup:
-                max_runup = val - min_val
-        return max_runup
+        cum_profit = (-1) ** drawdown * self.df.cum_profit.to_numpy('float64')
+        if not len(cum_profit):
+            return 0
+        # run up from the lowest value so far (0 at start) to each value
+        return max(float((cum_profit - np.minimum(np.minimum.accumulate(cum_profit), 0)).max()), 0)
 
     def sort_df_values(self, by):
         """sorts dataframe by values 'by'. 'by' must be any of the available column names"""
-        self.df.sort_values(by=by, inplace=True, ignore_index=True)
+        self.df = self.df.sort_values(by=by, ignore_index=True)
 
     def _complete_dataframe(self) -> None:
         """Add key columns to the dataframe for analysis.
 
         Columns: max_possible_gain, max_possible_loss, day_of_week, won_trade, accumulative_profit, 'pips'"""
 
-        self.df['max_possible_gain'] = self.df.apply(func=lambda row: round(self._get_max_gain(row, False), 2),
-                                                     axis='columns')
-        self.df['max_possible_loss'] = self.df.apply(func=lambda row: round(self._get_max_gain(row, True), 2),
-                                                     axis='columns')
+        self._add_max_possible_columns(self.df)
         self.df['cum_profit'] = self.df.profit.cumsum()
-        self.df['day_of_week'] = self.df.close_time.apply(func=lambda date: Metrics._DOW[date.weekday()])
+        self.df['day_of_week'] = self.df.close_time.dt.weekday.map(Metrics._DOW)
         self.df['won_trade'] = (self.df.profit > 0)
-        self.df['pips'] = self.df.apply(Metrics._get_pips, axis='columns')
+        self.df['pips'] = Metrics._pips_column(self.df)
         self.df.symbol = self.df.symbol.astype('category')
         self.df.order_type = self.df.order_type.astype('category')
         self.df.day_of_week = self.df.day_of_week.astype('category')
         self.df = self.df[_METRICS_DF_KEYS]
 
-    def _max_consecutive_streak(self, condition: bool = True) -> int:
-        """Returns the maximum consecutive streak of trades where won_trade == True | False"""
-        max_streak = 0
-        streak = 0
-        for val in self.df.won_trade:
-            if val == condition:
-                streak += 1
-                if streak > max_streak:
-                    max_streak = streak
-            else:
-                streak = 0
-        return max_streak
-
-    def _get_max_gain(self, row: pd.Series, max_loss: bool = False) -> float:
-        """gets max gain possible gain for a trade, taking into account whether it's a buy or a sell trade.
-        max_loss inverts the logic, so we can calculate the maximum possible loss. It's done by comparing it to what
-        the profit would have been if closed in high price (or low price for max_loss=True)"""
-
-        limits = [row.high, row.low]
+    def update_high_low(self, high_low: pd.DataFrame) -> None:
+        """Updates trades high and low from a dataframe with 'order', 'high' and 'low' columns (orders not in it keep
+        their values) and recomputes max_possible_gain/loss. Safe to call from another thread while the dataframe
+        is being read: the columns are computed on a copy, then 'self.df' is replaced in a single assignment"""
+        if self.df.empty:
+            return
+        df = self.df.copy()
+        values = high_low.drop_duplicates('order', keep='last').set_index('order')
+        df['high'] = df['order'].map(values['high']).fillna(df['high'])
+        df['low'] = df['order'].map(values['low']).fillna(df['low'])
+        self._add_max_possible_columns(df)
+        self.df = df
+
+    def _add_max_possible_columns(self, df: pd.DataFrame) -> None:
+        """Adds max_possible_gain and max_possible_loss columns to df, computed from its high and low columns.
+        The problems found are logged once with a count"""
+        quote_rates = self._quote_rates(df)
+        gain, gain_replaced = self._max_possible_column(df, quote_rates, max_loss=False)
+        loss, loss_replaced = self._max_possible_column(df, quote_rates, max_loss=True)
+        replaced = (gain_replaced | loss_replaced).sum()
+        if replaced:
+            logger.warning(f'In {replaced} trades max_possible_gain is less than profit (or max_possible_loss more '
+                           f'than profit), profit used instead')
+        no_rate = np.isnan(quote_rates).sum()
+        if no_rate:
+            logger.warning(f"In {no_rate} trades there is no {self.currency} rate of the quote currency, unable to "
+                           f"calculate max possible nor min possible, profit used instead (see 'add_fx_rates')")
+        df['max_possible_gain'] = gain
+        df['max_possible_loss'] = loss
+
+    def _quote_rates(self, df: pd.DataFrame) -> np.ndarray:
+        """Rate of the quote currency of every trade at close time (see 'fx_rates'). 1 for trades with the account
+        currency, which don't need it, NaN when there is no rate. df holds the trades of 'self.df' (or a copy)"""
+        rates = np.ones(len(df))
+        cross = ~self._quote_or_base_is_currency(df).to_numpy()
+        if cross.any():
+            rates[cross] = self.fx_rates.rates(df['quote'].to_numpy()[cross], df['close_time'].to_numpy()[cross])
+        return rates
+
+    def _build_fx_rates(self, df: pd.DataFrame) -> FxRateTable:
+        """Rates of the trades of df (or the given rates) and the added rates"""
+        if self._given_fx_rates is None:
+            fx_rates = FxRateTable.from_trades(df, self.currency)
+        elif self._added_fx_rates:
+            fx_rates = FxRateTable(self.currency)
+            fx_rates.update(self._given_fx_rates)  # a copy, added rates don't change the given table
+        else:
+            fx_rates = self._given_fx_rates
+        for rates in self._added_fx_rates:
+            fx_rates.add(rates)
+        return fx_rates
+
+    def _max_possible_column(self, df: pd.DataFrame, quote_rates: np.ndarray,
+                             max_loss: bool = False) -> tuple[np.ndarray, np.ndarray]:
+        """Returns (max possible gain of every trade rounded to 2 decimals, mask of trades where the profit was used
+        because the max possible gain was less than it). max_loss=True returns max possible losses instead"""
+        order_type = df['order_type'].to_numpy()
+        buy, sell = order_type == 'buy', order_type == 'sell'
+        high, low = df['high'].to_numpy('float64'), df['low'].to_numpy('float64')
         if max_loss:
-            # reverse if we're looking for max loss instead of max gain
-            limits.reverse()
-        gain = - 10 ** 100
-        if row.order_type == 'buy':
-            gain = self._get_trade_profit(row, limits[0])
-        elif row.order_type == 'sell':
-            gain = self._get_trade_profit(row, limits[1])
-
-        if Metrics._max_is_less_than_actual(gain, row.profit, max_loss):
-            logger.warning(f'In trade order: {row.order} max_possible_gain/loss {round(gain, 2)} '
-                           f'is less than profit {row.profit}')
-            return row.profit
-        return gain
-
-    def _get_trade_profit(self, row: pd.Series, final_value) -> float:
-        """Gets the profit from open_price to a settable final price.
-        if account currency is not the quote nor base currency, the rule of three is used.
-        This might not work when open and close price are equal, in which case profit returned is 0."""
-
-        lot = 10 ** 5  # a lot is 100 000 units
-        sign = (-1) ** (row.order_type == 'sell')
-        if row.quote == self.currency:
-            return sign * lot * row.volume * (final_value - row.open_price)
-
-        elif row.base == self.currency:
-            return sign * lot * row.volume * (final_value - row.open_price) / final_value
-        # TODO: create logic for cases where denom == 0. Calling the API to get account_currency/quote would satisfy
-        elif row.profit:
-            denominator = row.close_price - row.open_price
-            if denominator == 0:  # we are not able to calculate by rule of 3 when open price == close price
-                logger.warning(f"in trade {row.order} open and close prices are equal: {row.open_price},"
-                               f" unable to calculate max possible nor min possible be rule of three")
-                return row.profit
-            # apply rule of 3
-            return row.profit * (final_value - row.open_price) / (row.close_price - row.open_price)
+            high, low = low, high  # reverse if we're looking for max loss instead of max gain
+        final_value = np.where(buy, high, low)
+        gain = np.where(buy | sell, self._trade_profit_column(df, final_value, quote_rates), - 10 ** 100)
 
+        profit = df['profit'].to_numpy('float64')
+        if max_loss:
+            replaced = np.round(gain, 2) > np.round(profit, 2)
         else:
-            return row.profit
+            replaced = np.round(gain, 2) < np.round(profit, 2)
+        return np.round(np.where(replaced, profit, gain), 2), replaced
+
+    def _trade_profit_column(self, df: pd.DataFrame, final_value: np.ndarray, quote_rates: np.ndarray) -> np.ndarray:
+        """Profit of every trade if closed at 'final_value'. If the account currency is not the quote nor base
+        currency, the quote currency profit is converted with the rate of the quote currency at close time (see
+        'fx_rates'). Without a rate, profit is used"""
+        lot = contract_sizes(df['base'].to_numpy())
+        sign = np.where(df['order_type'].to_numpy() == 'sell', -1, 1)
+        volume = df['volume'].to_numpy('float64')
+        open_price = df['open_price'].to_numpy('float64')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            quote_profit = sign * lot * volume * (final_value - open_price)
+            base_profit = quote_profit / final_value
+            cross_profit = quote_profit * quote_rates
+        is_quote = df['quote'].to_numpy() == self.currency
+        is_base = df['base'].to_numpy() == self.currency
+        return np.select([is_quote, is_base, ~np.isnan(quote_rates)], [quote_profit, base_profit, cross_profit],
+                         default=df['profit'].to_numpy('float64'))
+
+    def _quote_or_base_is_currency(self, df: pd.DataFrame) -> pd.Series:
+        """True for trades whose quote or base currency is the account currency"""
+        return (df['quote'] == self.currency) | (df['base'] == self.currency)
 
-    def income_by_period(self, column: str, frequency: str) -> pd.DataFrame:
-        """returns a grouped dataframe with columns df[column].unique() and index my frequency: frequency end's."""
-
-        df = self.df[['close_time']].copy()
-        try:
-            if not column:
-                # if no column, just return profit for all rows of df
-                df = self.df[['close_time', 'profit']]
-
-            else:
-                for item in self.df[column].unique():
-                    # create column for each unique value in df[column] with values = 'profit'
-                    df[item] = self.df.profit[self.df[column] == item]
-
-        except KeyError:
+    def _max_consecutive_streak(self, condition: bool = True) -> int:
+        """Returns the maximum consecutive streak of trades where won_trade == True | False"""
+        _, lengths = Metrics._true_runs(self.df.won_trade.to_numpy() == condition)
+        return int(lengths.max()) if len(lengths) else 0
+
+    def _peak_time(self, peak: int) -> dt.datetime:
+        """Close time of the trade at index 'peak', open time of the first trade for the starting peak (-1)"""
+        return self.df.open_time.iloc[0] if peak < 0 else self.df.close_time.iloc[peak]
+
+    def grouped_kpis(self, by: str | list[str]) -> pd.DataFrame:
+        """KPIs of every group of trades, e.g. by='symbol' or by=['symbol', 'day_of_week'], in one groupby pass.
+        Returns a dataframe indexed by group (in order of first appearance) with columns n_of_trades, n_trades_won,
+        n_trades_loss, gross_revenue, gross_loss, net_income, perfect_efficiency_income, pips, win_rate,
+        expectancy, profit_factor, efficiency, max_runup and max_drawdown (as the properties of a Metrics object of
+        the group trades)"""
+        df = self.df
+        won = df['won_trade'].to_numpy(dtype=bool)
+        profit = df['profit'].to_numpy('float64')
+        columns = pd.DataFrame({
+            'n_of_trades': 1,
+            'n_trades_won': won.astype('int64'),
+            'n_trades_loss': (~won).astype('int64'),
+            'gross_revenue': np.where(won, profit, 0),
+            'gross_loss': np.where(won, 0, profit),
+            'net_income': profit,
+            'perfect_efficiency_income': df['max_possible_gain'].to_numpy('float64'),
+            'pips': df['pips'].to_numpy('float64'),
+        }, index=df.index)
+        keys = [df[key] for key in ([by] if isinstance(by, str) else by)]
+        grouping = dict(by=keys, sort=False, observed=True)
+        groups = columns.groupby(**grouping)
+        kpis = groups.sum()
+
+        # cum_profit of each group, runs are measured from a starting 0 as in 'get_max_run'
+        cum_profit = groups['net_income'].cumsum()
+        running = cum_profit.groupby(**grouping)
+        runup = (cum_profit - running.cummin().clip(upper=0)).groupby(**grouping).max()
+        drawdown = (running.cummax().clip(lower=0) - cum_profit).groupby(**grouping).max()
+
+        n_of_trades = kpis['n_of_trades']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            kpis['win_rate'] = kpis['n_trades_won'] / n_of_trades
+            kpis['expectancy'] = kpis['net_income'] / n_of_trades
+            # no trades: 0 (as 'zero_division_to_zero'), no losses: inf (as 'Metrics.profit_factor')
+            kpis['profit_factor'] = np.where(n_of_trades == 0, 0, (kpis['gross_revenue'] / kpis['gross_loss']).abs())
+            kpis['efficiency'] = np.where(n_of_trades == 0, 0,
+                                          kpis['gross_revenue'] / kpis['perfect_efficiency_income'])
+        kpis['max_runup'] = runup.clip(lower=0)
+        kpis['max_drawdown'] = -drawdown.clip(lower=0)
+        return kpis
+
+    def income_by_period(self, column: str | list[str] | None, frequency: str,
+                         measures: str | list[str] = 'profit') -> pd.DataFrame:
+        """returns a grouped dataframe with index by frequency (close time periods, e.g. 'W' or 'M') and a column per
+        unique value of df[column] (tuples of values for a list of columns e.g. ['symbol', 'order_type']), or a
+        single column if column is empty. measures: one of _PERIOD_MEASURES, or a list of them for columns
+        (measure, value). Every measure comes from the same groupby pass, periods without trades are 0 (NaN
+        win rate)"""
+        keys = ([column] if isinstance(column, str) else list(column)) if column else []
+        measure_list = [measures] if isinstance(measures, str) else list(measures)
+        unknown = [measure for measure in measure_list if measure not in Metrics._PERIOD_MEASURES]
+        if unknown:
+            raise ValueError(f"unknown measures {unknown}, expected any of {Metrics._PERIOD_MEASURES}")
+        missing = [key for key in keys if key not in self.df.columns]
+        if missing:
             logger.error(f"Column parameter for income_by_period '{column}'"
                          f" does not exist in dataframe:\n {self.df.head()}")
             return pd.DataFrame()
-        #
-        grouped_df = df.groupby(pd.Grouper(key='close_time', freq=frequency)).sum()
-        logger.info(f"This is the grouped df:\n {grouped_df.head()}")
+        if self.df.empty:
+            return pd.DataFrame()
+
+        df = self.df
+        values = pd.DataFrame({
+            'close_time': df['close_time'],
+            'profit': df['profit'].to_numpy('float64'),
+            'pips': df['pips'].to_numpy('float64'),
+            'count': 1,
+            'won': df['won_trade'].to_numpy(dtype='int64'),
+        }, index=df.index)
+        sums = values.groupby([pd.Grouper(key='close_time', freq=frequency)] + [df[key] for key in keys],
+                              observed=True).sum()
+        if keys:
+            sums = sums.unstack(list(range(1, len(keys) + 1)), fill_value=0)
+        sums = sums.resample(frequency).sum()  # periods without trades
+        with np.errstate(divide='ignore', invalid='ignore'):
+            periods = {
+                'profit': sums['profit'],
+                'pips': sums['pips'],
+                'count': sums['count'],
+                'win_rate': sums['won'] / sums['count'],
+            }
+
+        if not keys:
+            grouped_df = pd.DataFrame({measure: periods[measure] for measure in measure_list})
+        else:
+            # columns in order of first appearance, as df[column].unique()
+            order = pd.MultiIndex.from_frame(df[keys].drop_duplicates()) if len(keys) > 1 else df[keys[0]].unique()
+            grouped_df = pd.concat({measure: periods[measure].reindex(columns=order) for measure in measure_list},
+                                   axis='columns')
+            if isinstance(measures, str):
+                grouped_df = grouped_df[measures]
+        logger.debug(f"This is the grouped df:\n {grouped_df.head()}")
         return grouped_df
 
     @staticmethod
     def bootstrap_confidence_interval_mean(
-            data: pd.Series, n_iterations: int = 10000, ci: int = 95) -> (float, float, str):
-        """Returns a Confidence Interval of ci= percentage of the ci, statistic = numpy function (np.mean, np.std)
-        and n_iterations"""
+            data: pd.Series, n_iterations: int = 10000, ci: int = 95, seed: int | None = None) -> (float, float, str):
+        """Returns a Confidence Interval of ci= percentage of the ci of the mean, from n_iterations resamples.
+        Resamples are drawn in memory bounded chunks by a BootstrapEngine (see 'data_classes.resampling'),
+        a seed makes the result reproducible"""
         msg = 'This 95% CI is based on historical trade outcomes. Future results may differ.'
         if n_iterations < 1 or 1 > ci > 100 or not (isinstance(data[0], float) or isinstance(data[0], int)):
             logger.warning(f"can't run _bootstrap_confidence_interval_mean function with"
@@ -336,44 +845,60 @@ class Metrics:
         if size < 30:
             msg = 'bootstrap CI sample less than 30! result not very meaningful'
             logger.info(f"{__name__} {__class__} {msg}")
-        # produce n iterations of size data.size from data, to create samples. Values can repeat (replace=True)
-        samples = np.random.choice(data, size=(n_iterations, data.size), replace=True)
-        # get the mean of the n samples
-        stats = np.apply_along_axis(np.mean, axis=1, arr=samples)
-        lower = np.percentile(stats, (100 - ci) / 2)
-        upper = np.percentile(stats, 100 - (100 - ci) / 2)
+        # n iterations of size data.size resampled from data (values can repeat), the mean of each is kept
+        lower, upper = BootstrapEngine(n_iterations, seed=seed).confidence_interval(data, 'mean', ci=ci)
         return lower, upper, msg
 
+    def simulate_trade_sequences(self, n_simulations: int = 10_000, method: str = 'shuffle', seed: int | None = None,
+                                 n_workers: int = 1) -> MonteCarloResult:
+        """Monte Carlo distributions of max drawdown, final pnl, lowest pnl and longest losing streak of the trades
+        profits reshuffled ('shuffle') or resampled ('bootstrap') 'n_simulations' times (see 'MonteCarloSimulator').
+        e.g. metrics.simulate_trade_sequences(seed=1).probability_of_ruin(account_size=10_000)"""
+        simulator = MonteCarloSimulator(n_simulations, method=method, seed=seed, n_workers=n_workers)
+        return simulator.simulate(self.df.profit.to_numpy('float64'))
+
     @staticmethod
-    def _get_pips(row: pd.Series) -> int:
-        """Get pips as 0.0001 pair value difference. for JPY pair's it's 0.01."""
-        diff = abs(row.close_price - row.open_price)
-        sign = 1
-        if isinstance(row.won_trade, bool):
-            sign = (-1) ** (row.won_trade + 1)
-        if 'JPY' in row.symbol:
-            # for JPY pairs a pip is 0.01 times bigger than the minimum decimal
-            return int(round(sign * 100 * diff, 0))
-        else:
-            # for most other pairs a pip is 0.0001
-            return int(round(sign * 10 ** 4 * diff, 0))
+    def _sorted_close_times(df: pd.DataFrame) -> tuple[np.ndarray, bool]:
+        """Returns close times of a dataframe as an array and whether they are sorted"""
+        close_times = df['close_time'].to_numpy('datetime64[ns]')
+        return close_times, bool(np.all(close_times[1:] >= close_times[:-1]))
 
     @staticmethod
-    def _max_is_less_than_actual(maxim: float, actual: float, reverse: bool = False) -> bool:
-        """return true when a maxim value is less than a close price. Used to handle possible illogical results
-        in get_max_possible when best possible profit is less than actual profit"""
+    def _running_peak(values: np.ndarray) -> np.ndarray:
+        """Running max of values, starting from a 0 peak"""
+        return np.maximum(np.maximum.accumulate(values), 0) if len(values) else values
 
-        if reverse:
-            return round(maxim, 2) > round(actual, 2)
-        else:
-            return round(maxim, 2) < round(actual, 2)
+    @staticmethod
+    def _running_peak_position(values: np.ndarray) -> np.ndarray:
+        """Position of the running peak of each value (first time it was reached), -1 for the starting 0 peak"""
+        positions = np.arange(len(values))
+        previous_peak = np.concatenate([[0], Metrics._running_peak(values)[:-1]])
+        return np.maximum.accumulate(np.where(values > previous_peak, positions, -1))
+
+    @staticmethod
+    def _true_runs(mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Run length encoding of the True values of a boolean array: returns (run starts, run lengths)"""
+        edges = np.diff(np.concatenate([[0], mask.astype('int8'), [0]]))
+        starts = np.flatnonzero(edges == 1)
+        return starts, np.flatnonzero(edges == -1) - starts
+
+    @staticmethod
+    def _pips_column(df: pd.DataFrame) -> np.ndarray:
+        """Pips (0.0001 pair value difference, 0.01 for JPY pairs) of a dataframe with close_price, open_price,
+        won_trade and symbol columns"""
+        diff = (df['close_price'] - df['open_price']).abs().to_numpy('float64')
+        sign = np.where(df['won_trade'].to_numpy(dtype=bool), 1, -1)
+        symbols = df['symbol'].astype('category')
+        # pip size is looked up once per symbol: 0.01 for JPY pairs, 0.0001 for most other pairs
+        is_jpy = np.asarray(symbols.cat.categories.astype(str).str.contains('JPY'))[symbols.cat.codes.to_numpy()]
+        pip_factor = np.where(is_jpy, 100, 10 ** 4)
+        return np.round(sign * pip_factor * diff, 0).astype('int64')
 
 
 def metrics_between_dates(metrics_obj: Metrics, start_date: dt.datetime, end_date: dt.datetime) -> Metrics:
-    """Returns a metric object from a metric object given a start date and end date to filter."""
-    df = metrics_obj.df
-    df_ranged = df[(df['open_time'] >= start_date) & (df['close_time'] <= end_date)].reset_index(drop=True)
-    return Metrics(df_ranged, pd.DataFrame(), metrics_obj.currency)
+    """Returns a metric object from a metric object given a start date and end date to filter (see
+    'Metrics.between_dates')."""
+    return metrics_obj.between_dates(start_date, end_date)
 
 
 # Running this module as main loads a Trade object, creates metrics instance and prints dataframe and log all properties
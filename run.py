@@ -1,4 +1,19 @@
-from dash_apps.graphs import app
+from dash_apps.graphs import app, load_statement, follow_statement
+import argparse
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    parser = argparse.ArgumentParser(description='Trade analysis dash app')
+    parser.add_argument('statement', nargs='?', help='MT4 statement file displayed instead of the random data')
+    parser.add_argument('--follow', action='store_true',
+                        help='read the statement again every minute and add its new trades, while it keeps being '
+                             'exported during the trading day')
+    args = parser.parse_args()
+    if args.follow and not args.statement:
+        parser.error('--follow needs a statement')
+    if args.follow:
+        follow_statement(args.statement)
+    elif args.statement:
+        load_statement(args.statement)
+    # the reloader runs this module again in a child process, which would load the statement (and request its
+    # trades high and low) a second time
+    app.run(debug=True, use_reloader=not args.statement)
@@ -0,0 +1,160 @@
+from data_classes.mt4data import TraderMadeClient, Trade
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import datetime as dt
+import json
+import threading
+import time
+import pytest
+
+_HIGH, _LOW = 2.0, 0.5  # every stub bar, trades open at 1.0 and close at 1.1
+_SYMBOLS = ['EURUSD', 'GBPUSD', 'USDJPY', 'AUDUSD', 'USDCAD', 'NZDUSD', 'USDCHF', 'EURGBP', 'EURJPY', 'GBPJPY']
+
+
+class StubTradermade(ThreadingHTTPServer):
+    """Local 'timeseries' endpoint. Records the time and symbol of every request. 'failures[symbol]' requests of a
+    symbol get a 503 response first, symbols in 'malformed' get quotes that can't be read"""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _StubHandler)
+        self.requests = []
+        self.failures = {}
+        self.malformed = set()
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}/'
+
+    def count(self, symbol: str) -> int:
+        return sum(1 for _, requested in self.requests if requested == symbol)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        symbol = params['currency']
+        with self.server._lock:
+            self.server.requests.append((time.monotonic(), symbol))
+            failing = self.server.failures.get(symbol, 0) > 0
+            if failing:
+                self.server.failures[symbol] -= 1
+        if failing:
+            self._send(503, {'error': 'busy'})
+        elif symbol in self.server.malformed:
+            self._send(200, {'quotes': {'columns': ['date', 'high', 'low'], 'data': 'not rows'}})
+        else:
+            start = dt.datetime.strptime(params['start_date'], TraderMadeClient._TM_DATE_FORMAT_MINUTE)
+            end = dt.datetime.strptime(params['end_date'], TraderMadeClient._TM_DATE_FORMAT_MINUTE)
+            dates = [start + dt.timedelta(minutes=minute) for minute in range(int((end - start).total_seconds() // 60))]
+            self._send(200, {'quotes': {'columns': ['date', 'high', 'low'],
+                                        'data': [[str(date), _HIGH, _LOW] for date in dates]}})
+
+    def _send(self, status: int, body: dict):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = StubTradermade()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _trades(n: int) -> list[Trade]:
+    """Recent short trades (minute interval), one symbol each"""
+    now = dt.datetime.now().replace(second=0, microsecond=0)
+    trades = []
+    for order in range(n):
+        open_time = now - dt.timedelta(hours=order + 2)
+        close_time = open_time + dt.timedelta(minutes=30)
+        trades.append(Trade(order, open_time, 'buy', 1, _SYMBOLS[order % len(_SYMBOLS)], 1.0, 0, 0, close_time, 1.1,
+                            0, 0, 0, 0, delta_time=close_time - open_time))
+    return trades
+
+
+def _completed(trade: Trade) -> bool:
+    return (trade.high, trade.low) == (_HIGH, _LOW)
+
+
+def _fallback(trade: Trade) -> bool:
+    """High and low of a trade without market data: max and min of its open and close prices"""
+    return (trade.high, trade.low) == (1.1, 1.0)
+
+
+def test_completes_every_trade(stub):
+    trades = _trades(6)
+    progress = []
+    TraderMadeClient('key', base_url=stub.url).complete_trade_high_low_concurrently(
+        trades, requests_per_second=100, progress=lambda completed, total: progress.append((completed, total)))
+    assert all(_completed(trade) for trade in trades)
+    assert len(stub.requests) == 6
+    assert progress[-1] == (6, 6)
+
+
+def test_requests_are_rate_limited_without_initial_burst(stub):
+    rate = 20
+    TraderMadeClient('key', base_url=stub.url).complete_trade_high_low_concurrently(
+        _trades(8), max_concurrency=8, requests_per_second=rate)
+    times = sorted(requested for requested, _ in stub.requests)
+    assert len(times) == 8
+    # one token at start, then 'rate' per second: request i is sent i / rate seconds after the first one
+    assert times[-1] - times[0] >= 7 / rate * 0.9
+    assert times[1] - times[0] >= 1 / rate * 0.9
+
+
+def test_retryable_responses_are_retried(stub):
+    stub.failures['EURUSD'] = 2
+    trades = _trades(3)
+    TraderMadeClient('key', base_url=stub.url).complete_trade_high_low_concurrently(
+        trades, requests_per_second=100, max_retries=3, backoff=0.01)
+    assert all(_completed(trade) for trade in trades)
+    assert stub.count('EURUSD') == 3
+
+
+def test_gives_up_after_max_retries(stub):
+    stub.failures['EURUSD'] = 10
+    trades = _trades(3)
+    TraderMadeClient('key', base_url=stub.url).complete_trade_high_low_concurrently(
+        trades, requests_per_second=100, max_retries=2, backoff=0.01)
+    assert stub.count('EURUSD') == 3
+    assert _fallback(trades[0])
+    assert all(_completed(trade) for trade in trades[1:])
+
+
+def test_unexpected_error_does_not_stop_other_requests(stub):
+    stub.malformed.add('GBPUSD')
+    trades = _trades(3)
+    TraderMadeClient('key', base_url=stub.url).complete_trade_high_low_concurrently(
+        trades, requests_per_second=100, max_retries=3, backoff=0.01)
+    assert stub.count('GBPUSD') == 1  # not a connection error nor a retryable response, no retry
+    assert _fallback(trades[1])
+    assert _completed(trades[0]) and _completed(trades[2])
+
+
+def test_unreachable_server_falls_back_to_open_and_close_prices():
+    server = StubTradermade()
+    url = server.url
+    server.server_close()  # nothing listens on its port anymore
+    trades = _trades(2)
+    TraderMadeClient('key', base_url=url).complete_trade_high_low_concurrently(
+        trades, requests_per_second=100, max_retries=1, backoff=0.01)
+    assert all(_fallback(trade) for trade in trades)
+
+
+def test_concurrent_option_of_complete_trade_high_low(stub):
+    trades = _trades(10)
+    TraderMadeClient('key', base_url=stub.url).complete_trade_high_low(trades, coalesce=True, concurrent=True)
+    assert all(_completed(trade) for trade in trades)
+    assert len(stub.requests) == len({trade.symbol for trade in trades})  # one coalesced window per symbol
@@ -0,0 +1,87 @@
+from data_classes.benchmarks import synthetic_trade_rows, _STATEMENT_HEADER, _STATEMENT_FOOTER, _TRADE_ROW
+from data_classes.live import LiveMetrics, _StatementTail
+from data_classes.mt4data import FileParser, TradeData
+from data_classes.statistics_m import Metrics
+import numpy as np
+import pandas as pd
+import pytest
+
+_BALANCE_ROW = '<tr align=right><td title="deposit">{}</td><td class=msdate nowrap>{}</td><td>balance</td>' \
+               '<td colspan=10 align=left>deposit</td><td class=mspt>{}</td></tr>'
+
+
+@pytest.fixture(scope='module')
+def rows() -> list[list[str]]:
+    """Trade rows in close time order, as a live account exports them"""
+    return sorted(synthetic_trade_rows(400, seed=1), key=lambda row: row[8])
+
+
+def _write(path, rows: list[list[str]], header: str = _STATEMENT_HEADER, end: bool = True):
+    """Statement of the rows with a deposit before the trades 0, 150 and 315. end=False cuts it in the middle of its
+    last row"""
+    lines = []
+    for i, row in enumerate(rows):
+        if i in (0, 150, 315):
+            lines.append(_BALANCE_ROW.format(900 + i, row[1], '1 000.00'))
+        lines.append(_TRADE_ROW.format(*row))
+    text = header + '\n'.join(lines) + '\n' + _STATEMENT_FOOTER
+    path.write_text(text if end else text[:len(header) + len('\n'.join(lines)) - 40])
+
+
+def _assert_equals_full_read(live: LiveMetrics, path):
+    trade_data = TradeData(FileParser.from_filepath(str(path)), columnar=True)
+    trade_data.seed_high_low()
+    expected = Metrics.from_trade_data(trade_data)
+    pd.testing.assert_frame_equal(live.metrics.df, expected.df, check_categorical=False)
+    pd.testing.assert_frame_equal(live.metrics.balance_df, expected.balance_df)
+    for kpi in ('n_of_trades', 'net_income', 'win_rate', 'profit_factor', 'efficiency', 'max_runup', 'max_drawdown',
+                'consecutive_wins', 'consecutive_losses'):
+        assert np.isclose(getattr(live.kpis, kpi), getattr(expected, kpi)), kpi
+
+
+def test_live_refreshes_equal_metrics_of_the_whole_statement(tmp_path, rows):
+    path = tmp_path / 'statement.htm'
+    _write(path, rows[:300])
+    live = LiveMetrics.from_file(str(path))
+    for n in range(303, 331, 3):  # small batches: cross pairs (AUDCAD) need the rates of earlier trades
+        _write(path, rows[:n])
+        assert live.refresh() == 3
+    assert live.metrics.df['symbol'].dtype == 'category'
+    _assert_equals_full_read(live, path)
+
+
+def test_refresh_of_an_incomplete_statement_is_retried(tmp_path, rows):
+    path = tmp_path / 'statement.htm'
+    _write(path, rows[:300])
+    live = LiveMetrics.from_file(str(path))
+    _write(path, rows[:340], end=False)
+    assert live.refresh() == 0
+    _write(path, rows[:340])
+    assert live.refresh() == 40
+    _assert_equals_full_read(live, path)
+
+
+def test_only_rows_after_the_known_ones_are_read_again(tmp_path, rows):
+    path = tmp_path / 'statement.htm'
+    tail = _StatementTail(str(path))
+    _write(path, rows[:300])
+    assert tail.read(skip_orders=set())[1]
+    _write(path, rows[:310])
+    trade_data, full = tail.read(skip_orders=set())
+    assert not full and trade_data.n_of_trades == 10
+    assert tail.read(skip_orders=set()) == (None, False)
+
+    _write(path, rows[:320], header=_STATEMENT_HEADER.replace('June 12', 'September 12'))
+    trade_data, full = tail.read(skip_orders=set())  # rows are found from the end of the (longer) header
+    assert not full and trade_data.n_of_trades == 10
+    _write(path, rows[:5] + rows[6:320])
+    assert tail.read(skip_orders=set())[1]  # a known row removed
+
+
+def test_live_statement_with_a_changed_header_equals_the_whole_statement(tmp_path, rows):
+    path = tmp_path / 'statement.htm'
+    _write(path, rows[:300])
+    live = LiveMetrics.from_file(str(path))
+    _write(path, rows[:320], header=_STATEMENT_HEADER.replace('June 12', 'September 12'))
+    assert live.refresh() == 20
+    _assert_equals_full_read(live, path)
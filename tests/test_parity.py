@@ -0,0 +1,94 @@
+from data_classes.benchmarks import (synthetic_statement, synthetic_trade_rows, synthetic_metrics_frame, _row_max_gain,
+                                     _row_pips, _STATEMENT_HEADER, _STATEMENT_FOOTER, _TRADE_ROW)
+from data_classes.mt4data import FileParser, TradeData
+from data_classes.statistics_m import Metrics
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def _statement(rows: list[list[str]]) -> str:
+    return _STATEMENT_HEADER + '\n'.join(_TRADE_ROW.format(*row) for row in rows) + '\n' + _STATEMENT_FOOTER
+
+
+@pytest.fixture(scope='module')
+def metrics() -> Metrics:
+    return Metrics(synthetic_metrics_frame(2_000), pd.DataFrame(), 'USD')
+
+
+def test_fast_tokenizer_rows_equal_beautifulsoup_rows():
+    statement = synthetic_statement(500)
+    assert FileParser(statement).get_operations_info() == \
+        FileParser(statement, fast_tokenizer=False).get_operations_info()
+
+
+def test_fast_tokenizer_reads_quoted_greater_than_in_attributes():
+    line = '<tr><td title="a>b">1</td><td class=\'x>y\'><b title="q>r">EUR</b>&nbsp;</td><td>3</td></tr>'
+    assert FileParser._tokenize_td(line) == FileParser._parse_td(line) == ['1', 'EUR\xa0', '3']
+
+
+def test_columnar_trade_data_equals_trade_objects():
+    statement = synthetic_statement(500)
+    columnar, objects = TradeData(FileParser(statement), columnar=True), TradeData(FileParser(statement))
+    pd.testing.assert_frame_equal(columnar.frame, objects.frame, check_dtype=False, check_categorical=False)
+    pd.testing.assert_frame_equal(Metrics.from_trade_data(columnar).df, Metrics.from_trade_data(objects).df,
+                                  check_dtype=False, check_categorical=False)
+
+
+def test_vectorized_metrics_columns_equal_row_by_row_columns(metrics):
+    rows = [row for _, row in metrics.df.head(200).iterrows()]
+    assert metrics.df['max_possible_gain'].head(200).tolist() == [round(_row_max_gain(metrics, row), 2) for row in rows]
+    assert metrics.df['max_possible_loss'].head(200).tolist() == \
+        [round(_row_max_gain(metrics, row, max_loss=True), 2) for row in rows]
+    assert metrics.df['pips'].head(200).tolist() == [_row_pips(row) for row in rows]
+
+
+def test_kpi_range_index_equals_metrics_of_window_trades(metrics):
+    rng = np.random.default_rng(0)
+    close_times = metrics.df['close_time']
+    bounds = np.sort(rng.integers(0, len(close_times), (20, 2)), axis=1)
+    starts, ends = close_times.to_numpy()[bounds[:, 0]], close_times.to_numpy()[bounds[:, 1]]
+    kpis = metrics.range_kpis(starts, ends)
+    for i in range(len(starts)):
+        window = metrics.df[(close_times >= starts[i]) & (close_times <= ends[i])].reset_index(drop=True)
+        window['cum_profit'] = window['profit'].cumsum()
+        expected = Metrics.view(window, pd.DataFrame(), 'USD')
+        for kpi in ('n_of_trades', 'net_income', 'win_rate', 'expectancy', 'profit_factor', 'max_runup',
+                    'max_drawdown'):
+            assert np.isclose(kpis[kpi][i], getattr(expected, kpi)), (kpi, i)
+
+
+def test_grouped_kpis_equal_metrics_of_group_trades(metrics):
+    df = metrics.df[(metrics.df['symbol'] != 'EURUSD') | metrics.df['won_trade']].reset_index(drop=True)
+    grouped = Metrics.view(df, pd.DataFrame(), 'USD').grouped_kpis('symbol')
+    for symbol, kpis in grouped.iterrows():
+        group = df[df['symbol'] == symbol].reset_index(drop=True)
+        group['cum_profit'] = group['profit'].cumsum()
+        expected = Metrics.view(group, pd.DataFrame(), 'USD')
+        for kpi in ('n_of_trades', 'net_income', 'win_rate', 'profit_factor', 'efficiency', 'max_runup',
+                    'max_drawdown'):
+            assert np.isclose(kpis[kpi], getattr(expected, kpi)), (symbol, kpi)
+    assert grouped.loc['EURUSD', 'profit_factor'] == np.inf  # no losses, as 'Metrics.profit_factor'
+
+
+@pytest.mark.parametrize('columnar', [True, False])
+def test_merge_keeps_known_trades_and_records_conflicts_once(columnar):
+    rows = synthetic_trade_rows(300)
+    changed = [list(row) for row in rows[100:200]]
+    changed[5][-1] = '12345.00'  # profit of an order already known
+    repeated = [list(row) for row in rows[250:260]]
+    repeated[0][-1] = '999.00'  # order repeated in the merged statement with another profit
+    trade_data = TradeData(FileParser(_statement(rows[:150])), columnar=columnar)
+    merged = _statement(changed + rows[200:260] + repeated)
+
+    new = trade_data.merge(TradeData(FileParser(merged), columnar=columnar))
+    assert len(new) == 110
+    assert trade_data.n_of_trades == 260 and trade_data.frame['order'].is_unique
+    conflicts = dict(trade_data.merge_conflicts)
+    assert set(conflicts) == {int(rows[105][0]), int(rows[250][0])}
+    assert conflicts[int(rows[105][0])]['profit'][1] == 12345.0
+    assert trade_data.frame.set_index('order').loc[int(rows[105][0]), 'profit'] == float(rows[105][-1])
+
+    trade_data.merge(TradeData(FileParser(merged), columnar=columnar))
+    assert trade_data.n_of_trades == 260
+    assert len(trade_data.merge_conflicts) == 2